@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import socket
+import threading
+import time
+import paramiko
+import logging
+
+# the server side of dropped or closed connections is expected here, so keep it out of the pipeline code's log output
+logging.getLogger("paramiko.standin").setLevel(logging.CRITICAL)
+
+# local stand-in for TranscribeMe's SFTP server, so that the push and pull code can be exercised (and timed) without the live sftp.transcribeme.com host
+# serves a local folder with the same audio/ and output/ layout TranscribeMe uses, accepting any username and password
+# every SFTP request can be given an added latency (and each read/write chunk a separate delay, to limit throughput),
+# and connections can be dropped after every so many requests, to check retry behaviour
+# counts of each type of request received are kept, to report round trips
+
+class StandinSFTPServer:
+	def __init__(self, root, port=0, latency=0.0, chunk_delay=0.0, drop_every=0):
+		self.root = os.path.abspath(root)
+		self.latency = latency # seconds added to every request
+		self.chunk_delay = chunk_delay # seconds added to every read or write of a file chunk
+		self.drop_every = drop_every # drop the connection on every nth request, 0 to never drop
+		self.host_key = paramiko.RSAKey.generate(2048)
+		self.request_counts = {}
+		self.connection_count = 0
+		self.dropped_count = 0
+		self.lock = threading.Lock()
+		for folder in ["audio", "output"]:
+			if not os.path.isdir(os.path.join(self.root, folder)):
+				os.makedirs(os.path.join(self.root, folder))
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(("127.0.0.1", port))
+		self.port = self.sock.getsockname()[1] # port 0 picks a free one
+		self.transports = []
+
+	def start(self):
+		self.sock.listen(50)
+		threading.Thread(target=self.accept_loop, daemon=True).start()
+		return self
+
+	def stop(self):
+		self.sock.close()
+		for transport in self.transports:
+			transport.close()
+
+	def accept_loop(self):
+		while True:
+			try:
+				conn, addr = self.sock.accept()
+			except OSError:
+				return # socket closed by stop
+			transport = paramiko.Transport(conn)
+			transport.set_log_channel("paramiko.standin")
+			transport.add_server_key(self.host_key)
+			transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StandinSFTPInterface)
+			self.transports.append(transport)
+			with self.lock:
+				self.connection_count = self.connection_count + 1
+			transport.start_server(server=StandinServerInterface(self, transport))
+
+	# called on every request - counts it, adds the latency, and returns False if the connection was dropped instead
+	def request(self, kind, transport, delay=None):
+		with self.lock:
+			self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+			drop = self.drop_every > 0 and sum(self.request_counts.values()) % self.drop_every == 0
+			if drop:
+				self.dropped_count = self.dropped_count + 1
+		if drop:
+			transport.close()
+			return False
+		delay = self.latency if delay is None else delay
+		if delay > 0:
+			time.sleep(delay)
+		return True
+
+	def reset_counts(self):
+		with self.lock:
+			self.request_counts = {}
+			self.connection_count = 0
+			self.dropped_count = 0
+
+	def local_path(self, path):
+		return os.path.join(self.root, os.path.normpath("/" + path).lstrip("/"))
+
+class StandinServerInterface(paramiko.ServerInterface):
+	def __init__(self, standin, transport):
+		self.standin = standin
+		self.transport = transport
+
+	def get_allowed_auths(self, username):
+		return "password"
+
+	def check_auth_password(self, username, password):
+		return paramiko.AUTH_SUCCESSFUL
+
+	def check_channel_request(self, kind, chanid):
+		if kind == "session":
+			return paramiko.OPEN_SUCCEEDED
+		return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+class StandinSFTPHandle(paramiko.SFTPHandle):
+	def __init__(self, standin, transport, flags):
+		super().__init__(flags)
+		self.standin = standin
+		self.transport = transport
+
+	def read(self, offset, length):
+		if not self.standin.request("read", self.transport, delay=self.standin.chunk_delay):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		return super().read(offset, length)
+
+	def write(self, offset, data):
+		if not self.standin.request("write", self.transport, delay=self.standin.chunk_delay):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		return super().write(offset, data)
+
+	def stat(self):
+		if not self.standin.request("stat", self.transport):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		try:
+			return paramiko.SFTPAttributes.from_stat(os.fstat(getattr(self, "readfile", getattr(self, "writefile", None)).fileno()))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+class StandinSFTPInterface(paramiko.SFTPServerInterface):
+	def __init__(self, server, *args, **kwargs):
+		super().__init__(server, *args, **kwargs)
+		self.standin = server.standin
+		self.transport = server.transport
+
+	def list_folder(self, path):
+		if not self.standin.request("listdir", self.transport):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		try:
+			folder = self.standin.local_path(path)
+			attrs = []
+			for filename in os.listdir(folder):
+				cur_attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(folder, filename)))
+				cur_attr.filename = filename
+				attrs.append(cur_attr)
+			return attrs
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def stat(self, path):
+		if not self.standin.request("stat", self.transport):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		try:
+			return paramiko.SFTPAttributes.from_stat(os.stat(self.standin.local_path(path)))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def lstat(self, path):
+		return self.stat(path)
+
+	def open(self, path, flags, attr):
+		if not self.standin.request("open", self.transport):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		try:
+			fd = os.open(self.standin.local_path(path), flags, 0o644)
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		if flags & os.O_WRONLY:
+			mode = "ab" if flags & os.O_APPEND else "wb"
+		elif flags & os.O_RDWR:
+			mode = "a+b" if flags & os.O_APPEND else "r+b"
+		else:
+			mode = "rb"
+		cur_file = os.fdopen(fd, mode)
+		handle = StandinSFTPHandle(self.standin, self.transport, flags)
+		handle.filename = self.standin.local_path(path)
+		if mode != "wb" and mode != "ab":
+			handle.readfile = cur_file
+		if mode != "rb":
+			handle.writefile = cur_file
+		return handle
+
+	def remove(self, path):
+		return self.file_operation("remove", os.remove, path)
+
+	def rename(self, oldpath, newpath):
+		return self.file_operation("rename", os.rename, oldpath, newpath)
+
+	def mkdir(self, path, attr):
+		return self.file_operation("mkdir", os.mkdir, path)
+
+	def rmdir(self, path):
+		return self.file_operation("rmdir", os.rmdir, path)
+
+	def file_operation(self, kind, function, *paths):
+		if not self.standin.request(kind, self.transport):
+			return paramiko.sftp.SFTP_CONNECTION_LOST
+		try:
+			function(*[self.standin.local_path(x) for x in paths])
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		return paramiko.sftp.SFTP_OK
+
+if __name__ == '__main__':
+	# run the stand-in server on its own until interrupted
+	# usage: python sftp_standin_server.py root_folder [port, default 2222] [latency seconds, default 0] [drop every n requests, default 0 for never]
+	try:
+		port = int(sys.argv[2])
+	except:
+		port = 2222
+	try:
+		latency = float(sys.argv[3])
+	except:
+		latency = 0.0
+	try:
+		drop_every = int(sys.argv[4])
+	except:
+		drop_every = 0
+	server = StandinSFTPServer(sys.argv[1], port=port, latency=latency, drop_every=drop_every).start()
+	print("Stand-in SFTP server serving " + server.root + " on 127.0.0.1 port " + str(server.port))
+	try:
+		while True:
+			time.sleep(60)
+	except KeyboardInterrupt:
+		server.stop()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# the push and pull functions live with the rest of the subject level pipeline code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "site_level_pipeline_branches", "subject_level_functions"))
+from transcribeme_sftp_session import TranscribeMeSession
+from journal_transcribeme_sftp_push import site_transcript_push
+from journal_transcribeme_sftp_pull import site_transcript_pull
+from sftp_standin_server import StandinSFTPServer
+
+# end to end benchmark of the TranscribeMe push and pull code against the local stand-in SFTP server
+# sets up a synthetic site with some subjects' WAVs waiting in audio_to_send, pushes them all over one site-wide session,
+# then plays the part of TranscribeMe by dropping a txt into output for each uploaded WAV, and pulls them all back
+# reports time, throughput, SSH handshakes, retried failures, and the SFTP requests the server saw of each type for both steps,
+# before checking that every file ended up in the expected place locally and on the server
+# note pysftp 0.2.9 (as used by the pipeline) needs paramiko below 4, as pinned in the setup environment
+
+SITE = "PronetLA"
+LANGUAGE = "English"
+
+# makes the synthetic PHOENIX structure for the site under data_root, with num_files random WAVs of file_bytes each in audio_to_send for num_subjects subjects
+def make_site_data(data_root, num_subjects, num_files, file_bytes):
+	for i in range(num_subjects):
+		subject = "LA" + str(i + 1).zfill(5)
+		to_send = os.path.join(data_root, "PROTECTED", SITE, "processed", subject, "phone", "audio_journals", "audio_to_send")
+		os.makedirs(to_send)
+		for day in range(num_files):
+			with open(os.path.join(to_send, SITE + "_" + subject + "_audioJournal_day" + str(day + 1).zfill(4) + "_submission1.wav"), "wb") as f:
+				f.write(os.urandom(file_bytes))
+
+# stands in for the transcription itself - every WAV in the server's audio folder gets a matching txt in output
+def transcribe_uploads(server_root):
+	for filename in os.listdir(os.path.join(server_root, "audio")):
+		with open(os.path.join(server_root, "output", filename.split(".wav")[0] + ".txt"), "w") as f:
+			f.write("Speaker 1: 00:00:00.000 This is a placeholder transcript.\n")
+
+# returns the number of files in every subject's subfolder of the given name
+def count_subject_files(data_root, folder):
+	processed_folder = os.path.join(data_root, "PROTECTED", SITE, "processed")
+	total = 0
+	for subject in os.listdir(processed_folder):
+		cur_folder = os.path.join(processed_folder, subject, "phone", "audio_journals", folder)
+		if os.path.isdir(cur_folder):
+			total = total + len(os.listdir(cur_folder))
+	return total
+
+# returns the number of files in folder, 0 if it was never made (e.g. the archive folder when every pull attempt failed)
+def count_files(folder):
+	return len(os.listdir(folder)) if os.path.isdir(folder) else 0
+
+# runs one site level step (push or pull) over its own session against server, then prints the measurements for it
+def run_step(name, step_function, server, total_bytes):
+	server.reset_counts()
+	session = TranscribeMeSession("standin", "standin", host="127.0.0.1", port=server.port, retry_delay=0.1)
+	start_time = time.time()
+	try:
+		step_function(session)
+	finally:
+		session.close()
+	elapsed = time.time() - start_time
+	print(name + ": " + str(round(elapsed, 3)) + " seconds, " + str(round(total_bytes / 1e6 / elapsed, 3)) + " MB/s")
+	print("	" + str(session.handshake_count) + " SSH handshake(s) taking " + str(round(session.handshake_seconds, 3)) + " seconds, " + str(session.failed_attempts) + " failed attempt(s) retried, " + str(server.dropped_count) + " connection(s) dropped by server")
+	print("	SFTP requests - " + ", ".join([x + ": " + str(server.request_counts[x]) for x in sorted(server.request_counts)]) + " (total " + str(sum(server.request_counts.values())) + ")")
+
+def benchmark_transfers(num_subjects, num_files, file_bytes, latency, drop_every, upload_workers):
+	work_folder = tempfile.mkdtemp()
+	try:
+		data_root = os.path.join(work_folder, "PHOENIX")
+		server_root = os.path.join(work_folder, "transcribeme")
+		make_site_data(data_root, num_subjects, num_files, file_bytes)
+		server = StandinSFTPServer(server_root, latency=latency, drop_every=drop_every).start()
+		total_files = num_subjects * num_files
+		print("Benchmarking " + str(total_files) + " WAVs of " + str(file_bytes) + " bytes from " + str(num_subjects) + " subjects, with " + str(latency) + " seconds latency per request, " +
+			  ("no dropped connections" if drop_every == 0 else "a connection dropped every " + str(drop_every) + " requests") + ", and " + str(upload_workers) + " upload worker(s)")
+		try:
+			# the pipeline code changes directories as it goes, so put the working directory back after each step
+			cur_dir = os.getcwd()
+			run_step("push", lambda session: site_transcript_push(data_root, SITE, "standin", "standin", LANGUAGE, upload_workers=upload_workers, session=session), server, total_files * file_bytes)
+			os.chdir(cur_dir)
+			transcribe_uploads(server_root)
+			transcript_bytes = sum([os.path.getsize(os.path.join(server_root, "output", x)) for x in os.listdir(os.path.join(server_root, "output"))])
+			run_step("pull", lambda session: site_transcript_pull(data_root, SITE, "standin", "standin", LANGUAGE, session=session), server, transcript_bytes)
+			os.chdir(cur_dir)
+		finally:
+			server.stop()
+
+		# everything should have made it through the whole round trip
+		checks = [("audio left in audio_to_send", count_subject_files(data_root, "audio_to_send"), 0),
+				  ("audio left in pending_audio", count_subject_files(data_root, "pending_audio"), 0),
+				  ("audio moved to completed_audio", count_subject_files(data_root, "completed_audio"), total_files),
+				  ("transcripts pulled", count_subject_files(data_root, "transcripts"), total_files),
+				  ("audio left on server", len(os.listdir(os.path.join(server_root, "audio"))), 0),
+				  ("transcripts archived on server", count_files(os.path.join(server_root, "output", SITE + "_journals_archive")), total_files)]
+		for check_name, count, expected in checks:
+			print(check_name + ": " + str(count) + ("" if count == expected else " - WARNING: expected " + str(expected)))
+	finally:
+		shutil.rmtree(work_folder, ignore_errors=True)
+
+if __name__ == '__main__':
+	# usage: python sftp_transfer_benchmark.py [subjects, default 5] [WAVs per subject, default 10] [bytes per WAV, default 1000000]
+	#                                          [latency seconds per request, default 0.02] [drop a connection every n requests, default 0 for never] [upload workers, default 1]
+	try:
+		num_subjects = int(sys.argv[1])
+	except:
+		num_subjects = 5
+	try:
+		num_files = int(sys.argv[2])
+	except:
+		num_files = 10
+	try:
+		file_bytes = int(sys.argv[3])
+	except:
+		file_bytes = 1000000
+	try:
+		latency = float(sys.argv[4])
+	except:
+		latency = 0.02
+	try:
+		drop_every = int(sys.argv[5])
+	except:
+		drop_every = 0
+	try:
+		upload_workers = int(sys.argv[6])
+	except:
+		upload_workers = 1
+	benchmark_transfers(num_subjects, num_files, file_bytes, latency, drop_every, upload_workers)
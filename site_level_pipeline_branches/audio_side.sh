@@ -19,6 +19,48 @@ repo_root="$pipelines_root"/..
 
 # running config file will set up necessary environment variables
 source "$config_path"
+# optional performance settings do not need to be in the config file, fall back to defaults when they are missing
+if [[ -z $audio_qc_workers ]]; then
+	audio_qc_workers=1 # number of processes to use for audio QC feature computation
+fi
+if [[ -z $audio_qc_streaming ]]; then
+	audio_qc_streaming="N" # if "Y", audio QC reads WAVs in fixed size blocks instead of loading each one fully
+fi
+if [[ -z $flatness_engine ]]; then
+	flatness_engine="numpy" # "librosa" to compute spectral flatness with the librosa package instead of the built-in version
+fi
+if [[ -z $skip_rejected_flatness ]]; then
+	skip_rejected_flatness="N" # if "Y", diaries rejected based on length or submission number will not get a mean_flatness value
+fi
+if [[ -z $fused_audio_qc ]]; then
+	fused_audio_qc="N" # if "Y", journal MP3s are decoded and QCed in one step, skipping the intermediate temp_audio WAVs
+fi
+if [[ -z $conversion_workers ]]; then
+	conversion_workers=1 # number of ffmpeg MP3 to WAV conversions to run at once
+fi
+if [[ -z $conversion_timeout ]]; then
+	conversion_timeout=0 # seconds before a single ffmpeg conversion is abandoned, 0 for no limit
+fi
+if [[ -z $audio_qc_cache_size ]]; then
+	audio_qc_cache_size=0 # max number of entries in each subject's audio QC result cache, 0 to not cache
+fi
+if [[ -z $extra_audio_features ]]; then
+	extra_audio_features="N" # if "Y", audio QC also reports silence ratio, clipping fraction, SNR estimate, and speech band energy ratio
+fi
+if [[ -z $pooled_sftp_session ]]; then
+	pooled_sftp_session="N" # if "Y", TranscribeMe pushes for all subjects happen at the end over one SFTP session instead of one per subject
+fi
+if [[ -z $sftp_upload_workers ]]; then
+	sftp_upload_workers=1 # number of audio files to upload to TranscribeMe at once, each over its own SFTP channel
+fi
+if [[ -z $diary_ledger ]]; then
+	diary_ledger="N" # if "Y", diary progress is tracked in a per-subject SQLite ledger instead of raw_file_tracking_system marker files
+fi
+if [[ -z $subject_watermarks ]]; then
+	subject_watermarks="N" # if "Y", subjects whose raw phone files have not changed since their last completed run are skipped before any python is started
+fi
+# helpers for the change detection watermarks
+source "$func_root"/subject_watermark.sh
 
 # make directory for logs if needed
 if [[ ! -d ${repo_root}/logs ]]; then
@@ -99,6 +141,16 @@ for p in *; do
 		echo ""
 		continue
 	fi
+	# with watermarks on, also skip any subject whose raw phone files (and consent record) are unchanged since its last completed run
+	if [[ $subject_watermarks == "Y" ]]; then
+		audio_watermark_path="$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/file_accounting_details/"$site"_"$p"_audioSideWatermark.txt
+		cur_watermark="$(subject_watermark "$data_root"/PROTECTED/"$site"/raw/"$p"/phone), consent record checksum $(grep -F "$p" "$data_root"/PROTECTED/"$site"/"$site"_metadata.csv | md5sum | cut -d " " -f 1)"
+		if watermark_unchanged "$audio_watermark_path" "$cur_watermark"; then
+			echo "${p} has no changes to raw phone data since its last completed run, continuing to next subject"
+			echo ""
+			continue
+		fi
+	fi
 	cd "$p"/phone
 	app_count=$(ls -1 *activity*.json | wc -l)
 	if [[ $app_count == 0 ]]; then
@@ -125,16 +177,20 @@ for p in *; do
 	echo "Starting JSON accounting update for subject ${p}"
 	now=$(date +"%T")
 	echo "Current time: ${now}"
-	python "$func_root"/mindlamp_accounting.py "$data_root" "$site" "$p" "$timezone" "$transcription_language"
+	python "$func_root"/mindlamp_accounting.py "$data_root" "$site" "$p" "$timezone" "$transcription_language" "$diary_ledger"
 	echo "Accounting done for subject ${p}"
 	now=$(date +"%T")
 	echo "Current time: ${now}"
 
 	# next need to do the actual conversion to WAV!
 	# first confirm that any journals were actually recognized before bothering to proceed (may be EMA only)
-	if [[ ! -d "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/raw_file_tracking_system ]]; then
+	# (subjects on the diary ledger have the ledger file in place of the raw_file_tracking_system folder)
+	if [[ ! -d "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/raw_file_tracking_system ]] && [[ ! -f "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/diary_ledger.sqlite3 ]]; then
 		echo "${p} has no audio journal submission records found, continuing to next subject"
 		echo ""
+		if [[ $subject_watermarks == "Y" ]]; then
+			save_watermark "$audio_watermark_path" "$cur_watermark"
+		fi
 		cd "$data_root"/PROTECTED/"$site"/raw # return to top before continuing
 		continue
 	fi
@@ -142,42 +198,37 @@ for p in *; do
 	if [[ ! -d temp_audio ]]; then
 		mkdir temp_audio
 	fi
-	cd raw_file_tracking_system
-	new_audio_count=$(ls -1 TODO+*.txt | wc -l)
+	if [[ -f diary_ledger.sqlite3 ]]; then
+		new_audio_count=$(python "$func_root"/diary_ledger.py "$data_root" "$site" "$p" todo)
+	else
+		new_audio_count=$(ls -1 raw_file_tracking_system/TODO+*.txt | wc -l)
+	fi
 	# also will be nothing more to do on audio side of pipeline if there are no new filepaths set aside for processing
 	if [[ $new_audio_count == 0 ]]; then
 		echo "${p} has not submitted any new audio journals since last processing time, continuing to next subject"
 		echo ""
-		cd ..
 		rm -rf temp_audio
+		if [[ $subject_watermarks == "Y" ]]; then
+			save_watermark "$audio_watermark_path" "$cur_watermark"
+		fi
 		cd "$data_root"/PROTECTED/"$site"/raw # return to top before continuing
 		continue
 	fi
 
-	echo "Starting conversion of newly detected journal MP3s to renamed WAVs for subject ${p}"
-	now=$(date +"%T")
-	echo "Current time: ${now}"
-	for file in TODO+*.txt; do
-		# get raw path from filename, get processed path from file contents, convert it to wav in correct location (temp for now), rename txt file to remove TODO once that is confirmed
-		cur_raw_file=$(echo "$file" | awk -F 'ODO[+]' '{print $2}') 
-		cur_raw_name=$(echo "$cur_raw_file" | awk -F '.txt' '{print $1}') 
-		raw_mp3_name="$cur_raw_name".mp3
-		input_path="$data_root"/PROTECTED/"$site"/raw/"$p"/phone/"$raw_mp3_name"
-		output_name=$(cat ${file})
-		ffmpeg -i "$input_path" ../temp_audio/"$output_name" &> /dev/null
-
-		if [[ -e "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/temp_audio/"$output_name" ]]; then
-			# confirm the converted file was created to then remove this diary from TODO
-			mv "$file" "$cur_raw_file"
-		else
-			echo "WARNING: issue with WAV conversion detected for ${cur_raw_name}"
-		fi
-	done
+	# when the fused audio QC mode is on, MP3s are decoded directly by the QC step below instead, which writes the WAVs to temp_audio itself
+	if [[ $fused_audio_qc != "Y" ]]; then
+		echo "Starting conversion of newly detected journal MP3s to renamed WAVs for subject ${p}"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
+		# conversion scheduler runs up to conversion_workers ffmpeg processes at once, with optional per-file timeout in seconds
+		# - it renames a TODO marker only once the WAV is confirmed written to temp_audio, and logs the time taken for each file
+		python "$func_root"/journal_mp3_conversion.py "$data_root" "$site" "$p" "$conversion_workers" "$conversion_timeout"
+	fi
 	echo "Setup of new audio files on processed side has now been completed for subject ${p}"
 	now=$(date +"%T")
 	echo "Current time: ${now}"
 
-	cd ..
+	cd "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals
 	# now need to do the processing steps on the set aside diary WAVs
 	echo "Beginning audio QC on new diaries from subject ${p}"
 	now=$(date +"%T")
@@ -198,11 +249,24 @@ for p in *; do
 
 	# main audio QC function 
 	# - also handles the selection process for transcript upload when the db and length cutoff arguments are provided like they are here
-	python "$func_root"/audio_diary_qc.py "$data_root" "$site" "$p" "$db_cutoff" "$length_cutoff"
+	if [[ $fused_audio_qc == "Y" ]]; then
+		# fused version does the MP3 conversion at the same time, renaming TODO markers (and moving WAVs out of temp_audio) only once the QC rows are saved
+		python "$func_root"/journal_mp3_fused_qc.py "$data_root" "$site" "$p" "$db_cutoff" "$length_cutoff" "$audio_qc_workers" "$flatness_engine" "$skip_rejected_flatness" "$extra_audio_features"
+	else
+		python "$func_root"/audio_diary_qc.py "$data_root" "$site" "$p" "$db_cutoff" "$length_cutoff" "$audio_qc_workers" "$audio_qc_streaming" "$flatness_engine" "$skip_rejected_flatness" "$audio_qc_cache_size" "$extra_audio_features"
+	fi
 
 	echo "Audio QC finished for new diaries from subject ${p}"
 	now=$(date +"%T")
 	echo "Current time: ${now}"
+	# the watermark is only saved for this run once nothing is left to convert, so that failed conversions are still retried on the next run
+	if [[ $subject_watermarks == "Y" ]]; then
+		if [[ -f diary_ledger.sqlite3 ]]; then
+			todo_left=$(python "$func_root"/diary_ledger.py "$data_root" "$site" "$p" todo)
+		else
+			todo_left=$(ls -1 raw_file_tracking_system/TODO+*.txt 2> /dev/null | wc -l)
+		fi
+	fi
 
 	# if anything left in temp_audio at this point signals a potential problem, handle that file management
 	if [ ! -z "$(ls -A temp_audio)" ]; then
@@ -223,6 +287,9 @@ for p in *; do
 		rm -rf audio_to_send # if it is empty, clear it out!
 		echo "${p} had no new audio journals acceptable for transcription upload, continuing to next subject"
 		echo ""
+		if [[ $subject_watermarks == "Y" ]] && [[ $todo_left == 0 ]]; then
+			save_watermark "$audio_watermark_path" "$cur_watermark"
+		fi
 		cd "$data_root"/PROTECTED/"$site"/raw # return to top before continuing
 		continue
 	fi
@@ -233,26 +300,34 @@ for p in *; do
 			mkdir pending_audio
 		fi
 	
-		echo "Sending accepted audio journals from subject ${p} to TranscribeMe"
-		now=$(date +"%T")
-		echo "Current time: ${now}"
+		if [[ $pooled_sftp_session == "Y" ]]; then
+			# audio is left in to_send for now, the pooled session at the end of the site will push it along with everything else
+			echo "Accepted audio journals from subject ${p} will be sent to TranscribeMe with the rest of the site once all subjects are processed"
+		else
+			echo "Sending accepted audio journals from subject ${p} to TranscribeMe"
+			now=$(date +"%T")
+			echo "Current time: ${now}"
 
-		# next script will go through the files in to_send and send them to transcribeme, moving them to pending_audio if push was successful
-		python "$func_root"/journal_transcribeme_sftp_push.py "$data_root" "$site" "$p" "$transcribeme_username" "$transcribeme_password" "$transcription_language"
+			# next script will go through the files in to_send and send them to transcribeme, moving them to pending_audio if push was successful
+			python "$func_root"/journal_transcribeme_sftp_push.py "$data_root" "$site" "$p" "$transcribeme_username" "$transcribeme_password" "$transcription_language" "$sftp_upload_workers"
 
-		echo "TranscribeMe SFTP push complete for subject ${p}"
-		now=$(date +"%T")
-		echo "Current time: ${now}"
+			echo "TranscribeMe SFTP push complete for subject ${p}"
+			now=$(date +"%T")
+			echo "Current time: ${now}"
 
-		# check if to_send is empty now - if so delete it, if not print an error message
-		if [ -z "$(ls -A audio_to_send)" ]; then
-			rm -rf audio_to_send
-		else
-			echo "WARNING: some diaries from subject ${p} meant to be pushed to TranscribeMe failed to upload. Check ${data_root}/PROTECTED/${site}/processed/${p}/phone/audio_journals/audio_to_send for more info."
+			# check if to_send is empty now - if so delete it, if not print an error message
+			if [ -z "$(ls -A audio_to_send)" ]; then
+				rm -rf audio_to_send
+			else
+				echo "WARNING: some diaries from subject ${p} meant to be pushed to TranscribeMe failed to upload. Check ${data_root}/PROTECTED/${site}/processed/${p}/phone/audio_journals/audio_to_send for more info."
+			fi
 		fi
 	else
 		echo "TranscribeMe SFTP push turned off for this run, leaving all approved audio in corresponding audio_to_send folder for subject ${p}"
 	fi
+	if [[ $subject_watermarks == "Y" ]] && [[ $todo_left == 0 ]]; then
+		save_watermark "$audio_watermark_path" "$cur_watermark"
+	fi
 
 	cd "$data_root"/PROTECTED/"$site"/raw # at end of loop go back to start spot
 	echo "${p} has completed new audio journal processing!"
@@ -272,20 +347,33 @@ echo "Current time: ${now}"
 if [ $auto_send_on = "Y" ] || [ $auto_send_on = "y" ]; then
 	cd "$data_root"/PROTECTED/"$site"/processed
 	echo ""
-	echo "Double checking for failed TranscribeMe SFTP uploads (audio left from prior day perhaps)"
+	if [[ $pooled_sftp_session == "Y" ]]; then
+		# with the site keyword in place of a subject ID the push script goes through every subject with audio in to_send (including any left from a prior day), over one SFTP session
+		echo "Sending all accepted audio journals for the site to TranscribeMe over one SFTP session"
+		python "$func_root"/journal_transcribeme_sftp_push.py "$data_root" "$site" site "$transcribeme_username" "$transcribeme_password" "$transcription_language" "$sftp_upload_workers"
+		echo ""
+		echo "Checking for failed TranscribeMe SFTP uploads"
+	else
+		echo "Double checking for failed TranscribeMe SFTP uploads (audio left from prior day perhaps)"
+	fi
 	for p in *; do
 		if [[ ! -d $p/phone/audio_journals/audio_to_send ]]; then
 			continue
 		fi
 		cd "$p"/phone/audio_journals
 		if [ -z "$(ls -A audio_to_send)" ]; then
+			if [[ $pooled_sftp_session == "Y" ]]; then
+				rm -rf audio_to_send # everything was pushed by the pooled session
+			fi
 			cd "$data_root"/PROTECTED/"$site"/processed
 			continue
 		fi
 
-		echo ""
-		echo "Audio to push found for subject ${p}, calling SFTP python function"
-		python "$func_root"/journal_transcribeme_sftp_push.py "$data_root" "$site" "$p" "$transcribeme_username" "$transcribeme_password" "$transcription_language"
+		if [[ $pooled_sftp_session != "Y" ]]; then
+			echo ""
+			echo "Audio to push found for subject ${p}, calling SFTP python function"
+			python "$func_root"/journal_transcribeme_sftp_push.py "$data_root" "$site" "$p" "$transcribeme_username" "$transcribeme_password" "$transcription_language" "$sftp_upload_workers"
+		fi
 
 		# check if to_send is empty now - if so delete it, if not print an error message
 		if [ -z "$(ls -A audio_to_send)" ]; then
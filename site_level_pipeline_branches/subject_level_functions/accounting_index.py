@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import os
+import pandas as pd
+
+# shared helpers for looking up a diary's record in a subject's audioJournalJSONRecordsInfo.csv accounting file
+# the QC scripts used to filter the full accounting DF with a boolean mask for every file, which scales with (new files x all records to date)
+# instead the CSV is read once and indexed by (assigned_study_day, adjusted_sound_number), so each lookup is a single dict access
+
+# load the accounting CSV for a subject and build the index
+# returns dict mapping (day, submission number) to the list of matching records, each record a dict of column name to value
+# if the accounting CSV is missing, warns (naming the output the metadata was meant for) and returns an empty index
+def load_accounting_index(data_root, site, subject, output_name="audio QC"):
+	accounting_path = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "file_accounting_details", site + "_" + subject + "_audioJournalJSONRecordsInfo.csv")
+	if not os.path.isfile(accounting_path):
+		# shouldn't have this issue when called from pipeline
+		print("WARNING: JSON file accounting missing for input subject " + subject + ", so some metadata details will be missing from " + output_name + " output here")
+		return {}
+	return build_accounting_index(pd.read_csv(accounting_path))
+
+# build the index from an already loaded accounting DF
+# records are kept in lists rather than overwritten so that duplicated keys can still be detected at lookup time
+def build_accounting_index(accounting_df):
+	accounting_index = {}
+	if accounting_df.empty:
+		return accounting_index
+	for record in accounting_df.to_dict("records"):
+		key = (record["assigned_study_day"], record["adjusted_sound_number"])
+		accounting_index.setdefault(key, []).append(record)
+	return accounting_index
+
+# get the single accounting record for the given diary, or None if it can't be determined
+# prints the same warning the QC scripts always have when the key is missing or duplicated, but stays silent when there is no accounting info at all
+def lookup_accounting_record(accounting_index, filename, cur_day, cur_num):
+	if len(accounting_index) == 0:
+		return None
+	matches = accounting_index.get((cur_day, cur_num), [])
+	if len(matches) != 1:
+		# shouldn't really have this happen in scope of main pipeline if run correctly with no manual interference
+		# - but catch this to be safe, will print this warning but also will find obvious due to placement of NaNs in resulting CSV
+		print("WARNING: " + filename + " had issue with lookup in JSON accounting CSV, some metadata will be missing for it - shape of filtered DF was actually " + str(len(matches)))
+		return None
+	return matches[0]
@@ -1,17 +1,22 @@
 #!/usr/bin/env python
 
-# prevent librosa from logging a warning every time it is imported
-import warnings
-warnings.filterwarnings("ignore", category=FutureWarning)
-
-# actual imports
 import os
 import pandas as pd
 import numpy as np
 import soundfile as sf
-import librosa
 import sys
-import glob
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# spectral flatness comes from built-in numpy implementation by default, librosa is only imported when that engine is requested
+from audio_features import get_flatness_function, frame_features, summarize_frame_features, count_clipped
+from accounting_index import load_accounting_index, lookup_accounting_record
+from incremental_qc_save import save_qc_rows
+from diary_ledger import update_subject_ledger
+from audio_qc_cache import load_audio_qc_cache, save_audio_qc_cache, hash_audio_file, get_cached_qc, set_cached_qc
+
+# columns added to the audio QC CSV when the optional extra features are turned on
+EXTRA_FEATURE_HEADERS = ["silence_ratio","clipping_fraction","snr_estimate_db","speech_band_energy_ratio"]
 
 # function that does basic QC on new audio journals (via presence in current temp_audio folder where initial file conversions go)
 # pipeline calls this for all subjects, but this function itself is written for individual subject
@@ -19,11 +24,15 @@ import glob
 # expects files to already be renamed to match our conventions, as is done by default when this is called by main pipeline
 # also when called by main pipeline the db_cutoff and length_cutoff arguments will be provided
 # those optional arguments cause the code to do file movement as well to fully prep for sending to TranscribeMe
-def audio_diary_qc(data_root, site, subject, db_cutoff=None, length_cutoff=None):
-	# specify column headers that will be used for every CSV
-	# make it DPDash formatted, but will leave reftime columns blank. others will look up
-	headers=["reftime","day","timeofday","weekday","site","subject","daily_submission_number","submit_hour_int","length_minutes","overall_db","mean_flatness","subject_consent_month"]
-	# initialize lists to fill in df
+# workers argument sets the number of processes used for the per-file decode and feature step (1 keeps everything in this process)
+# streaming argument switches to reading each WAV in fixed size blocks, so memory use does not grow with recording length
+# flatness_engine argument selects "numpy" (built-in, default) or "librosa" for the spectral flatness computation
+# skip_rejected_flatness argument leaves mean_flatness empty for files already known to be rejected from their header (length or submission number)
+# extra_features argument adds the silence_ratio, clipping_fraction, snr_estimate_db, and speech_band_energy_ratio columns, all derived from the same STFT pass as the flatness
+# - that pass is always the built-in one, so flatness_engine only applies when extra_features is off
+# cache_size argument turns on the content hash cache of QC results (see audio_qc_cache) holding up to that many entries, 0 to not use it
+def audio_diary_qc(data_root, site, subject, db_cutoff=None, length_cutoff=None, workers=1, streaming=False, flatness_engine="numpy", skip_rejected_flatness=False, cache_size=0, extra_features=False):
+	# initialize lists to fill in df (column headers are specified by build_audio_qc_csv helper below)
 	site_days = []
 	times = []
 	week_days = []
@@ -36,8 +45,10 @@ def audio_diary_qc(data_root, site, subject, db_cutoff=None, length_cutoff=None)
 	# max and min of the flatness were never really informative, so just reporting the mean
 	mean_flats=[]
 	pt_consents=[] # for getting a sense in GENERAL of participant enrollment time without fully revealing dates in DPDash
+	extra_values=[[] for x in EXTRA_FEATURE_HEADERS] # only filled in when extra_features is on
+	if extra_features and flatness_engine != "numpy":
+		print("NOTE: extra audio features are on, so mean_flatness comes from their shared built-in STFT and the " + flatness_engine + " flatness engine will not be used")
 	if db_cutoff is not None and length_cutoff is not None:
-		headers.append("audio_approved_bool")
 		audio_bools = []
 		# audio would be rejected because file failed to load, db or duration not above cutoff amount, or second+ submission from same pt day
 		# reason will be obvious from other factors in the CSV, but want easy sorting for all rejections at once
@@ -69,16 +80,7 @@ def audio_diary_qc(data_root, site, subject, db_cutoff=None, length_cutoff=None)
 			return
 
 	# next will prep to get additional info from accounting JSON 
-	# - not strictly necessary for python script but should always exist in context of broader pipeline
-	if not os.path.isfile(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "file_accounting_details", site + "_" + subject + "_audioJournalJSONRecordsInfo.csv")):
-		# shouldn't have this issue when called from pipeline
-		print("WARNING: JSON file accounting missing for input subject " + subject + ", so some metadata details will be missing from audio QC output here")
-		accounting_df = pd.DataFrame()
-	else:
-		accounting_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "file_accounting_details", site + "_" + subject + "_audioJournalJSONRecordsInfo.csv"))
-
-	# constant used to convert RMS to decibels
-	ref_rms=float(2*(10**(-5)))
+	accounting_index = load_accounting_index(data_root, site, subject)
 
 	cur_files.sort() # go in order, although can also always sort CSV later.
 	wav_files = []
@@ -88,118 +90,94 @@ def audio_diary_qc(data_root, site, subject, db_cutoff=None, length_cutoff=None)
 			continue
 		wav_files.append(filename) # for later check of filenames in order
 
-		# handle the DPDash and other metadata columns here
-		# first pulling directly from filename for core info which we will always require
-		cur_day = int(filename.split("_day")[-1].split("_")[0])
-		cur_num = int(filename.split("_submission")[-1].split(".wav")[0])
+		# handle the DPDash and other metadata columns here (helper defined below)
+		cur_day, cur_num, cur_time, cur_weekday, cur_hour, cur_consent = audio_journal_metadata(filename, accounting_index)
 		site_days.append(cur_day)
 		sub_nums.append(cur_num)
-		# next get additional info from accounting JSON where available
-		if accounting_df.empty:
-			times.append(np.nan)
-			week_days.append(np.nan)
-			sub_hours.append(np.nan)
-			pt_consents.append(np.nan)
-		else:
-			# match exactly that record in the accounting JSON
-			cur_account = accounting_df[(accounting_df["assigned_study_day"]==cur_day) & (accounting_df["adjusted_sound_number"]==cur_num)]
-			if cur_account.shape[0] != 1:
-				# shouldn't really have this happen in scope of main pipeline if run correctly with no manual interference
-				# - but catch this to be safe, will print this warning but also will find obvious due to placement of NaNs in resulting CSV
-				print("WARNING: " + filename + " had issue with lookup in JSON accounting CSV, some metadata will be missing for it - shape of filtered DF was actually " + str(cur_account.shape[0]))
-				times.append(np.nan)
-				week_days.append(np.nan)
-				sub_hours.append(np.nan)
-				pt_consents.append(np.nan)
-			else:
-				times.append(cur_account["local_time_converted"].tolist()[0].split(" ")[-1])
-				week_days.append(cur_account["assigned_day_of_week"].tolist()[0])
-				sub_hours.append(cur_account["adjusted_submission_hour"].tolist()[0])
-				full_consent_str = cur_account["consent_date_at_accounting"].tolist()[0]
-				pt_consents.append(full_consent_str.split("-")[1] + "/" + full_consent_str.split("-")[0])
+		times.append(cur_time)
+		week_days.append(cur_weekday)
+		sub_hours.append(cur_hour)
+		pt_consents.append(cur_consent)
 
-		try:
-			data, fs = sf.read(filename)
-		except:
-			# if audio file can't be loaded obviously needs to be skipped
-			print("WARNING: " + filename + " appears to be a corrupted audio file, QC values will be empty for it")
-			# put nans in so they are still included fully in DF!
-			lengths.append(np.nan)
-			db.append(np.nan)
-			mean_flats.append(np.nan)
-			if db_cutoff is not None and length_cutoff is not None:
-				audio_bools.append(0)
-			continue 
-
-		# get length info
-		ns = data.shape[0]
-		if ns == 0:
-			# ignore entirely empty audio as well
-			print("WARNING: " + filename + " is an empty file, QC values will be empty for it")
-			# put nans in so they are still included fully in DF!
-			lengths.append(np.nan)
-			db.append(np.nan)
-			mean_flats.append(np.nan)
-			if db_cutoff is not None and length_cutoff is not None:
-				audio_bools.append(0)
-			continue
-		
-		try: 
-			# may not be a second shape number when file is mono, but should check for it in case we encounter stereo here
-			cs = data.shape[1] 
-			if cs == 2: 
-				print("WARNING: " + filename + " is stereo audio but expected mono - collapsing for QC calculation using mean")
-				data = np.mean(data, axis=1)
-			data = data.flatten() # drop the axis entirely once its shape is down to 1
-		except: 
-			pass
-			
-		# append length info
-		sec = float(ns)/fs
-		mins = sec/float(60)
-		# use round so values are reasonably viewable on DPDash
-		lengths.append(round(mins,3))
+	# when selecting audio for transcription, first do a cheap pass over just the WAV headers (frame count and sampling rate)
+	# files that can't be opened or are empty are caught here without decoding them, and files that will definitely be rejected
+	# on length or submission number are known before any decoding - for those the flatness can be skipped entirely if requested
+	process_bools = [True for x in wav_files]
+	flatness_bools = [True for x in wav_files]
+	if db_cutoff is not None and length_cutoff is not None:
+		for i in range(len(wav_files)):
+			filename = wav_files[i]
+			try:
+				header = sf.info(filename)
+			except:
+				print("WARNING: " + filename + " appears to be a corrupted audio file, QC values will be empty for it")
+				process_bools[i] = False
+				continue
+			if header.frames == 0:
+				print("WARNING: " + filename + " is an empty file, QC values will be empty for it")
+				process_bools[i] = False
+				continue
+			if skip_rejected_flatness and (float(header.frames)/header.samplerate < length_cutoff or sub_nums[i] > 1):
+				flatness_bools[i] = False
+	to_process = [x for x,y in zip(wav_files,process_bools) if y]
+	to_process_flatness = [x for x,y in zip(flatness_bools,process_bools) if y]
 
-		# get other audio props
-		gain = np.sqrt(np.mean(np.square(data)))
-		vol = round(20 * np.log10(gain/ref_rms),2)
+	# when the cache is on, identical audio that was already analyzed reuses its stored QC values without any decoding
+	if cache_size > 0:
+		cache = load_audio_qc_cache(data_root, site, subject)
+		file_hashes = [hash_audio_file(x) for x in to_process]
+		cached_results = [get_cached_qc(cache, x, y, extra_features=extra_features) for x,y in zip(file_hashes,to_process_flatness)]
+		for filename,cur_qc in zip(to_process,cached_results):
+			if cur_qc is not None:
+				print("Reusing cached audio QC values for " + filename)
+	else:
+		cached_results = [None for x in to_process]
+	to_compute = [x for x,y in zip(to_process,cached_results) if y is None]
+	to_compute_flatness = [x for x,y in zip(to_process_flatness,cached_results) if y is None]
+
+	# now get the actual audio QC values for each WAV, in parallel when requested
+	# executor map returns results in input order, so rows stay aligned with the metadata lists built above
+	file_qc = partial(audio_file_qc, streaming=streaming, flatness_engine=flatness_engine, extra_features=extra_features)
+	if workers > 1 and len(to_compute) > 1:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			computed_results = list(pool.map(file_qc, to_compute, to_compute_flatness))
+	else:
+		computed_results = [file_qc(x,y) for x,y in zip(to_compute,to_compute_flatness)]
+	# merge back with the cached values, and add the new ones to the cache
+	computed_results.reverse()
+	processed_results = [computed_results.pop() if x is None else x for x in cached_results]
+	if cache_size > 0:
+		for filename,file_hash,cached_qc,cur_qc in zip(to_process,file_hashes,cached_results,processed_results):
+			if cached_qc is None:
+				set_cached_qc(cache, file_hash, filename, cur_qc)
+		save_audio_qc_cache(data_root, site, subject, cache, cache_size)
+	# put nans back in for anything that failed the header check, so those are still included fully in DF!
+	processed_results.reverse()
+	qc_results = [processed_results.pop() if x else empty_qc(extra_features) for x in process_bools]
+
+	for filename,cur_num,cur_qc in zip(wav_files,sub_nums,qc_results):
+		sec, mins, vol, mean_flat = cur_qc[:4]
+		lengths.append(mins)
 		db.append(vol)
-		spec_flat = librosa.feature.spectral_flatness(y=data)
-		mean_flats.append(round(np.mean(spec_flat),4))
+		mean_flats.append(mean_flat)
+		if extra_features:
+			for i in range(len(EXTRA_FEATURE_HEADERS)):
+				extra_values[i].append(cur_qc[4+i])
 
 		# finally add transcript push approval column info when needed
 		if db_cutoff is not None and length_cutoff is not None:
-			if vol < db_cutoff or sec < length_cutoff or cur_num > 1:
-				print("WARNING: " + filename + " rejected by audio QC script (db=" + str(vol) + ", seconds=" + str(sec) + ", number=" + str(cur_num) + ")")
-				audio_bools.append(0)
-			else:
-				audio_bools.append(1)
-
-	# get pt and site lists, and also a list of nans for reftime column (values optional but column must exist per DPDash)
-	sites = [site for x in range(len(db))]
-	subjects = [subject for x in range(len(db))]
-	ref_times = [np.nan for x in range(len(db))]
+			audio_bools.append(audio_approval(filename, cur_num, cur_qc, db_cutoff, length_cutoff))
 
 	# construct current CSV
-	values = [ref_times, site_days, times, week_days, sites, subjects, sub_nums, sub_hours, lengths, db, mean_flats, pt_consents]
+	values = [site_days, times, week_days, sub_nums, sub_hours, lengths, db, mean_flats, pt_consents]
 	if db_cutoff is not None and length_cutoff is not None:
 		values.append(audio_bools)
-	new_csv = pd.DataFrame()
-	for i in range(len(headers)):
-		h = headers[i]
-		vals = values[i]
-		new_csv[h] = vals
+	new_csv = build_audio_qc_csv(site, subject, values, extra_values=extra_values if extra_features else None)
 
 	# go back to top level of PROTECTED processed for subject - by this point in code know it must exist
 	os.chdir(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals"))
-	# check for prior audio diary QC records
-	source_path = os.path.join("dpdash_source_csvs", site + "_" + subject + "_" + "diaryAudioQC.csv")
-	if os.path.isfile(source_path):
-		old_df = pd.read_csv(source_path)
-		final_save = pd.concat([old_df,new_csv]).reset_index(drop=True)
-	else:
-		final_save = new_csv
-	final_save.to_csv(source_path,index=False)
+	# save the new rows - appends to the PROTECTED source CSV and updates the GENERAL DPDash copy for push to predict
+	save_qc_rows(data_root, site, subject, new_csv, "diaryAudioQC")
 
 	# now that main audio QC stats CSV has been updated, move files if audio selection included
 	if db_cutoff is not None and length_cutoff is not None:
@@ -208,23 +186,225 @@ def audio_diary_qc(data_root, site, subject, db_cutoff=None, length_cutoff=None)
 				os.rename(os.path.join("temp_audio",audio_name),os.path.join("audio_to_send",audio_name))
 			else:
 				os.rename(os.path.join("temp_audio",audio_name),os.path.join("rejected_audio",audio_name))
+	# record the QC (and upload decision when made) for subjects tracked by the diary ledger
+	update_subject_ledger(data_root, site, subject, wav_files, "qcd", qc_accepted=audio_bools if db_cutoff is not None and length_cutoff is not None else None)
+
+# helper that makes the transcription upload decision for a diary given its submission number and QC tuple, returning 1 or 0
+def audio_approval(filename, cur_num, cur_qc, db_cutoff, length_cutoff):
+	sec, mins, vol, mean_flat = cur_qc[:4]
+	if np.isnan(sec):
+		# file failed to load or was empty, warning already given by QC helper
+		return 0
+	if vol < db_cutoff or sec < length_cutoff or cur_num > 1:
+		print("WARNING: " + filename + " rejected by audio QC script (db=" + str(vol) + ", seconds=" + str(sec) + ", number=" + str(cur_num) + ")")
+		return 0
+	return 1
+
+# helper for getting the DPDash and other metadata columns for a given renamed diary file
+# core info (day and submission number) is pulled directly from filename, which we will always require
+# additional info comes from the accounting JSON records where available
+# returns tuple of (day, submission number, time of day, weekday, submission hour, consent month)
+def audio_journal_metadata(filename, accounting_index):
+	cur_day = int(filename.split("_day")[-1].split("_")[0])
+	cur_num = int(filename.split("_submission")[-1].split(".wav")[0])
+	# match exactly that record in the accounting JSON
+	cur_account = lookup_accounting_record(accounting_index, filename, cur_day, cur_num)
+	if cur_account is None:
+		return (cur_day, cur_num, np.nan, np.nan, np.nan, np.nan)
+	cur_time = cur_account["local_time_converted"].split(" ")[-1]
+	cur_weekday = cur_account["assigned_day_of_week"]
+	cur_hour = cur_account["adjusted_submission_hour"]
+	full_consent_str = cur_account["consent_date_at_accounting"]
+	return (cur_day, cur_num, cur_time, cur_weekday, cur_hour, full_consent_str.split("-")[1] + "/" + full_consent_str.split("-")[0])
+
+# helper for putting together the new rows of the audio QC CSV
+# values should be the lists for day, time, weekday, submission number, submission hour, length, db, flatness, consent month (in that order)
+# and then optionally the approval list, which adds the audio_approved_bool column
+# extra_values optionally gives the lists for the extra feature columns, in EXTRA_FEATURE_HEADERS order - these go at the end
+def build_audio_qc_csv(site, subject, values, extra_values=None):
+	# specify column headers that will be used for every CSV
+	# make it DPDash formatted, but will leave reftime columns blank. others will look up
+	headers=["reftime","day","timeofday","weekday","site","subject","daily_submission_number","submit_hour_int","length_minutes","overall_db","mean_flatness","subject_consent_month"]
+	if len(values) > 9:
+		headers.append("audio_approved_bool")
+	# get pt and site lists, and also a list of nans for reftime column (values optional but column must exist per DPDash)
+	n_rows = len(values[0])
+	sites = [site for x in range(n_rows)]
+	subjects = [subject for x in range(n_rows)]
+	ref_times = [np.nan for x in range(n_rows)]
+	values = [ref_times, values[0], values[1], values[2], sites, subjects] + values[3:]
+	if extra_values is not None:
+		headers = headers + EXTRA_FEATURE_HEADERS
+		values = values + extra_values
+	new_csv = pd.DataFrame()
+	for i in range(len(headers)):
+		h = headers[i]
+		vals = values[i]
+		new_csv[h] = vals
+	return new_csv
+
+# helper that loads a single WAV (from current working directory) and computes the core audio QC values for it
+# returns tuple of (seconds, minutes, db, mean flatness) - all nan if the file could not be used
+# when extra_features is True the tuple continues with the extra feature values in EXTRA_FEATURE_HEADERS order
+# kept at module level with only picklable inputs/outputs so that audio_diary_qc can map it over a process pool
+# when streaming is True the file is never fully loaded, see streaming_audio_stats below for details
+# when compute_flatness is False the mean flatness (and any extra features) are left as nan and no STFT is done at all
+def audio_file_qc(filename, compute_flatness=True, streaming=False, flatness_engine="numpy", extra_features=False):
+	# constant used to convert RMS to decibels
+	ref_rms=float(2*(10**(-5)))
+
+	if streaming:
+		try:
+			ns, fs, sum_squares, flat_sum, flat_count, extra_stats = streaming_audio_stats(filename, flatness_engine=flatness_engine, compute_flatness=compute_flatness, extra_features=extra_features)
+		except:
+			print("WARNING: " + filename + " appears to be a corrupted audio file, QC values will be empty for it")
+			return empty_qc(extra_features)
+		if ns == 0:
+			print("WARNING: " + filename + " is an empty file, QC values will be empty for it")
+			return empty_qc(extra_features)
+		sec = float(ns)/fs
+		mins = sec/float(60)
+		gain = np.sqrt(sum_squares/ns)
+		vol = round(20 * np.log10(gain/ref_rms),2)
+		if not compute_flatness:
+			return (sec, round(mins,3), vol, np.nan) + empty_qc(extra_features)[4:]
+		if extra_features:
+			feats, n_clipped = extra_stats
+			return (sec, round(mins,3), vol, round(flat_sum/flat_count,4)) + summarize_frame_features(feats, n_clipped, ns, ref_rms)
+		return (sec, round(mins,3), vol, round(flat_sum/flat_count,4))
 
-	# finally also deal with saving copy to be pushed to predict under GENERAL, matching expectations for DPDash
-	final_save.sort_values(by="day",inplace=True) # should already be sorted but ensure before grabbing day number for name
-	start_day = final_save["day"].dropna().tolist()[0]
-	end_day = final_save["day"].dropna().tolist()[-1]
-	# also drop any duplicates in case audio got processed a second time - shouldn't happen via pipeline though!
-	final_save.drop_duplicates(subset=["day", "timeofday"],inplace=True)
-	dpdash_name = site[-2:] + "-" + subject + "-diaryAudioQC-day" + str(start_day) + "to" + str(end_day) + ".csv"
-	dpdash_folder = os.path.join(data_root, "GENERAL", site, "processed", subject, "phone", "audio_journals")
 	try:
-		os.chdir(dpdash_folder)
+		data, fs = sf.read(filename)
 	except:
-		print("WARNING: correct folder structure does not exist for push of DPDash CSV to predict server, please fix for future monitoring updates")
-		return
-	for old_dpdash in glob.glob(site[-2:] + "-" + subject + "-diaryAudioQC-day*.csv"):
-		os.remove(old_dpdash)
-	final_save.to_csv(dpdash_name,index=False)
+		# if audio file can't be loaded obviously needs to be skipped
+		print("WARNING: " + filename + " appears to be a corrupted audio file, QC values will be empty for it")
+		# put nans in so they are still included fully in DF!
+		return empty_qc(extra_features)
+	return audio_data_qc(data, fs, filename, compute_flatness=compute_flatness, flatness_engine=flatness_engine, extra_features=extra_features)
+
+# helper that computes the core audio QC values from an already loaded audio array (samples by channels, or 1D for mono)
+# returns same tuple as audio_file_qc above - filename is just for warning messages
+def audio_data_qc(data, fs, filename, compute_flatness=True, flatness_engine="numpy", extra_features=False):
+	# constant used to convert RMS to decibels
+	ref_rms=float(2*(10**(-5)))
+
+	# get length info
+	ns = data.shape[0]
+	if ns == 0:
+		# ignore entirely empty audio as well
+		print("WARNING: " + filename + " is an empty file, QC values will be empty for it")
+		return empty_qc(extra_features)
+	
+	try: 
+		# may not be a second shape number when file is mono, but should check for it in case we encounter stereo here
+		cs = data.shape[1] 
+		if cs == 2: 
+			print("WARNING: " + filename + " is stereo audio but expected mono - collapsing for QC calculation using mean")
+			data = np.mean(data, axis=1)
+		data = data.flatten() # drop the axis entirely once its shape is down to 1
+	except: 
+		pass
+		
+	# length info
+	sec = float(ns)/fs
+	mins = sec/float(60)
+
+	# get other audio props
+	gain = np.sqrt(np.mean(np.square(data)))
+	vol = round(20 * np.log10(gain/ref_rms),2)
+	if not compute_flatness:
+		return (sec, round(mins,3), vol, np.nan) + empty_qc(extra_features)[4:]
+	if extra_features:
+		# one STFT and framed RMS pass gives the flatness and everything needed for the extra features
+		# (so flatness always comes from the built-in engine in this case, rather than running a second STFT through librosa)
+		feats = frame_features(data, fs)
+		extra_qc = summarize_frame_features(feats, count_clipped(data), ns, ref_rms)
+		return (sec, round(mins,3), vol, round(np.mean(feats["flatness"]),4)) + extra_qc
+	spectral_flatness = get_flatness_function(flatness_engine)
+	spec_flat = spectral_flatness(y=data)
+
+	# use round so values are reasonably viewable on DPDash
+	return (sec, round(mins,3), vol, round(np.mean(spec_flat),4))
+
+# helper that reads a WAV in fixed size blocks and accumulates what is needed for the db and flatness QC values
+# returns tuple of (number of samples, sampling rate, sum of squared samples, sum of frame flatness values, number of frames)
+# peak memory is set by block_size plus one STFT frame of carry over, regardless of recording length
+# framing reproduces the default spectral_flatness settings (n_fft 2048, hop 512, centered with zero padding),
+# so mean flatness here matches the in-memory path up to float summation order - in practice both stored (rounded) values agree,
+# with differences before rounding well under 1e-6 for db and flatness. older librosa versions that pad with reflection instead
+# (pre 0.10) will differ slightly in the first and last couple of frames, which is only noticeable for very short files
+# (flatness sums are left at 0 if compute_flatness is False)
+# when extra_features is True, the final returned item is a tuple of the per frame feature arrays (see audio_features.frame_features) and clipped sample count,
+# otherwise it is None - those arrays hold one value per hop, so they are still small relative to the audio itself
+def streaming_audio_stats(filename, block_size=65536, n_fft=2048, hop_length=512, flatness_engine="numpy", compute_flatness=True, extra_features=False):
+	if extra_features:
+		# flatness comes along with the other per frame features in this case, no separate call (or second STFT for the librosa engine) needed
+		spectral_flatness = None
+	else:
+		spectral_flatness = get_flatness_function(flatness_engine)
+	sum_squares = 0.0
+	flat_sum = 0.0
+	flat_count = 0
+	frame_lists = {}
+	n_clipped = 0
+	# centered framing is equivalent to padding n_fft//2 zeros on both ends of the signal
+	carry = np.zeros(n_fft//2)
+	with sf.SoundFile(filename) as f:
+		fs = f.samplerate
+		ns = f.frames
+		if ns == 0:
+			return (0, fs, sum_squares, flat_sum, flat_count, None)
+		stereo_warned = False
+		for block in f.blocks(blocksize=block_size):
+			if block.ndim > 1:
+				if block.shape[1] == 2:
+					if not stereo_warned:
+						print("WARNING: " + filename + " is stereo audio but expected mono - collapsing for QC calculation using mean")
+						stereo_warned = True
+					block = np.mean(block, axis=1)
+				block = block.flatten()
+			sum_squares = sum_squares + np.dot(block, block)
+			if not compute_flatness:
+				continue
+			if extra_features:
+				n_clipped = n_clipped + count_clipped(block)
+			carry, cur_sum, cur_count = _streaming_flatness_step(np.concatenate([carry, block]), n_fft, hop_length, spectral_flatness, fs=fs, extra_features=extra_features, frame_lists=frame_lists)
+			flat_sum = flat_sum + cur_sum
+			flat_count = flat_count + cur_count
+	if not compute_flatness:
+		return (ns, fs, sum_squares, flat_sum, flat_count, None)
+	# finish off the final frames with the end padding
+	carry, cur_sum, cur_count = _streaming_flatness_step(np.concatenate([carry, np.zeros(n_fft//2)]), n_fft, hop_length, spectral_flatness, fs=fs, extra_features=extra_features, frame_lists=frame_lists)
+	flat_sum = flat_sum + cur_sum
+	flat_count = flat_count + cur_count
+	if not extra_features:
+		return (ns, fs, sum_squares, flat_sum, flat_count, None)
+	feats = dict([(k, np.concatenate(v)) for k,v in frame_lists.items()])
+	return (ns, fs, sum_squares, flat_sum, flat_count, (feats, n_clipped))
+
+# computes flatness over all complete frames in the buffer, returning the leftover samples needed for the next frame
+# when extra_features is True the per frame feature arrays are also appended to the lists in frame_lists (keyed like the frame_features dict),
+# and spectral_flatness may then be None to take the flatness from those features
+def _streaming_flatness_step(buffer, n_fft, hop_length, spectral_flatness, fs=None, extra_features=False, frame_lists=None):
+	if buffer.shape[0] < n_fft:
+		return (buffer, 0.0, 0)
+	n_frames = 1 + (buffer.shape[0] - n_fft)//hop_length
+	frame_buffer = buffer[:(n_frames-1)*hop_length + n_fft]
+	if extra_features:
+		feats = frame_features(frame_buffer, fs, n_fft=n_fft, hop_length=hop_length, center=False)
+		for k in feats:
+			frame_lists.setdefault(k, []).append(feats[k])
+	if spectral_flatness is None:
+		spec_flat = feats["flatness"]
+	else:
+		spec_flat = spectral_flatness(y=frame_buffer, n_fft=n_fft, hop_length=hop_length, center=False)
+	return (buffer[n_frames*hop_length:], float(np.sum(spec_flat)), n_frames)
+
+# QC tuple used when a file can't be analyzed, all nan (with the extra feature slots when those are on)
+def empty_qc(extra_features=False):
+	if extra_features:
+		return tuple([np.nan for x in range(4 + len(EXTRA_FEATURE_HEADERS))])
+	return (np.nan, np.nan, np.nan, np.nan)
 
 if __name__ == '__main__':
 	# Map command line arguments to function arguments.
@@ -234,5 +414,29 @@ if __name__ == '__main__':
 	except:
 		db_cutoff=None
 		length_cutoff=None
-	audio_diary_qc(sys.argv[1], sys.argv[2], sys.argv[3], db_cutoff=db_cutoff, length_cutoff=length_cutoff)
+	try:
+		workers=int(sys.argv[6])
+	except:
+		workers=1
+	try:
+		streaming=sys.argv[7] in ["Y","y"]
+	except:
+		streaming=False
+	try:
+		flatness_engine=sys.argv[8]
+	except:
+		flatness_engine="numpy"
+	try:
+		skip_rejected_flatness=sys.argv[9] in ["Y","y"]
+	except:
+		skip_rejected_flatness=False
+	try:
+		cache_size=int(sys.argv[10])
+	except:
+		cache_size=0
+	try:
+		extra_features=sys.argv[11] in ["Y","y"]
+	except:
+		extra_features=False
+	audio_diary_qc(sys.argv[1], sys.argv[2], sys.argv[3], db_cutoff=db_cutoff, length_cutoff=length_cutoff, workers=workers, streaming=streaming, flatness_engine=flatness_engine, skip_rejected_flatness=skip_rejected_flatness, cache_size=cache_size, extra_features=extra_features)
 
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import warnings
+import numpy as np
+
+# numpy-only audio feature helpers used by the audio QC step
+# importing librosa pulls in numba and scipy, which is a noticeable startup cost for a script launched once per subject every night
+# so spectral flatness is reimplemented here with librosa's default parameters, and librosa is only imported if explicitly requested
+
+# default STFT settings used by librosa.feature.spectral_flatness
+DEFAULT_N_FFT = 2048
+DEFAULT_HOP_LENGTH = 512
+DEFAULT_AMIN = 1e-10
+DEFAULT_POWER = 2.0
+
+# returns the spectral flatness function for the requested engine ("numpy" for the built-in one, "librosa" for the package version)
+# both accept the same keyword arguments used in this repo (y, n_fft, hop_length, center) and return a (1, n_frames) array
+def get_flatness_function(engine="numpy"):
+	if engine == "librosa":
+		# prevent librosa from logging a warning every time it is imported
+		warnings.filterwarnings("ignore", category=FutureWarning)
+		import librosa
+		return librosa.feature.spectral_flatness
+	return spectral_flatness
+
+# periodic hann window, matching scipy.signal.get_window("hann", n_fft) that librosa uses
+def hann_window(n_fft):
+	return 0.5 - 0.5*np.cos(2.0*np.pi*np.arange(n_fft)/n_fft)
+
+# generator over the power spectrogram of a mono float signal, a chunk of frames at a time
+# yields (start frame index, stop frame index, raw frames, power spectrum) so callers can derive several features from one STFT
+# framing is librosa's default (hann window, centered frames with zero padding as in librosa >= 0.10)
+def stft_power_chunks(y, n_fft=DEFAULT_N_FFT, hop_length=DEFAULT_HOP_LENGTH, power=DEFAULT_POWER, center=True, frames_per_chunk=256):
+	y = np.asarray(y, dtype=np.float64)
+	if center:
+		y = np.pad(y, n_fft//2, mode="constant")
+	if y.shape[0] < n_fft:
+		# not enough samples for a single frame
+		return
+
+	window = hann_window(n_fft)
+	# strided view of all frames, no copy is made here
+	frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop_length]
+	n_frames = frames.shape[0]
+	for start in range(0, n_frames, frames_per_chunk):
+		stop = min(start + frames_per_chunk, n_frames)
+		S = np.abs(np.fft.rfft(frames[start:stop] * window, axis=1))**power
+		yield (start, stop, frames[start:stop], S)
+
+# number of frames stft_power_chunks will produce for a signal of n samples
+def count_frames(n, n_fft=DEFAULT_N_FFT, hop_length=DEFAULT_HOP_LENGTH, center=True):
+	if center:
+		n = n + 2*(n_fft//2)
+	if n < n_fft:
+		return 0
+	return 1 + (n - n_fft)//hop_length
+
+# flatness of each frame from its power spectrum (geometric mean over arithmetic mean)
+def _frame_flatness(S, amin):
+	S_thresh = np.maximum(amin, S)
+	gmean = np.exp(np.mean(np.log(S_thresh), axis=1))
+	amean = np.mean(S_thresh, axis=1)
+	return gmean/amean
+
+# STFT-based spectral flatness of a mono float signal, reproducing librosa's defaults
+# (hann window, n_fft 2048, hop 512, power spectrum, amin 1e-10, centered frames with zero padding as in librosa >= 0.10)
+# frames are processed in chunks so the full spectrogram is never held in memory at once
+def spectral_flatness(y, n_fft=DEFAULT_N_FFT, hop_length=DEFAULT_HOP_LENGTH, amin=DEFAULT_AMIN, power=DEFAULT_POWER, center=True, frames_per_chunk=256):
+	flatness = np.empty(count_frames(len(y), n_fft=n_fft, hop_length=hop_length, center=center))
+	for start, stop, frames, S in stft_power_chunks(y, n_fft=n_fft, hop_length=hop_length, power=power, center=center, frames_per_chunk=frames_per_chunk):
+		flatness[start:stop] = _frame_flatness(S, amin)
+	return flatness.reshape(1,-1)
+
+# settings for the optional extra QC features
+SPEECH_BAND = (300.0, 3400.0) # telephone speech band in Hz
+DEFAULT_SILENCE_DB = 40.0 # frames quieter than this (same dB scale as the overall_db QC value) count as silence
+DEFAULT_CLIP_LEVEL = 0.999 # samples at or above this absolute value (of full scale 1) count as clipped
+
+# per frame arrays for all the optional QC features, computed from one STFT and one framed RMS pass over the same frames
+# returns dict with "flatness" (identical to spectral_flatness above), "rms" of the raw (unwindowed) frame samples,
+# and "speech_power" / "total_power", the power spectrum summed within the speech band and overall for each frame
+def frame_features(y, sr, n_fft=DEFAULT_N_FFT, hop_length=DEFAULT_HOP_LENGTH, amin=DEFAULT_AMIN, power=DEFAULT_POWER, center=True, frames_per_chunk=256, speech_band=SPEECH_BAND):
+	n_frames = count_frames(len(y), n_fft=n_fft, hop_length=hop_length, center=center)
+	feats = {"flatness": np.empty(n_frames), "rms": np.empty(n_frames), "speech_power": np.empty(n_frames), "total_power": np.empty(n_frames)}
+	freqs = np.fft.rfftfreq(n_fft, d=1.0/sr)
+	# speech band bins are contiguous, so a slice avoids copying the spectrum
+	speech_bins = np.nonzero((freqs >= speech_band[0]) & (freqs <= speech_band[1]))[0]
+	speech_slice = slice(speech_bins[0], speech_bins[-1] + 1)
+	for start, stop, frames, S in stft_power_chunks(y, n_fft=n_fft, hop_length=hop_length, power=power, center=center, frames_per_chunk=frames_per_chunk):
+		feats["flatness"][start:stop] = _frame_flatness(S, amin)
+		feats["speech_power"][start:stop] = np.sum(S[:,speech_slice], axis=1)
+		feats["total_power"][start:stop] = np.sum(S, axis=1)
+		if n_fft % hop_length != 0:
+			feats["rms"][start:stop] = np.sqrt(np.mean(np.square(frames), axis=1))
+	if n_fft % hop_length == 0 and n_frames > 0:
+		# with the default settings each frame is exactly 4 hops long, so frame energy is just a sum of per hop energies
+		# this squares each sample once instead of once per overlapping frame
+		y = np.asarray(y, dtype=np.float64)
+		if center:
+			y = np.pad(y, n_fft//2, mode="constant")
+		hops_per_frame = n_fft//hop_length
+		n_hops = n_frames + hops_per_frame - 1
+		hop_energy = np.sum(np.square(y[:n_hops*hop_length].reshape(n_hops, hop_length)), axis=1)
+		frame_energy = np.zeros(n_frames)
+		for k in range(hops_per_frame):
+			frame_energy = frame_energy + hop_energy[k:k+n_frames]
+		feats["rms"] = np.sqrt(frame_energy/n_fft)
+	return feats
+
+# reduce the per frame arrays (plus the clipped sample count) to the extra QC values
+# returns tuple of (silence ratio, clipping fraction, SNR estimate in dB, speech band energy ratio), rounded for viewing on DPDash
+# - silence ratio is the fraction of frames with RMS below silence_db
+# - clipping fraction is the fraction of samples at or above the clip level
+# - SNR estimate compares the 90th percentile of frame power (speech) to the 10th percentile (noise floor)
+# - speech band energy ratio is the share of total spectral power that falls within the speech band
+def summarize_frame_features(feats, n_clipped, n_samples, ref_rms, silence_db=DEFAULT_SILENCE_DB, amin=DEFAULT_AMIN):
+	if len(feats["rms"]) == 0 or n_samples == 0:
+		return (np.nan, np.nan, np.nan, np.nan)
+	frame_db = 20 * np.log10(np.maximum(feats["rms"], amin)/ref_rms)
+	silence_ratio = np.mean(frame_db < silence_db)
+	frame_power = np.square(feats["rms"])
+	snr = 10 * np.log10(max(np.percentile(frame_power, 90), amin)/max(np.percentile(frame_power, 10), amin))
+	total_power = np.sum(feats["total_power"])
+	speech_ratio = np.sum(feats["speech_power"])/total_power if total_power > 0 else np.nan
+	return (round(float(silence_ratio),4), round(float(n_clipped)/n_samples,6), round(float(snr),2), round(float(speech_ratio),4))
+
+# count of samples at or above the clip level
+def count_clipped(y, clip_level=DEFAULT_CLIP_LEVEL):
+	return int(np.count_nonzero(np.abs(y) >= clip_level))
+
+# checks spectral_flatness against librosa.feature.spectral_flatness on synthetic signals, raising AssertionError if any differ beyond the tolerance
+# covers a pure tone, white noise, a tone in noise, silence, an odd length signal, and one shorter than a single frame before padding
+def flatness_parity_check(sr=16000, rtol=1e-6, atol=1e-9):
+	librosa_flatness = get_flatness_function("librosa")
+	rng = np.random.default_rng(0)
+	t = np.arange(5*sr)/float(sr)
+	signals = [("sine", 0.5*np.sin(2*np.pi*440.0*t)),
+			   ("noise", 0.1*rng.standard_normal(5*sr)),
+			   ("sine in noise", 0.3*np.sin(2*np.pi*220.0*t) + 0.01*rng.standard_normal(5*sr)),
+			   ("silence", np.zeros(5*sr)),
+			   ("odd length", 0.1*rng.standard_normal(5*sr + 333)),
+			   ("shorter than a frame", 0.1*rng.standard_normal(1001))]
+	for name, y in signals:
+		with warnings.catch_warnings():
+			# librosa warns about the deliberately short signal
+			warnings.simplefilter("ignore", UserWarning)
+			expected = librosa_flatness(y=y)
+		result = spectral_flatness(y)
+		assert result.shape == expected.shape, name + ": shape " + str(result.shape) + " does not match librosa's " + str(expected.shape)
+		assert np.allclose(result, expected, rtol=rtol, atol=atol), name + ": max difference " + str(np.max(np.abs(result - expected))) + " from librosa"
+		print(name + ": " + str(result.shape[1]) + " frames match librosa, max difference " + str(np.max(np.abs(result - expected))))
+
+# times fresh python processes importing audio_diary_qc as the pipeline does (numpy flatness engine), and with the librosa engine loaded too
+# returns the fastest of repeats for each, after checking that the plain import does not pull in librosa
+def import_startup_benchmark(repeats=5):
+	import os
+	import subprocess
+	func_folder = os.path.dirname(os.path.abspath(__file__))
+	commands = [("numpy engine", "import sys, audio_diary_qc; assert 'librosa' not in sys.modules, 'librosa imported at module load'"),
+				("librosa engine", "import audio_diary_qc, audio_features; audio_features.get_flatness_function('librosa')")]
+	best_times = []
+	for name, command in commands:
+		cur_times = []
+		for r in range(repeats):
+			start = time.perf_counter()
+			subprocess.run([sys.executable, "-c", command], cwd=func_folder, check=True)
+			cur_times.append(time.perf_counter() - start)
+		best_times.append(min(cur_times))
+		print(name + ": fresh import of audio_diary_qc took " + str(round(min(cur_times),3)) + " seconds (fastest of " + str(repeats) + ")")
+	return best_times
+
+if __name__ == '__main__':
+	# usage: python audio_features.py parity - check the built-in spectral flatness against librosa on synthetic signals (librosa must be installed)
+	#        python audio_features.py startup [repeats, default 5] - time a fresh import of audio_diary_qc with the numpy engine versus with librosa loaded
+	#        python audio_features.py [recording length in minutes, default 5] [sampling rate, default 16000] [repeats, default 3]
+	#        - quick benchmark of the per file cost of the flatness only QC versus the full set of features from the shared STFT
+	if len(sys.argv) > 1 and sys.argv[1] == "parity":
+		flatness_parity_check()
+		print("spectral flatness matches librosa on all test signals")
+		sys.exit()
+	if len(sys.argv) > 1 and sys.argv[1] == "startup":
+		try:
+			repeats = int(sys.argv[2])
+		except:
+			repeats = 5
+		numpy_time, librosa_time = import_startup_benchmark(repeats=repeats)
+		print("librosa engine adds " + str(round(librosa_time - numpy_time,3)) + " seconds of startup")
+		sys.exit()
+	try:
+		minutes = float(sys.argv[1])
+	except:
+		minutes = 5.0
+	try:
+		sr = int(sys.argv[2])
+	except:
+		sr = 16000
+	try:
+		repeats = int(sys.argv[3])
+	except:
+		repeats = 3
+	y = 0.1*np.random.default_rng(0).standard_normal(int(minutes*60*sr))
+	flat_times = []
+	full_times = []
+	for r in range(repeats):
+		start = time.perf_counter()
+		np.mean(spectral_flatness(y))
+		flat_times.append(time.perf_counter() - start)
+		start = time.perf_counter()
+		summarize_frame_features(frame_features(y, sr), count_clipped(y), len(y), 2e-5)
+		full_times.append(time.perf_counter() - start)
+	print("flatness only: " + str(round(min(flat_times),3)) + " seconds for " + str(minutes) + " minutes of audio at " + str(sr) + " Hz")
+	print("all features: " + str(round(min(full_times),3)) + " seconds (" + str(round(min(full_times)/min(flat_times),2)) + "x)")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import hashlib
+import numpy as np
+
+# persistent per subject cache of audio QC results, keyed by SHA-256 hash of the WAV file contents
+# used by audio_diary_qc so that a diary re-queued into temp_audio (e.g. after a manual fix) does not need to be decoded and analyzed again
+# cache lives in the subject's file_accounting_details folder as a JSON dict of hash to stored QC values plus some info for inspection
+# once it holds more than the configured max number of entries, the least recently used entries are evicted
+# can also be run directly to inspect or invalidate entries for a subject - see main at bottom for usage
+
+# get the path to the cache file for a subject
+def audio_qc_cache_path(data_root, site, subject):
+	return os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "file_accounting_details", site + "_" + subject + "_audioQCCache.json")
+
+# load the cache dict for a subject, empty if there is none yet (or it can't be read)
+def load_audio_qc_cache(data_root, site, subject):
+	cache_path = audio_qc_cache_path(data_root, site, subject)
+	if not os.path.isfile(cache_path):
+		return {}
+	try:
+		with open(cache_path) as f:
+			return json.load(f)
+	except:
+		print("WARNING: audio QC cache for subject " + subject + " could not be read, starting a new one")
+		return {}
+
+# save the cache dict for a subject, first evicting least recently used entries beyond max_entries
+# write goes through a temporary file so an interrupted save can't corrupt the existing cache
+def save_audio_qc_cache(data_root, site, subject, cache, max_entries):
+	cache_path = audio_qc_cache_path(data_root, site, subject)
+	if not os.path.isdir(os.path.dirname(cache_path)):
+		return
+	if len(cache) > max_entries:
+		by_use = sorted(cache.keys(), key=lambda x: cache[x]["last_used"])
+		for key in by_use[:len(cache) - max_entries]:
+			del cache[key]
+	with open(cache_path + ".tmp", "w") as f:
+		json.dump(cache, f)
+	os.replace(cache_path + ".tmp", cache_path)
+
+# SHA-256 hex digest of a file's contents, read in chunks so memory use stays small
+def hash_audio_file(filename, chunk_size=1048576):
+	file_hash = hashlib.sha256()
+	with open(filename, "rb") as f:
+		chunk = f.read(chunk_size)
+		while chunk:
+			file_hash.update(chunk)
+			chunk = f.read(chunk_size)
+	return file_hash.hexdigest()
+
+# get the stored QC tuple (seconds, minutes, db, mean flatness) for a hash, or None on a miss
+# an entry stored without flatness (see skip_rejected_flatness) is treated as a miss when flatness is needed now,
+# and similarly an entry without the extra feature values when extra_features is on (which then get appended to the tuple)
+def get_cached_qc(cache, file_hash, compute_flatness=True, extra_features=False):
+	if file_hash not in cache:
+		return None
+	entry = cache[file_hash]
+	if compute_flatness and np.isnan(entry["flatness"]):
+		return None
+	if extra_features and compute_flatness and "extra" not in entry:
+		return None
+	entry["last_used"] = time.time()
+	if not compute_flatness:
+		cur_qc = (entry["seconds"], entry["minutes"], entry["db"], np.nan)
+		if extra_features:
+			cur_qc = cur_qc + tuple([np.nan for x in range(4)])
+		return cur_qc
+	cur_qc = (entry["seconds"], entry["minutes"], entry["db"], entry["flatness"])
+	if extra_features:
+		cur_qc = cur_qc + tuple(entry["extra"])
+	return cur_qc
+
+# store a newly computed QC tuple for a hash - failed QC (all nan) is not cached, so it will be retried next time
+# any extra feature values in the tuple are stored as well, as long as they were actually computed (i.e. flatness was not skipped)
+def set_cached_qc(cache, file_hash, filename, cur_qc):
+	sec, mins, vol, mean_flat = cur_qc[:4]
+	if np.isnan(sec):
+		return
+	entry = {"seconds": sec, "minutes": mins, "db": vol, "flatness": mean_flat, "filename": filename, "last_used": time.time()}
+	if len(cur_qc) > 4 and not np.isnan(mean_flat):
+		entry["extra"] = list(cur_qc[4:])
+	cache[file_hash] = entry
+
+if __name__ == '__main__':
+	# usage: python audio_qc_cache.py data_root site subject [inspect|invalidate|clear] [hash or WAV filename ...]
+	# inspect (default) prints the cache contents, invalidate removes the given entries, clear removes the whole cache for the subject
+	data_root, site, subject = sys.argv[1], sys.argv[2], sys.argv[3]
+	try:
+		command = sys.argv[4]
+	except:
+		command = "inspect"
+	cache_path = audio_qc_cache_path(data_root, site, subject)
+	cache = load_audio_qc_cache(data_root, site, subject)
+
+	if command == "inspect":
+		if not os.path.isfile(cache_path):
+			print("No audio QC cache exists for subject " + subject)
+			sys.exit(0)
+		print(str(len(cache)) + " entries in audio QC cache for subject " + subject + " (" + str(os.path.getsize(cache_path)) + " bytes)")
+		for key in sorted(cache.keys(), key=lambda x: cache[x]["filename"]):
+			entry = cache[key]
+			print(key[:12] + " " + entry["filename"] + " - seconds=" + str(entry["seconds"]) + ", db=" + str(entry["db"]) + ", flatness=" + str(entry["flatness"]) + ", last used " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_used"])))
+	elif command == "invalidate":
+		removed = 0
+		for target in sys.argv[5:]:
+			# match either full hash, hash prefix as printed by inspect, or the WAV filename the entry was stored under
+			for key in [x for x in cache.keys() if x.startswith(target) or cache[x]["filename"] == target]:
+				del cache[key]
+				removed = removed + 1
+		save_audio_qc_cache(data_root, site, subject, cache, len(cache))
+		print(str(removed) + " entries removed from audio QC cache for subject " + subject)
+	elif command == "clear":
+		if os.path.isfile(cache_path):
+			os.remove(cache_path)
+		print("Audio QC cache cleared for subject " + subject)
+	else:
+		print("Unrecognized command " + command + ", should be one of inspect, invalidate, or clear")
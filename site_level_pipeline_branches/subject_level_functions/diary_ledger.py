@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import sqlite3
+import datetime
+
+# per subject SQLite ledger of where each audio journal is in the pipeline, replacing the raw_file_tracking_system marker files when turned on
+# each diary gets one row, keyed by its raw MP3 name (without extension) along with the processed WAV name it maps to, recording its current state
+# and when it first reached each state - so "what is TODO" and "what is stuck" are single indexed queries instead of walks over thousands of tiny files
+# all changes are made in transactions, so a crash part way through a step never leaves the ledger half updated
+# the ledger lives at audio_journals/diary_ledger.sqlite3 for the subject, and pipeline steps only update it for subjects that have one
+
+# states in pipeline order:
+# discovered - recorded by mindlamp_accounting with a matching MP3, still to be converted (the old TODO marker)
+# converted - WAV conversion done (the old renamed marker)
+# qcd - audio QC done, with qc_accepted noting whether it was selected for transcription (rejected diaries stop here)
+# sent - uploaded to TranscribeMe, now in pending_audio
+# pending - a pull found its transcript still not ready
+# returned - transcript pulled from TranscribeMe
+# redacted - redacted transcript made
+DIARY_STATES = ["discovered", "converted", "qcd", "sent", "pending", "returned", "redacted"]
+LEDGER_NAME = "diary_ledger.sqlite3"
+
+def ledger_path(data_root, site, subject):
+	return os.path.join(data_root, "PROTECTED", site, "processed", subject, "phone", "audio_journals", LEDGER_NAME)
+
+# returns the open ledger for the subject, or None if the subject does not use one - with create, a missing ledger is made instead
+# any raw_file_tracking_system folder found next to the ledger is migrated into it (the folder is only removed once that fully succeeds, so this also finishes an interrupted migration)
+def open_subject_ledger(data_root, site, subject, create=False):
+	path = ledger_path(data_root, site, subject)
+	if not create and not os.path.isfile(path):
+		return None
+	ledger = DiaryLedger(path)
+	tracking_folder = os.path.join(os.path.dirname(path), "raw_file_tracking_system")
+	if os.path.isdir(tracking_folder):
+		ledger.migrate_markers(tracking_folder)
+	return ledger
+
+# convenience for the pipeline steps that only need to record a state change - does nothing for subjects without a ledger
+def update_subject_ledger(data_root, site, subject, processed_names, state, qc_accepted=None):
+	if len(processed_names) == 0:
+		return
+	ledger = open_subject_ledger(data_root, site, subject)
+	if ledger is None:
+		return
+	with ledger:
+		ledger.advance(processed_names, state, qc_accepted=qc_accepted)
+
+# current UTC time in the format stored in the ledger (which sorts and compares correctly as text)
+def ledger_timestamp(unix_time=None):
+	if unix_time is None:
+		return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+	return datetime.datetime.fromtimestamp(unix_time, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+class DiaryLedger:
+	def __init__(self, path):
+		self.path = path
+		# a generous timeout, as the transcript side of the pipeline could be updating the same subject's ledger
+		self.connection = sqlite3.connect(path, timeout=60)
+		with self.connection:
+			self.connection.execute("CREATE TABLE IF NOT EXISTS diaries (raw_name TEXT PRIMARY KEY, processed_name TEXT NOT NULL, state TEXT NOT NULL, qc_accepted INTEGER, updated_at TEXT NOT NULL, " +
+									", ".join([x + "_at TEXT" for x in DIARY_STATES]) + ")")
+			self.connection.execute("CREATE INDEX IF NOT EXISTS diaries_by_state ON diaries (state, updated_at)")
+			self.connection.execute("CREATE INDEX IF NOT EXISTS diaries_by_processed_name ON diaries (processed_name)")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		self.connection.close()
+
+	def is_known(self, raw_name):
+		return self.connection.execute("SELECT 1 FROM diaries WHERE raw_name = ?", (raw_name,)).fetchone() is not None
+
+	# record newly found diaries, given as (raw name, processed name) pairs, all in one transaction
+	# returns the list of raw names that were actually new (anything already in the ledger is left as it is)
+	def discover(self, diaries):
+		timestamp = ledger_timestamp()
+		new_names = []
+		with self.connection:
+			for raw_name, processed_name in diaries:
+				cursor = self.connection.execute("INSERT OR IGNORE INTO diaries (raw_name, processed_name, state, updated_at, discovered_at) VALUES (?, ?, 'discovered', ?, ?)",
+												 (raw_name, processed_name, timestamp, timestamp))
+				if cursor.rowcount > 0:
+					new_names.append(raw_name)
+		return new_names
+
+	# move the diaries with the given processed names forward to state, all in one transaction
+	# diaries are never moved backwards or to the state they are already in - so e.g. a pull marking pending does not touch anything already returned,
+	# and a diary that is still pending keeps the time it first became pending. any states skipped over get the same timestamp
+	# qc_accepted can be a single value for all the diaries or a list matching processed_names
+	# state must be one of the states after discovered, raises ValueError otherwise
+	def advance(self, processed_names, state, qc_accepted=None):
+		if state not in DIARY_STATES[1:]:
+			# discovered is only ever set by discover, nothing can move forward into it
+			raise ValueError("cannot advance diaries to state " + str(state) + ", must be one of " + ", ".join(DIARY_STATES[1:]))
+		timestamp = ledger_timestamp()
+		state_index = DIARY_STATES.index(state)
+		if not isinstance(qc_accepted, list):
+			qc_accepted = [qc_accepted for x in processed_names]
+		set_clause = ", ".join([x + "_at = COALESCE(" + x + "_at, :timestamp)" for x in DIARY_STATES[1:state_index + 1]])
+		earlier_states = ", ".join(["'" + x + "'" for x in DIARY_STATES[:state_index]])
+		with self.connection:
+			for name, accepted in zip(processed_names, qc_accepted):
+				self.connection.execute("UPDATE diaries SET state = :state, updated_at = :timestamp, qc_accepted = COALESCE(:accepted, qc_accepted), " + set_clause +
+										" WHERE processed_name = :name AND state IN (" + earlier_states + ")", {"state": state, "timestamp": timestamp, "accepted": accepted, "name": name})
+
+	# list of (raw name, processed name) for the diaries still to be converted, in raw name order
+	def todo(self):
+		return self.connection.execute("SELECT raw_name, processed_name FROM diaries WHERE state = 'discovered' ORDER BY raw_name").fetchall()
+
+	# list of (raw name, processed name, state, time of last change) for diaries that have sat in the same unfinished state for more than days
+	# finished means transcript redacted, or rejected by audio QC
+	def stuck(self, days):
+		cutoff = ledger_timestamp(datetime.datetime.now(datetime.timezone.utc).timestamp() - days*24*3600)
+		stuck_diaries = []
+		for state in DIARY_STATES[:-1]:
+			query = "SELECT raw_name, processed_name, state, updated_at FROM diaries WHERE state = ? AND updated_at < ?"
+			if state == "qcd":
+				query = query + " AND (qc_accepted IS NULL OR qc_accepted != 0)"
+			stuck_diaries.extend(self.connection.execute(query + " ORDER BY updated_at", (state, cutoff)).fetchall())
+		return stuck_diaries
+
+	# dict of state to the number of diaries currently in it
+	def state_counts(self):
+		return dict(self.connection.execute("SELECT state, COUNT(*) FROM diaries GROUP BY state").fetchall())
+
+	# list of (raw name, processed name, state) for every diary, in raw name order
+	def all_diaries(self):
+		return self.connection.execute("SELECT raw_name, processed_name, state FROM diaries ORDER BY raw_name").fetchall()
+
+	# one time import of an existing raw_file_tracking_system folder, after which the marker files (and folder) are removed
+	# TODO+ markers become discovered, and for converted markers the current state is worked out from which audio_journals folder the WAV is now in
+	# marker file times are used as the discovered time (and converted time, for converted markers), while any later state is timed from the migration,
+	# as that is the earliest it is actually known to have been reached. nothing is removed unless the whole import was committed
+	def migrate_markers(self, tracking_folder):
+		audio_journals_folder = os.path.dirname(os.path.abspath(tracking_folder))
+		folder_contents = {}
+		for folder in ["rejected_audio", "audio_to_send", "pending_audio", "completed_audio", os.path.join("transcripts", "redacted_copies")]:
+			cur_folder = os.path.join(audio_journals_folder, folder)
+			folder_contents[folder] = set(os.listdir(cur_folder)) if os.path.isdir(cur_folder) else set()
+
+		migration_time = ledger_timestamp()
+		rows = []
+		with os.scandir(tracking_folder) as markers:
+			for marker in markers:
+				if not marker.name.endswith(".txt") or not marker.is_file():
+					continue
+				with open(marker.path) as txt:
+					processed_name = txt.read().strip()
+				marker_time = ledger_timestamp(marker.stat().st_mtime)
+				if marker.name.startswith("TODO+"):
+					rows.append((marker.name[len("TODO+"):-len(".txt")], processed_name, "discovered", None, marker_time))
+					continue
+				wav_root = processed_name.split(".wav")[0]
+				if wav_root + "_REDACTED.txt" in folder_contents[os.path.join("transcripts", "redacted_copies")]:
+					state, accepted = "redacted", 1
+				elif processed_name in folder_contents["completed_audio"]:
+					state, accepted = "returned", 1
+				elif processed_name in folder_contents["pending_audio"]:
+					state, accepted = "sent", 1
+				elif processed_name in folder_contents["audio_to_send"]:
+					state, accepted = "qcd", 1
+				elif processed_name in folder_contents["rejected_audio"]:
+					state, accepted = "qcd", 0
+				else:
+					state, accepted = "converted", None
+				rows.append((marker.name[:-len(".txt")], processed_name, state, accepted, marker_time))
+
+		with self.connection:
+			for raw_name, processed_name, state, accepted, marker_time in rows:
+				state_times = {"discovered_at": marker_time}
+				if state != "discovered":
+					state_times["converted_at"] = marker_time
+				if state not in ["discovered", "converted"]:
+					state_times[state + "_at"] = migration_time
+				self.connection.execute("INSERT OR IGNORE INTO diaries (raw_name, processed_name, state, qc_accepted, updated_at, " + ", ".join(state_times.keys()) + ") VALUES (?, ?, ?, ?, ?" + ", ?"*len(state_times) + ")",
+										[raw_name, processed_name, state, accepted, state_times[state + "_at"]] + list(state_times.values()))
+
+		for marker in os.listdir(tracking_folder):
+			os.remove(os.path.join(tracking_folder, marker))
+		os.rmdir(tracking_folder)
+		print("Migrated " + str(len(rows)) + " raw_file_tracking_system markers into diary ledger " + self.path)
+		return len(rows)
+
+# ledger version of the raw_file_tracking_system checks in subject_summaries_update.sh, logging the same major issues to the subject's issues CSV
+# diaries never converted are logged as failed conversions, and converted diaries whose WAV is in none of the expected folders as missing audio
+# (filenames in the log are the equivalent marker names, so entries are consistent with those logged before the ledger)
+# also prints any diaries stuck in an unfinished state for more than stuck_days, for the monitoring logs
+def ledger_issue_check(data_root, site, subject, cur_date, stuck_days=14):
+	ledger = open_subject_ledger(data_root, site, subject)
+	if ledger is None:
+		return
+	with ledger:
+		all_diaries = ledger.all_diaries()
+		stuck_diaries = ledger.stuck(stuck_days)
+	audio_journals_folder = os.path.dirname(ledger_path(data_root, site, subject))
+	# one listing of each folder a converted WAV could be in, rather than checking each diary's file separately
+	wav_names = set()
+	for folder in ["completed_audio", "rejected_audio", "pending_audio", "crashed_audio", "audio_to_send", "temp_audio"]:
+		if os.path.isdir(os.path.join(audio_journals_folder, folder)):
+			wav_names.update(os.listdir(os.path.join(audio_journals_folder, folder)))
+
+	# failed conversions are all logged first, then missing audio, in the same order the marker file loops went in
+	issue_rows = []
+	for raw_name, processed_name, state in all_diaries:
+		if state == "discovered":
+			print("TODO+" + raw_name + ".txt failed ffmpeg conversion")
+			issue_rows.append(",".join([cur_date, site, subject, "TODO+" + raw_name + ".txt", "pre-wav", "Audio conversion to WAV failed"]))
+	for raw_name, processed_name, state in all_diaries:
+		if state != "discovered" and raw_name.startswith("U") and processed_name not in wav_names:
+			# may be normal if choose to clear out converted diaries for space, but not default
+			print("Failed to find corresponding audio under subject " + subject + " processed for raw diary record " + raw_name + ".txt")
+			issue_rows.append(",".join([cur_date, site, subject, raw_name + ".txt", "pre-wav", "Audio conversion to WAV marked as complete but subsequently missing (if not intentionally deleted definitely a problem)"]))
+	if len(issue_rows) > 0:
+		issues_path = os.path.join(audio_journals_folder, site + "_" + subject + "_audioJournalMajorIssuesLog.csv")
+		if not os.path.isfile(issues_path):
+			with open(issues_path, "w") as issues_log:
+				issues_log.write("date_detected,site,subject,filename,file_stage,error_message\n")
+		with open(issues_path, "a") as issues_log:
+			issues_log.write("\n".join(issue_rows) + "\n")
+
+	if len(stuck_diaries) > 0:
+		print("WARNING: " + str(len(stuck_diaries)) + " diaries from subject " + subject + " have been in the same unfinished pipeline state for over " + str(stuck_days) + " days:")
+		for raw_name, processed_name, state, updated_at in stuck_diaries:
+			print(processed_name + " (" + raw_name + ") - " + state + " since " + updated_at + " UTC")
+
+if __name__ == '__main__':
+	# Map command line arguments to function arguments.
+	# usage: python diary_ledger.py data_root site subject [todo | issues date | stuck days]
+	# todo prints the number of diaries waiting to be converted (0 for a subject with no ledger), issues runs ledger_issue_check for the summaries,
+	# stuck lists diaries that have not moved on in more than the given number of days (default 14), and with no command the count of diaries in each state is printed
+	try:
+		command = sys.argv[4]
+	except:
+		command = None
+	if command == "todo":
+		ledger = open_subject_ledger(sys.argv[1], sys.argv[2], sys.argv[3])
+		if ledger is None:
+			print(0)
+		else:
+			with ledger:
+				print(len(ledger.todo()))
+	elif command == "issues":
+		ledger_issue_check(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[5])
+	else:
+		ledger = open_subject_ledger(sys.argv[1], sys.argv[2], sys.argv[3])
+		if ledger is None:
+			print("No diary ledger found for subject " + sys.argv[3])
+			sys.exit()
+		with ledger:
+			if command == "stuck":
+				try:
+					stuck_days = float(sys.argv[5])
+				except:
+					stuck_days = 14
+				for raw_name, processed_name, state, updated_at in ledger.stuck(stuck_days):
+					print(processed_name + " (" + raw_name + ") - " + state + " since " + updated_at + " UTC")
+			else:
+				state_counts = ledger.state_counts()
+				for state in DIARY_STATES:
+					print(state + ": " + str(state_counts.get(state, 0)))
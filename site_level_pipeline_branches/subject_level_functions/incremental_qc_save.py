@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+
+# shared saving logic for the per subject QC outputs (diaryAudioQC and diaryTranscriptQC)
+# the QC scripts used to load the entire PROTECTED source CSV every run, concat the new rows, rewrite it, and then also fully rewrite the GENERAL DPDash copy
+# which means I/O every night grows with study length even though usually only a handful of new diaries are added
+# instead new rows are appended directly to the source CSV, and a small JSON sidecar next to it keeps track of what the DPDash copy currently contains
+# (its filename, day range, size, and the keys of its final day rows) so that it too can usually just be appended to and renamed if the day range changed
+# the sidecar also records whether each source column reads back as int or float, as the full rewrite writes a whole column as float (e.g. 3.0) once any row is NaN -
+# new rows are cast to match float columns before appending, and a column that would switch from int to float needs the full rewrite
+# whenever the sidecar doesn't match the files on disk (first run, manual edits to either CSV, new rows going back before the last day, column changes, etc.)
+# it falls back to the original full concat and rebuild, so the saved contents are always the same as before
+
+# main function to save new QC rows for a subject
+# qc_name is the suffix used in the file names (e.g. "diaryAudioQC"), dpdash_exclude_columns are any columns only kept in the PROTECTED source version
+def save_qc_rows(data_root, site, subject, new_csv, qc_name, dpdash_exclude_columns=[]):
+	source_folder = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "dpdash_source_csvs")
+	source_path = os.path.join(source_folder, site + "_" + subject + "_" + qc_name + ".csv")
+	state_path = os.path.join(source_folder, site + "_" + subject + "_" + qc_name + "_dpdashState.json")
+	dpdash_folder = os.path.join(data_root, "GENERAL", site, "processed", subject, "phone", "audio_journals")
+	dpdash_prefix = site[-2:] + "-" + subject + "-" + qc_name + "-day"
+
+	state = load_save_state(state_path)
+	# the sidecar is only trusted if the source CSV is exactly as the last save left it
+	if state is not None and (not os.path.isfile(source_path) or os.path.getsize(source_path) != state["source_size"]):
+		state = None
+
+	# first update the PROTECTED source CSV
+	final_save = None
+	append_csv = match_column_kinds(new_csv, state)
+	if append_csv is not None and can_append_csv(source_path, list(new_csv.columns)):
+		new_csv = append_csv
+		new_csv.to_csv(source_path, mode="a", header=False, index=False)
+		source_kinds = merge_column_kinds(state["source_kinds"], column_kinds(new_csv))
+	elif os.path.isfile(source_path):
+		# columns changed, file was otherwise modified, or a column now needs writing as float, so do original full concat instead
+		old_df = pd.read_csv(source_path)
+		final_save = pd.concat([old_df,new_csv]).reset_index(drop=True)
+		final_save.to_csv(source_path,index=False)
+		source_kinds = column_kinds(final_save)
+		state = None
+	else:
+		final_save = new_csv.copy()
+		final_save.to_csv(source_path,index=False)
+		source_kinds = column_kinds(final_save)
+		state = None
+	source_size = os.path.getsize(source_path)
+
+	if not os.path.isdir(dpdash_folder):
+		print("WARNING: correct folder structure does not exist for push of DPDash CSV to predict server, please fix for future monitoring updates")
+		# make sure next run rebuilds the DPDash copy from scratch
+		if os.path.isfile(state_path):
+			os.remove(state_path)
+		return
+
+	# now the GENERAL DPDash copy - try to just add the new rows first
+	dpdash_columns = [x for x in new_csv.columns if x not in dpdash_exclude_columns]
+	if state is not None and append_dpdash_rows(dpdash_folder, dpdash_prefix, new_csv[dpdash_columns], state):
+		state["source_size"] = source_size
+		state["source_kinds"] = source_kinds
+		write_save_state(state_path, state)
+		return
+
+	# otherwise rebuild the entire DPDash copy as before
+	if final_save is None:
+		final_save = pd.read_csv(source_path)
+	final_save.sort_values(by="day",inplace=True) # should already be sorted but ensure before grabbing day number for name
+	start_day = final_save["day"].dropna().tolist()[0]
+	end_day = final_save["day"].dropna().tolist()[-1]
+	# also drop any duplicates in case a diary got processed a second time - shouldn't happen via pipeline though!
+	final_save.drop_duplicates(subset=["day", "timeofday"],inplace=True)
+	final_save.drop(columns=dpdash_exclude_columns,inplace=True)
+	dpdash_name = dpdash_prefix + str(start_day) + "to" + str(end_day) + ".csv"
+	for old_dpdash in glob.glob(os.path.join(dpdash_folder, dpdash_prefix + "*.csv")):
+		os.remove(old_dpdash)
+	final_save.to_csv(os.path.join(dpdash_folder, dpdash_name),index=False)
+
+	state = {"source_size": source_size, "source_kinds": source_kinds, "columns": list(final_save.columns), "dpdash_name": dpdash_name,
+			 "dpdash_size": os.path.getsize(os.path.join(dpdash_folder, dpdash_name)), "start_day": start_day, "end_day": end_day,
+			 "end_day_keys": day_keys(final_save, end_day)}
+	write_save_state(state_path, state)
+
+# helper that tries to add new rows onto the existing DPDash copy described by state, returning False if a full rebuild is needed instead
+# this is only possible when the new rows all come on or after the current last day, so the file stays sorted by day
+# duplicates (by day and time of day) are dropped against the last day's rows and each other, keeping the first occurrence like the full rebuild
+def append_dpdash_rows(dpdash_folder, dpdash_prefix, new_rows, state):
+	dpdash_path = os.path.join(dpdash_folder, state["dpdash_name"])
+	if not os.path.isfile(dpdash_path) or os.path.getsize(dpdash_path) != state["dpdash_size"]:
+		return False
+	if list(new_rows.columns) != state["columns"] or not can_append_csv(dpdash_path, state["columns"]):
+		return False
+	if new_rows.shape[0] == 0:
+		return True
+	if new_rows["day"].isnull().any() or new_rows["day"].min() < state["end_day"]:
+		return False
+
+	new_rows = new_rows.sort_values(by="day", kind="mergesort")
+	seen_keys = set([tuple(x) for x in state["end_day_keys"]])
+	keep = []
+	for day,time in zip(new_rows["day"].tolist(), new_rows["timeofday"].tolist()):
+		key = (int(day), key_time(time))
+		keep.append(key not in seen_keys)
+		seen_keys.add(key)
+	new_rows = new_rows[keep]
+	if new_rows.shape[0] == 0:
+		# nothing actually changes in the DPDash copy
+		return True
+	new_rows.to_csv(dpdash_path, mode="a", header=False, index=False)
+
+	# rename when the day range grew
+	end_day = new_rows["day"].tolist()[-1]
+	if end_day != state["end_day"]:
+		state["end_day_keys"] = []
+	state["end_day_keys"] = state["end_day_keys"] + day_keys(new_rows, end_day)
+	dpdash_name = dpdash_prefix + str(state["start_day"]) + "to" + str(end_day) + ".csv"
+	if dpdash_name != state["dpdash_name"]:
+		os.rename(dpdash_path, os.path.join(dpdash_folder, dpdash_name))
+		dpdash_path = os.path.join(dpdash_folder, dpdash_name)
+	state["dpdash_name"] = dpdash_name
+	state["dpdash_size"] = os.path.getsize(dpdash_path)
+	state["end_day"] = end_day
+	return True
+
+# helper to check rows with the given columns can be appended directly to an existing CSV - header must match exactly and file must end on a complete line
+def can_append_csv(path, columns):
+	if not os.path.isfile(path) or os.path.getsize(path) == 0:
+		return False
+	with open(path, "rb") as f:
+		header = f.readline().decode("utf-8", errors="replace").rstrip("\r\n")
+		f.seek(-1, os.SEEK_END)
+		last_char = f.read(1)
+	return header == ",".join(columns) and last_char == b"\n"
+
+# dict of how each column of df reads back from CSV - "int", "float" (including columns with nothing but NaN), or "other"
+def column_kinds(df):
+	kinds = {}
+	for col in df.columns:
+		if pd.api.types.is_bool_dtype(df[col]):
+			kinds[col] = "other"
+		elif pd.api.types.is_integer_dtype(df[col]):
+			kinds[col] = "int"
+		elif pd.api.types.is_float_dtype(df[col]) or df[col].isnull().all():
+			kinds[col] = "float"
+		else:
+			kinds[col] = "other"
+	return kinds
+
+# kinds of the columns of a CSV after rows of new_kinds are appended to rows of old_kinds, the same as concat would give
+def merge_column_kinds(old_kinds, new_kinds):
+	kinds = {}
+	for col in old_kinds:
+		if "other" in [old_kinds[col], new_kinds[col]]:
+			kinds[col] = "other"
+		elif "float" in [old_kinds[col], new_kinds[col]]:
+			kinds[col] = "float"
+		else:
+			kinds[col] = "int"
+	return kinds
+
+# returns new_csv ready to be appended to the source CSV described by state, with int columns cast to float wherever the CSV already has that column as float
+# returns None instead if the rows can't be appended without changing how the existing rows would be written (or there is no trusted state to check against)
+def match_column_kinds(new_csv, state):
+	if state is None or "source_kinds" not in state or list(state["source_kinds"].keys()) != list(new_csv.columns):
+		return None
+	new_kinds = column_kinds(new_csv)
+	new_csv = new_csv.copy()
+	for col,kind in state["source_kinds"].items():
+		if kind == "float" and new_kinds[col] == "int":
+			new_csv[col] = new_csv[col].astype(float)
+		elif kind == "int" and new_kinds[col] == "float":
+			return None
+	return new_csv
+
+# list of JSON-friendly (day, time of day) keys for the rows of df on the given day
+def day_keys(df, day):
+	day_rows = df[df["day"] == day]
+	return [[int(day), key_time(x)] for x in day_rows["timeofday"].tolist()]
+
+# time of day values are strings or nan, use None for missing so keys match the way drop_duplicates treats nan as equal
+def key_time(time):
+	if isinstance(time, float) and np.isnan(time):
+		return None
+	return str(time)
+
+def load_save_state(state_path):
+	if not os.path.isfile(state_path):
+		return None
+	try:
+		with open(state_path) as f:
+			return json.load(f)
+	except:
+		# corrupted sidecar just means a full rebuild
+		return None
+
+def write_save_state(state_path, state):
+	# day values may be numpy types, convert for JSON
+	for k in ["start_day", "end_day"]:
+		state[k] = state[k].item() if hasattr(state[k], "item") else state[k]
+	with open(state_path + ".tmp", "w") as f:
+		json.dump(state, f)
+	os.replace(state_path + ".tmp", state_path)
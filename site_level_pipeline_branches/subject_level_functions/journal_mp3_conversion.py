@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from diary_ledger import open_subject_ledger, update_subject_ledger
+
+# converts the new journal MP3s set aside in raw_file_tracking_system to renamed WAVs in temp_audio, replacing the serial bash loop
+# ffmpeg is CPU-bound per file, so up to workers conversions are run at once - threads are enough here as all the real work happens in the ffmpeg child processes
+# each conversion can also be given a timeout in seconds, after which ffmpeg is killed and the diary is left marked TODO for the next run
+# as before, the TODO marker is only renamed once ffmpeg exits successfully and the output WAV is confirmed to exist
+# for subjects with a diary ledger, the TODO list comes from the ledger instead, and successfully converted diaries are marked as such there all at once at the end
+def convert_new_journals(data_root, site, subject, workers=1, timeout=None):
+	audio_journals_folder = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals")
+	ledger = open_subject_ledger(data_root, site, subject)
+	todo_list = []
+	if ledger is not None:
+		with ledger:
+			for raw_name, output_name in ledger.todo():
+				raw_path = os.path.join(data_root,"PROTECTED", site, "raw", subject, "phone", raw_name + ".mp3")
+				todo_list.append((None, raw_path, os.path.join("temp_audio", output_name)))
+		os.chdir(audio_journals_folder)
+	else:
+		try:
+			os.chdir(os.path.join(audio_journals_folder, "raw_file_tracking_system"))
+		except:
+			# should generally not reach this warning if calling from main pipeline bash script
+			print("WARNING: no diaries have been set aside for processing yet for input subject " + subject + ", or problem with input arguments")
+			return
+		# get raw path from marker filename and processed name from marker contents
+		for marker in sorted(glob.glob("TODO+*.txt")):
+			raw_name = marker.split("ODO+")[-1].split(".txt")[0]
+			raw_path = os.path.join(data_root,"PROTECTED", site, "raw", subject, "phone", raw_name + ".mp3")
+			with open(marker) as txt:
+				output_name = txt.read().strip()
+			todo_list.append((marker, raw_path, os.path.join("../temp_audio", output_name)))
+	if not os.path.isdir(os.path.join(audio_journals_folder, "temp_audio")):
+		os.mkdir(os.path.join(audio_journals_folder, "temp_audio"))
+	if len(todo_list) == 0:
+		print("WARNING: no new diaries to convert for input subject " + subject)
+		return
+
+	start_time = time.time()
+	convert = partial(convert_journal, timeout=timeout)
+	if workers > 1 and len(todo_list) > 1:
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			results = list(pool.map(lambda x: convert(*x), todo_list))
+	else:
+		results = [convert(*x) for x in todo_list]
+
+	print("Converted " + str(sum(results)) + " of " + str(len(todo_list)) + " new diaries for subject " + subject + " in " + str(round(time.time() - start_time, 2)) + " seconds using " + str(workers) + " ffmpeg worker(s)")
+	if ledger is not None:
+		update_subject_ledger(data_root, site, subject, [os.path.basename(x[2]) for x,y in zip(todo_list, results) if y], "converted")
+
+# helper that runs ffmpeg on a single diary and handles its TODO marker, returns True if the conversion was confirmed successful
+# called from within the raw_file_tracking_system folder, or with marker None (from the audio_journals folder) for a subject tracked by the diary ledger
+def convert_journal(marker, raw_path, output_path, timeout=None):
+	raw_name = os.path.basename(raw_path).split(".mp3")[0]
+	start_time = time.time()
+	try:
+		# -nostdin is needed so simultaneous ffmpeg processes do not compete over the terminal input of the main pipeline
+		result = subprocess.run(["ffmpeg", "-nostdin", "-i", raw_path, output_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+		success = (result.returncode == 0 and os.path.exists(output_path))
+	except subprocess.TimeoutExpired:
+		print("WARNING: WAV conversion for " + raw_name + " timed out after " + str(timeout) + " seconds")
+		success = False
+	except:
+		success = False
+	elapsed = round(time.time() - start_time, 2)
+
+	if not success:
+		# make sure no partial WAV is left behind for audio QC to pick up
+		if os.path.exists(output_path):
+			os.remove(output_path)
+		print("WARNING: issue with WAV conversion detected for " + raw_name)
+		return False
+
+	# confirm the converted file was created to then remove this diary from TODO
+	if marker is not None:
+		os.rename(marker, marker.replace("TODO+",""))
+	print(raw_name + " converted in " + str(elapsed) + " seconds")
+	return True
+
+if __name__ == '__main__':
+	# Map command line arguments to function arguments.
+	try:
+		workers=int(sys.argv[4])
+	except:
+		workers=1
+	try:
+		# a timeout of 0 (the default) means no limit
+		timeout=float(sys.argv[5])
+		if timeout <= 0:
+			timeout=None
+	except:
+		timeout=None
+	convert_new_journals(sys.argv[1], sys.argv[2], sys.argv[3], workers=workers, timeout=timeout)
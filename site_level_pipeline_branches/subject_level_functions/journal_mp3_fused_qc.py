@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import io
+import subprocess
+import numpy as np
+import soundfile as sf
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from accounting_index import load_accounting_index
+from diary_ledger import open_subject_ledger, update_subject_ledger
+from incremental_qc_save import save_qc_rows
+from audio_diary_qc import audio_journal_metadata, audio_data_qc, audio_approval, build_audio_qc_csv, EXTRA_FEATURE_HEADERS
+
+# fused alternative to the ffmpeg conversion loop of audio_side.sh followed by audio_diary_qc.py on temp_audio
+# for each diary marked TODO in raw_file_tracking_system, the raw MP3 is decoded once, audio QC is computed from the decoded samples in memory,
+# and the renamed WAV is written to temp_audio - no intermediate WAV is read back in for QC
+# QC rows and DPDash outputs are built and saved the exact same way as in audio_diary_qc, so the audio QC CSV is unchanged in format
+# only once those rows are saved are the WAVs moved into audio_to_send or rejected_audio based on the upload decision and their TODO markers renamed,
+# so if the run dies before then the WAVs are left in temp_audio for the crashed_audio handling of audio_side.sh, and the diaries are still TODO for the next run
+# for subjects with a diary ledger, the TODO list comes from the ledger instead, and diaries are marked QCed there (with their upload decision) at that same point
+def fused_mp3_audio_qc(data_root, site, subject, db_cutoff, length_cutoff, workers=1, flatness_engine="numpy", skip_rejected_flatness=False, extra_features=False):
+	audio_journals_folder = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals")
+	ledger = open_subject_ledger(data_root, site, subject)
+	if ledger is None:
+		try:
+			os.chdir(os.path.join(audio_journals_folder, "raw_file_tracking_system"))
+		except:
+			# should generally not reach this warning if calling from main pipeline bash script
+			print("WARNING: no diaries have been set aside for processing yet for input subject " + subject + ", or problem with input arguments")
+			return
+
+	# need output folders setup before proceeding as well - again this is just check for someone calling outside the scope of main pipeline
+	for folder in ["temp_audio", "dpdash_source_csvs", "audio_to_send", "rejected_audio"]:
+		if not os.path.isdir(os.path.join(audio_journals_folder, folder)):
+			print("WARNING: output folders not correctly set up yet for input subject " + subject + " - please address in order to save audio QC outputs")
+			return
+
+	# get raw MP3 path and processed WAV name for each diary still marked TODO
+	todo_list = []
+	if ledger is not None:
+		with ledger:
+			for raw_name, output_name in ledger.todo():
+				raw_path = os.path.join(data_root,"PROTECTED", site, "raw", subject, "phone", raw_name + ".mp3")
+				todo_list.append((output_name, None, raw_path))
+	else:
+		for marker in glob.glob("TODO+*.txt"):
+			raw_name = marker.split("ODO+")[-1].split(".txt")[0]
+			raw_path = os.path.join(data_root,"PROTECTED", site, "raw", subject, "phone", raw_name + ".mp3")
+			with open(marker) as txt:
+				output_name = txt.read().strip()
+			todo_list.append((output_name, marker, raw_path))
+	if len(todo_list) == 0:
+		print("WARNING: no new diaries to process for input subject " + subject)
+		return
+	# go in order of processed name, same as audio QC on temp_audio would have
+	# (sorted on the name alone, as the marker slot is None for ledger subjects and a processed name could repeat)
+	todo_list.sort(key=lambda x: x[0])
+
+	if extra_features and flatness_engine != "numpy":
+		print("NOTE: extra audio features are on, so mean_flatness comes from their shared built-in STFT and the " + flatness_engine + " flatness engine will not be used")
+
+	# get metadata columns from filename and accounting JSON up front
+	accounting_index = load_accounting_index(data_root, site, subject)
+	metadata = [audio_journal_metadata(x[0], accounting_index) for x in todo_list]
+
+	# now do the fused conversion and QC for each diary, in parallel when requested
+	# executor map returns results in input order, so rows stay aligned with the metadata list
+	os.chdir(audio_journals_folder)
+	diary_qc = partial(fused_diary_qc, db_cutoff=db_cutoff, length_cutoff=length_cutoff, flatness_engine=flatness_engine, skip_rejected_flatness=skip_rejected_flatness, extra_features=extra_features)
+	output_names = [x[0] for x in todo_list]
+	markers = [os.path.join("raw_file_tracking_system", x[1]) if x[1] is not None else None for x in todo_list]
+	raw_paths = [x[2] for x in todo_list]
+	sub_nums = [x[1] for x in metadata]
+	if workers > 1 and len(todo_list) > 1:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			results = list(pool.map(diary_qc, output_names, raw_paths, sub_nums))
+	else:
+		results = [diary_qc(x,y,z) for x,y,z in zip(output_names, raw_paths, sub_nums)]
+
+	# put together the new QC rows for everything that was successfully converted
+	values = [[] for x in range(10)]
+	extra_values = [[] for x in EXTRA_FEATURE_HEADERS]
+	for cur_meta,cur_result in zip(metadata,results):
+		if cur_result is None:
+			# conversion failed, warning already printed and diary is still marked TODO
+			continue
+		cur_qc, approval = cur_result
+		cur_day, cur_num, cur_time, cur_weekday, cur_hour, cur_consent = cur_meta
+		sec, mins, vol, mean_flat = cur_qc[:4]
+		for i,val in enumerate([cur_day, cur_time, cur_weekday, cur_num, cur_hour, mins, vol, mean_flat, cur_consent, approval]):
+			values[i].append(val)
+		for i,val in enumerate(cur_qc[4:]):
+			extra_values[i].append(val)
+	if len(values[0]) == 0:
+		return
+
+	new_csv = build_audio_qc_csv(site, subject, values, extra_values=extra_values if extra_features else None)
+	save_qc_rows(data_root, site, subject, new_csv, "diaryAudioQC")
+
+	# now that main audio QC stats CSV has been updated, move files and remove the converted diaries from TODO
+	for output_name,marker,cur_result in zip(output_names,markers,results):
+		if cur_result is None:
+			continue
+		if not os.path.exists(os.path.join("temp_audio",output_name)):
+			# a diary that maps to the same processed name as an earlier one in the list shares its WAV, which has already been moved
+			pass
+		elif cur_result[1] == 1:
+			os.rename(os.path.join("temp_audio",output_name),os.path.join("audio_to_send",output_name))
+		else:
+			os.rename(os.path.join("temp_audio",output_name),os.path.join("rejected_audio",output_name))
+		if marker is not None:
+			os.rename(marker, marker.replace("TODO+",""))
+	if ledger is not None:
+		update_subject_ledger(data_root, site, subject, [x for x,y in zip(output_names, results) if y is not None], "qcd", qc_accepted=[y[1] for y in results if y is not None])
+
+# helper that converts and QCs a single diary - run from the subject's audio_journals folder
+# the WAV is only written to temp_audio here, all moves and TODO/ledger updates are left to the main process once the QC rows are saved
+# returns tuple of (QC tuple, approval) on success, or None if the MP3 could not be decoded or the WAV could not be written
+# kept at module level with only picklable inputs/outputs so it can be mapped over a process pool
+def fused_diary_qc(output_name, raw_path, cur_num, db_cutoff=None, length_cutoff=None, flatness_engine="numpy", skip_rejected_flatness=False, extra_features=False):
+	try:
+		data, fs = decode_mp3(raw_path)
+	except:
+		print("WARNING: issue with WAV conversion detected for " + raw_path.split("/")[-1].split(".mp3")[0])
+		return None
+
+	# work with 16 bit samples so QC sees exactly what reading back the written WAV would give
+	# (soundfile scales 16 bit PCM by 1/32768 when loading as float)
+	float_data = data.astype(np.float64)/32768.0
+	compute_flatness = True
+	if skip_rejected_flatness and data.shape[0] > 0 and (float(data.shape[0])/fs < length_cutoff or cur_num > 1):
+		compute_flatness = False
+	cur_qc = audio_data_qc(float_data, fs, output_name, compute_flatness=compute_flatness, flatness_engine=flatness_engine, extra_features=extra_features)
+	approval = audio_approval(output_name, cur_num, cur_qc, db_cutoff, length_cutoff)
+
+	# now write the WAV to temp_audio, via a temporary name so a partial file never looks like a finished one
+	wav_path = os.path.join("temp_audio", output_name)
+	try:
+		sf.write(wav_path + ".part", data, fs, subtype="PCM_16", format="WAV")
+		os.rename(wav_path + ".part", wav_path)
+	except:
+		print("WARNING: issue with WAV conversion detected for " + raw_path.split("/")[-1].split(".mp3")[0])
+		if os.path.exists(wav_path + ".part"):
+			os.remove(wav_path + ".part")
+		return None
+	return (cur_qc, approval)
+
+# helper that decodes an MP3 into a 16 bit sample array (samples by channels for stereo) and its sampling rate
+# soundfile can decode MP3 directly with libsndfile >= 1.1, for older builds ffmpeg decodes straight into memory instead
+# note decoders can differ very slightly from the ffmpeg to WAV conversion of the regular pipeline, well below the precision QC values are saved at
+def decode_mp3(raw_path):
+	try:
+		return sf.read(raw_path, dtype="int16")
+	except:
+		if not os.path.isfile(raw_path):
+			raise
+		# AU output is used for the pipe because its header allows an unknown data length, unlike WAV
+		result = subprocess.run(["ffmpeg", "-nostdin", "-i", raw_path, "-f", "au", "-acodec", "pcm_s16be", "pipe:1"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+		return sf.read(io.BytesIO(result.stdout), dtype="int16")
+
+if __name__ == '__main__':
+	# Map command line arguments to function arguments.
+	try:
+		workers=int(sys.argv[6])
+	except:
+		workers=1
+	try:
+		flatness_engine=sys.argv[7]
+	except:
+		flatness_engine="numpy"
+	try:
+		skip_rejected_flatness=sys.argv[8] in ["Y","y"]
+	except:
+		skip_rejected_flatness=False
+	try:
+		extra_features=sys.argv[9] in ["Y","y"]
+	except:
+		extra_features=False
+	fused_mp3_audio_qc(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]), workers=workers, flatness_engine=flatness_engine, skip_rejected_flatness=skip_rejected_flatness, extra_features=extra_features)
@@ -1,25 +1,15 @@
 #!/usr/bin/env python
 
-import pysftp
 import os
 import sys
 
-# make sure if paramiko throws an error it will get mentioned in log files
-import logging
-logging.basicConfig()
+from transcribeme_sftp_session import TranscribeMeSession
+from diary_ledger import update_subject_ledger
 
-def transcript_pull(data_root, site, subject, username, password, transcription_language):
+def transcript_pull(data_root, site, subject, username, password, transcription_language, session=None):
 	# track transcripts that got properly pulled this time, for use in cleaning up server later
 	successful_transcripts = []
 
-	# hardcode the basic properties for the transcription service, password is only sftp-related input for now
-	source_directory = "output" 
-	# also specify input directory for cleanup of finished audio
-	input_directory = "audio"
-	# need to ensure transcribeme is actually putting .txt files into the top level output directory as they are done consistently
-	# (hasn't really been a problem for interviews for this project though thankfully)
-	host = "sftp.transcribeme.com"
-
 	try:
 		directory = os.path.join(data_root, "PROTECTED", site, "processed", subject, "phone", "audio_journals", "pending_audio")
 		os.chdir(directory) 
@@ -35,54 +25,15 @@ def transcript_pull(data_root, site, subject, username, password, transcription_
 		print("WARNING: no actual pending audio to check for subject " + subject)
 		return
 
-	# now actually attempt to establish SFTP connection for all (available) pull for this subject
-	# give it a few tries before falling back
-	count = 0
-	connect_pending = True
-	while connect_pending and count < 10:
-		try:
-			cnopts = pysftp.CnOpts()
-			cnopts.hostkeys = None # ignore hostkey
-			with pysftp.Connection(host, username=username, password=password, cnopts=cnopts) as sftp:
-				# loop through WAV files marked as currently pending 
-				for filename in cur_pending:
-					# setup expected source filepath and desired destination filepath
-					rootname = filename.split(".wav")[0]
-					transname = rootname + ".txt"
-					# need to add language marker in for lookup on transcribeme side
-					transname_lookup = rootname.split("submission")[0] + transcription_language + "_submission" + rootname.split("submission")[1] + ".txt"
-					src_path = os.path.join(source_directory, transname_lookup)
-					local_path = os.path.join(data_root, "PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts", transname)
-					if sftp.exists(src_path): # check if the transcript has been transcribed yet and if so try to get it
-						sftp.get(src_path, local_path) # pull it if available
-						# append pending WAV name to list for later local audio renaming/other tracking
-						successful_transcripts.append(filename) # if we reach this line it means transcript has been successfully pulled onto PHOENIX
-						print("New transcript " + transname + " successfully pulled")
-
-						# additionally, do cleanup on transcribemes server for this file
-						# will remove audio, as they do not need it anymore
-						match_name = transname_lookup.split(".txt")[0] 
-						match_audio = match_name + ".wav"
-						remove_path = os.path.join(input_directory, match_audio)
-						# will also move the pulled transcript into an archive subfolder of output on their server (organized by site)
-						cur_path = os.path.join(source_directory, transname_lookup)
-						archive_name = site + "_journals_archive"
-						archive_path = os.path.join(source_directory, archive_name, transname_lookup)
-						archive_folder = os.path.join(source_directory, archive_name)
-						if not sftp.exists(archive_folder):
-							sftp.mkdir(archive_folder)
-						sftp.rename(cur_path, archive_path)
-						sftp.remove(remove_path) 
-				# if get to this point connection was fully successful, can stop loop after doing pushes
-				connect_pending = False	
-		except:
-			# here will increment counter and possibly try again
-			count = count + 1 
-			if count == 10:
-				print("WARNING: connections to TranscribeMe's SFTP server failed when attempting to pull transcripts for subject " + subject)
-			else:
-				# but do short delay first
-				time.sleep(5) # waiting 5 seconds before reattempting connection
+	# now actually attempt the SFTP pull for this subject, over the given site-wide session if there is one
+	# the session gives it a few tries before falling back
+	if session is None:
+		with TranscribeMeSession(username, password) as subject_session:
+			pull_success = subject_session.run(lambda sftp: pull_transcripts(sftp, subject_session.listdir("output"), data_root, site, subject, transcription_language, cur_pending, successful_transcripts))
+	else:
+		pull_success = session.run(lambda sftp: pull_transcripts(sftp, session.listdir("output"), data_root, site, subject, transcription_language, cur_pending, successful_transcripts))
+	if not pull_success:
+		print("WARNING: connections to TranscribeMe's SFTP server failed when attempting to pull transcripts for subject " + subject)
 
 	# log some very basic info about success of script
 	print("Final for subject " + subject + ": " + str(len(successful_transcripts)) + " total new transcripts pulled (" + str(len(cur_pending)-len(successful_transcripts)) + " remain pending)")
@@ -92,8 +43,89 @@ def transcript_pull(data_root, site, subject, username, password, transcription_
 	for transcript in successful_transcripts:
 		pending_rename = os.path.join(data_root, "PROTECTED", site, "processed", subject, "phone", "audio_journals", "completed_audio", transcript)
 		os.rename(transcript,pending_rename)
+	# for subjects tracked by the diary ledger, record the pulled transcripts, and (when the server was actually checked) the ones still not ready
+	update_subject_ledger(data_root, site, subject, successful_transcripts, "returned")
+	if pull_success:
+		update_subject_ledger(data_root, site, subject, [x for x in cur_pending if x not in successful_transcripts], "pending")
+
+# helper that pulls any finished transcripts for the subject's pending WAV files (cur_pending) from TranscribeMe over the open connection sftp
+# which transcripts are ready is looked up in output_listing, the set of names in TranscribeMe's output folder (listed once per session), rather than asking the server about each pending file
+# pulled WAV names are added to successful_transcripts - can be repeated after a failure part way through, as once all the gets finish each transcript is archived on the server
+# only after its audio there is removed, so a transcript still in the top level output folder always has its server cleanup still to do
+def pull_transcripts(sftp, output_listing, data_root, site, subject, transcription_language, cur_pending, successful_transcripts):
+	# hardcode the basic properties for the transcription service
+	source_directory = "output" 
+	# also specify input directory for cleanup of finished audio
+	input_directory = "audio"
+	# need to ensure transcribeme is actually putting .txt files into the top level output directory as they are done consistently
+	# (hasn't really been a problem for interviews for this project though thankfully)
+	# pulled transcripts are moved into an archive subfolder of output on their server (organized by site)
+	archive_name = site + "_journals_archive"
+	archive_folder = os.path.join(source_directory, archive_name)
+
+	# match pending WAV files against what is available
+	to_pull = []
+	for filename in cur_pending:
+		rootname = filename.split(".wav")[0]
+		# need to add language marker in for lookup on transcribeme side
+		transname_lookup = rootname.split("submission")[0] + transcription_language + "_submission" + rootname.split("submission")[1] + ".txt"
+		if transname_lookup in output_listing: # check if the transcript has been transcribed yet
+			to_pull.append((filename, rootname + ".txt", transname_lookup))
+	if len(to_pull) == 0:
+		return
+
+	# first pull all of the available transcripts
+	for filename, transname, transname_lookup in to_pull:
+		local_path = os.path.join(data_root, "PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts", transname)
+		sftp.get(os.path.join(source_directory, transname_lookup), local_path)
+		# append pending WAV name to list for later local audio renaming/other tracking
+		if filename not in successful_transcripts:
+			successful_transcripts.append(filename) # if we reach this line it means transcript has been successfully pulled onto PHOENIX
+			print("New transcript " + transname + " successfully pulled")
+
+	# then do cleanup on transcribemes server for these files
+	if archive_name not in output_listing:
+		sftp.mkdir(archive_folder)
+		output_listing.add(archive_name)
+	for filename, transname, transname_lookup in to_pull:
+		# will also remove audio, as they do not need it anymore - done before the transcript is archived, so a dropped connection in between leaves it to be redone
+		# (audio already gone means an earlier attempt removed it before failing)
+		try:
+			sftp.remove(os.path.join(input_directory, transname_lookup.split(".txt")[0] + ".wav"))
+		except FileNotFoundError:
+			pass
+		sftp.rename(os.path.join(source_directory, transname_lookup), os.path.join(archive_folder, transname_lookup))
+		output_listing.discard(transname_lookup)
+
+# batch version of transcript_pull for every subject in a site with audio pending transcription, all over one SFTP session
+# so the SSH handshake is paid once per site rather than once per subject - an already open session can also be given. transcripts and completed_audio folders are made where needed
+def site_transcript_pull(data_root, site, username, password, transcription_language, session=None):
+	data_root = os.path.abspath(data_root) # subject level function changes directories
+	processed_folder = os.path.join(data_root, "PROTECTED", site, "processed")
+	if not os.path.isdir(processed_folder):
+		print("WARNING: invalid data root path " + data_root + " or site ID " + site + ", as necessary base folder structure does not exist")
+		return
+	if session is None:
+		# a session that the caller passes in is left open for them to close
+		with TranscribeMeSession(username, password) as site_session:
+			site_transcript_pull(data_root, site, username, password, transcription_language, session=site_session)
+		return
+	for subject in sorted(os.listdir(processed_folder)):
+		audio_journals_folder = os.path.join(processed_folder, subject, "phone", "audio_journals")
+		if not os.path.isdir(os.path.join(audio_journals_folder, "pending_audio")) or len(os.listdir(os.path.join(audio_journals_folder, "pending_audio"))) == 0:
+			continue
+		for folder in ["transcripts", "completed_audio"]:
+			if not os.path.isdir(os.path.join(audio_journals_folder, folder)):
+				os.mkdir(os.path.join(audio_journals_folder, folder))
+		print("Starting TranscribeMe pull attempt for subject " + subject + " as pending audios were detected")
+		transcript_pull(data_root, site, subject, username, password, transcription_language, session=session)
 
 if __name__ == '__main__':
 	# Map command line arguments to function arguments.
-	transcript_pull(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6])
+	# usage: python journal_transcribeme_sftp_pull.py data_root site subject username password language
+	# giving the keyword site in place of a subject ID pulls for every subject of the site over one SFTP session
+	if sys.argv[3] == "site":
+		site_transcript_pull(sys.argv[1], sys.argv[2], sys.argv[4], sys.argv[5], sys.argv[6])
+	else:
+		transcript_pull(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6])
     
\ No newline at end of file
@@ -1,18 +1,17 @@
 #!/usr/bin/env python
 
-import pysftp
 import os
 import shutil
 import sys
-import time
 from pathlib import Path
 from typing import Dict, Optional
 import pandas as pd
 import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
-# make sure if paramiko throws an error it will get mentioned in log files
-import logging
-logging.basicConfig()
+from transcribeme_sftp_session import TranscribeMeSession
+from diary_ledger import update_subject_ledger
 
 def map_transcription_language(language_code: int) -> str:
 	"""
@@ -135,14 +134,10 @@ def get_transcription_language(subject_id: str, study: str, data_root: Path) ->
 
 	return map_transcription_language(int(language_code))
 
-def transcript_push(data_root, site, subject, username, password, transcription_language):
+def transcript_push(data_root, site, subject, username, password, transcription_language, session=None, upload_workers=1):
 	# initialize list to keep track of which audio files will need to be moved at end of patient run
 	push_list = []
 
-	# hardcode the basic properties for the transcription service, as these shouldn't change
-	destination_directory = "audio"
-	host = "sftp.transcribeme.com"
-
 	try:
 		directory = os.path.join(data_root, "PROTECTED", site, "processed", subject, "phone", "audio_journals", "audio_to_send")
 		os.chdir(directory) 
@@ -160,43 +155,117 @@ def transcript_push(data_root, site, subject, username, password, transcription_
 		print(f"Using default transcription language: {transcription_language}")
 		pass
 
-	# now actually attempt to establish SFTP connection for all push for this subject
-	# give it a few tries before falling back
-	count = 0
-	connect_pending = True
-	while connect_pending and count < 10:
-		try:
-			cnopts = pysftp.CnOpts()
-			cnopts.hostkeys = None # ignore hostkey
-			with pysftp.Connection(host, username=username, password=password, cnopts=cnopts) as sftp:
-				# loop through the WAV files in to_send, push them to TranscribeMe
-				for filename in os.listdir("."):
-					if not filename.endswith(".wav"): # should always only be WAV if called from pipeline, but double check
-						continue 
-					# source filepath is just filename, setup desired destination path
-					filename_with_lang = filename.split("submission")[0] + transcription_language + "_submission" + filename.split("submission")[1]
-					dest_path = os.path.join(destination_directory, filename_with_lang)
-					if not sftp.exists(dest_path): # double check in case gets part way through loop on one connection for some reason
-						sftp.put(filename, dest_path)
-					push_list.append(filename) # if get to this point push was successful, add to list
-				# if get to this point connection was fully successful, can stop loop after doing pushes
-				connect_pending = False	
-		except:
-			# any files that had problem with push will still be in to_send after this script runs, so can just pass here
-			# in future may try to catch specific types of errors to identify when the problem is incorrect login info versus something else 
-			# (in the past have run out of storage space in the input folder, not sure if that specific issue could be caught by the python errors though)
-			
-			# here will increment counter and possibly try again
-			count = count + 1 
-			# but do short delay first
-			time.sleep(5) # waiting 5 seconds before reattempting connection
+	# now actually attempt the SFTP push for this subject, over the given site-wide session if there is one
+	# the session gives it a few tries before falling back
+	# any files that had problem with push will still be in to_send after this script runs, so nothing else needs to be done on failure
+	# in future may try to catch specific types of errors to identify when the problem is incorrect login info versus something else 
+	# (in the past have run out of storage space in the input folder, not sure if that specific issue could be caught by the python errors though)
+	if session is None:
+		with TranscribeMeSession(username, password) as subject_session:
+			subject_session.run(lambda sftp: push_audio_files(sftp, transcription_language, push_list, session=subject_session, upload_workers=upload_workers))
+	else:
+		session.run(lambda sftp: push_audio_files(sftp, transcription_language, push_list, session=session, upload_workers=upload_workers))
 		
 	# now move all the successfully uploaded files from to_send to pending_audio
 	for filename in push_list:
 		new_path = "../pending_audio/" + filename
 		# move the file lcoally
 		shutil.move(filename, new_path)
+	# and record the uploads for subjects tracked by the diary ledger
+	update_subject_ledger(data_root, site, subject, push_list, "sent")
+
+# helper that pushes all the WAV files in the current directory (to_send for a subject) to TranscribeMe over the open connection sftp
+# successfully uploaded filenames are added to push_list - can be repeated after a failure part way through, as files already fully on the server are skipped
+# with upload_workers above 1, up to that many files are uploaded at once, each over its own SFTP channel opened from session on the same SSH connection
+def push_audio_files(sftp, transcription_language, push_list, session=None, upload_workers=1):
+	destination_directory = "audio"
+	# loop through the WAV files in to_send, setting up the TranscribeMe destination for each
+	uploads = []
+	for filename in os.listdir("."):
+		if not filename.endswith(".wav"): # should always only be WAV if called from pipeline, but double check
+			continue 
+		# source filepath is just filename, setup desired destination path
+		filename_with_lang = filename.split("submission")[0] + transcription_language + "_submission" + filename.split("submission")[1]
+		uploads.append((filename, os.path.join(destination_directory, filename_with_lang)))
+
+	if upload_workers <= 1 or session is None or len(uploads) <= 1:
+		for filename, dest_path in uploads:
+			upload_audio_file(sftp, filename, dest_path)
+			if filename not in push_list:
+				push_list.append(filename) # if get to this point push was successful, add to list
+		return
+
+	# concurrent version - each worker thread takes a free channel for each of its uploads
+	channels = session.open_channels(min(upload_workers, len(uploads)))
+	free_channels = queue.Queue()
+	for channel in channels:
+		free_channels.put(channel)
+	def upload_with_free_channel(filename, dest_path):
+		channel = free_channels.get()
+		try:
+			upload_audio_file(channel, filename, dest_path)
+		finally:
+			free_channels.put(channel)
+	try:
+		with ThreadPoolExecutor(max_workers=len(channels)) as executor:
+			futures = [executor.submit(upload_with_free_channel, filename, dest_path) for filename, dest_path in uploads]
+		# all uploads are done at this point, so record every successful one before raising any problem for the session to retry
+		upload_error = None
+		for (filename, dest_path), future in zip(uploads, futures):
+			if future.exception() is not None:
+				upload_error = future.exception()
+			elif filename not in push_list:
+				push_list.append(filename)
+		if upload_error is not None:
+			raise upload_error
+	finally:
+		for channel in channels:
+			channel.close()
+
+# helper that uploads a single WAV file, unless the server already has the whole file (in case gets part way through on one connection for some reason)
+# the remote file size is compared against the local one to verify the upload, raising an error if they differ - so it won't be moved to pending_audio
+def upload_audio_file(sftp, filename, dest_path):
+	local_size = os.path.getsize(filename)
+	try:
+		remote_size = sftp.stat(dest_path).st_size
+	except IOError:
+		remote_size = None # not on the server yet
+	if remote_size != local_size:
+		remote_size = sftp.put(filename, dest_path).st_size
+	if remote_size != local_size:
+		raise IOError("size of " + dest_path + " on TranscribeMe server does not match local " + filename + " after upload")
+
+# batch version of transcript_push for every subject in a site with audio waiting in to_send, all over one SFTP session
+# so the SSH handshake is paid once per site rather than once per subject - an already open session can also be given
+def site_transcript_push(data_root, site, username, password, transcription_language, upload_workers=1, session=None):
+	data_root = os.path.abspath(data_root) # subject level function changes directories
+	processed_folder = os.path.join(data_root, "PROTECTED", site, "processed")
+	if not os.path.isdir(processed_folder):
+		print("WARNING: invalid data root path " + data_root + " or site ID " + site + ", as necessary base folder structure does not exist")
+		return
+	if session is None:
+		# a session that the caller passes in is left open for them to close
+		with TranscribeMeSession(username, password) as site_session:
+			site_transcript_push(data_root, site, username, password, transcription_language, upload_workers=upload_workers, session=site_session)
+		return
+	for subject in sorted(os.listdir(processed_folder)):
+		audio_journals_folder = os.path.join(processed_folder, subject, "phone", "audio_journals")
+		if not os.path.isdir(os.path.join(audio_journals_folder, "audio_to_send")) or len(os.listdir(os.path.join(audio_journals_folder, "audio_to_send"))) == 0:
+			continue
+		if not os.path.isdir(os.path.join(audio_journals_folder, "pending_audio")):
+			os.mkdir(os.path.join(audio_journals_folder, "pending_audio"))
+		print("Pushing audio to TranscribeMe for subject " + subject)
+		transcript_push(data_root, site, subject, username, password, transcription_language, session=session, upload_workers=upload_workers)
 
 if __name__ == '__main__':
 	# Map command line arguments to function arguments.
-	transcript_push(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6])
+	# usage: python journal_transcribeme_sftp_push.py data_root site subject username password language [upload workers, default 1]
+	# giving the keyword site in place of a subject ID pushes for every subject of the site over one SFTP session
+	try:
+		upload_workers = int(sys.argv[7])
+	except:
+		upload_workers = 1
+	if sys.argv[3] == "site":
+		site_transcript_push(sys.argv[1], sys.argv[2], sys.argv[4], sys.argv[5], sys.argv[6], upload_workers=upload_workers)
+	else:
+		transcript_push(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6], upload_workers=upload_workers)
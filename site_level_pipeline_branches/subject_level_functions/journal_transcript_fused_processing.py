@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import io
+import re
+import sys
+import pandas as pd
+
+from accounting_index import load_accounting_index
+from diary_ledger import update_subject_ledger
+from incremental_qc_save import save_qc_rows
+from phone_transcript_redaction import redact_lines
+from transcript_csv_conversion import transcript_to_csv
+from transcript_diary_qc import transcript_metadata, load_transcript_csv, batch_transcript_qc, build_transcript_qc_csv
+from phone_transcript_sentence_stats import sentence_stats, lookup_audio_duration, disfluency_summary_values, save_disfluency_rows
+
+# fused alternative to running phone_transcript_redaction.py, transcript_csv_conversion.py, transcript_diary_qc.py, and phone_transcript_sentence_stats.py in turn
+# those each read every new transcript from disk again in its latest form, while here each new transcript is read just once -
+# the redacted text is kept in memory for CSV conversion, and the CSV text for one shared DF load that both the QC and sentence stats use
+# every output is still written to the same place, with the same contents as the separate scripts would make
+# (each stage also still picks up anything left for it on disk by a previous run, e.g. a CSV without sentence stats yet, and reads that file instead)
+def fused_transcript_processing(data_root, site, subject):
+	audio_journals_folder = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals")
+	try:
+		os.chdir(os.path.join(audio_journals_folder, "transcripts"))
+	except:
+		# should generally not reach this warning if calling from main pipeline bash script
+		print("WARNING: no transcripts yet for input subject " + subject + ", or problem with input arguments")
+		return
+
+	# need output folders setup before proceeding as well - again this is just check for someone calling outside the scope of main pipeline
+	for folder in [os.path.join("transcripts", "redacted_copies", "csv"), os.path.join("transcripts", "redacted_csvs_with_stats"), "dpdash_source_csvs"]:
+		if not os.path.isdir(os.path.join(audio_journals_folder, folder)):
+			print("WARNING: output folders not correctly set up yet for input subject " + subject + " - please address in order to save transcript processing outputs")
+			return
+
+	# first redaction of any transcripts not redacted yet
+	# redacted contents are kept as the bytes actually written, for the encoding check during CSV conversion and QC
+	redacted_bytes = {}
+	for trans in sorted(glob.glob("*.txt")):
+		redacted_trans_name = trans.split(".txt")[0] + "_REDACTED.txt"
+		if os.path.isfile(os.path.join("redacted_copies",redacted_trans_name)):
+			continue
+		try:
+			with open(trans, 'r') as input_file:
+				# remove white space characters from the ends of the lines for cleaning
+				input_lines = [line.rstrip() for line in input_file.readlines()]
+		except UnicodeDecodeError:
+			# skipped the same way as in the standalone redaction
+			print("WARNING: found transcript that is not UTF-8 encoded, this may cause issues with the automatic redaction! It will be completely skipped for now, please review in main transcripts folder manually")
+			continue
+		redacted_text = redact_lines(input_lines, trans)
+		if redacted_text is None:
+			continue
+		# saved via a temporary name like the standalone redaction, so a partial file never looks like a finished one
+		with open(os.path.join("redacted_copies",redacted_trans_name + ".part"), 'w') as output_file:
+			output_file.write(redacted_text)
+			redacted_bytes[redacted_trans_name] = redacted_text.encode(output_file.encoding)
+		os.replace(os.path.join("redacted_copies",redacted_trans_name + ".part"), os.path.join("redacted_copies",redacted_trans_name))
+	print(str(len(redacted_bytes)) + " total transcripts newly redacted for subject " + subject)
+	update_subject_ledger(data_root, site, subject, [x.split("_REDACTED.txt")[0] + ".wav" for x in redacted_bytes], "redacted")
+
+	# next CSV conversion of any redacted transcripts without a CSV yet
+	os.chdir("redacted_copies")
+	csv_texts = {}
+	for trans in sorted(glob.glob("*.txt")):
+		# name matched the same way as in transcript_csv_conversion
+		trans_name = re.split(".txt", trans)[0]
+		if os.path.exists(os.path.join("csv", trans_name + ".csv")):
+			continue
+		print("New transcript to convert detected: " + trans)
+		csv_text = transcript_to_csv(trans, os.path.join("csv", trans_name + ".csv"), site, subject, trans_name, raw_bytes=redacted_bytes.get(trans))
+		if csv_text is not None:
+			csv_texts[trans_name + ".csv"] = csv_text
+	print(str(len(csv_texts)) + " total transcripts newly converted to CSV for subject " + subject)
+
+	# finally transcript QC and sentence stats, for each CSV that is missing either
+	os.chdir("csv")
+	cur_files = sorted([x for x in os.listdir(".") if x.endswith(".csv")])
+	if len(cur_files) == 0:
+		# should generally not reach this warning if calling from main pipeline bash script
+		print("WARNING: haven't generated any redacted transcript CSVs yet for input subject " + subject)
+		return
+	stats_root = os.path.join(audio_journals_folder, "transcripts", "redacted_csvs_with_stats")
+	source_folder = os.path.join(audio_journals_folder, "dpdash_source_csvs")
+
+	# same reference info as the separate QC and sentence stats scripts load
+	accounting_index = load_accounting_index(data_root, site, subject, output_name="transcript QC")
+	if os.path.isfile(os.path.join(source_folder, site + "_" + subject + "_" + "diaryTranscriptQC.csv")):
+		prev_trans_list = pd.read_csv(os.path.join(source_folder, site + "_" + subject + "_" + "diaryTranscriptQC.csv"), usecols=["redacted_csv_filename"])["redacted_csv_filename"].tolist()
+	else:
+		prev_trans_list = []
+	if not os.path.isfile(os.path.join(source_folder, site + "_" + subject + "_" + "diaryAudioQC.csv")):
+		print("WARNING: no audio QC found for subject " + subject + " - will proceed with process but sentence duration estimates will be incomplete, and this could be sign of a larger issue")
+		aud_qc_ref = pd.DataFrame()
+	else:
+		aud_qc_ref = pd.read_csv(os.path.join(source_folder, site + "_" + subject + "_" + "diaryAudioQC.csv"))
+
+	qc_pending = []
+	disf_values = [[] for x in range(9)]
+	new_count = 0
+	for filename in cur_files:
+		trans_name = filename.split(".csv")[0]
+		processed_trans_name = trans_name + "_withSentenceStats.csv"
+		need_qc = filename not in prev_trans_list
+		need_stats = not os.path.isfile(os.path.join(stats_root, processed_trans_name))
+		if not need_qc and not need_stats:
+			continue
+
+		# one load of the CSV for both steps, from memory when it was just converted
+		if filename in csv_texts:
+			cur_trans = load_transcript_csv(io.StringIO(csv_texts[filename]))
+		else:
+			cur_trans = load_transcript_csv(filename)
+
+		if need_qc:
+			# QC values themselves are computed for all new transcripts in one batch after the loop
+			qc_pending.append((filename, cur_trans, os.path.join(audio_journals_folder, "transcripts", "redacted_copies", trans_name + ".txt"),
+							   redacted_bytes.get(trans_name + ".txt"), transcript_metadata(filename, accounting_index)))
+
+		if need_stats:
+			cur_day = int(filename.split("_day")[-1].split("_")[0])
+			cur_sub_num = int(filename.split("_submission")[-1].split("_")[0])
+			cur_audio = lookup_audio_duration(aud_qc_ref, filename, cur_day, cur_sub_num)
+			# (sentence stats adds its columns onto the DF, but batch QC only uses the original ones)
+			cur_df = sentence_stats(filename, cur_trans, os.path.join(stats_root, processed_trans_name), audio_duration=cur_audio)
+			if not cur_df.empty:
+				new_count = new_count + 1
+				for i,val in enumerate(disfluency_summary_values(processed_trans_name, cur_day, cur_sub_num, cur_audio, cur_df)):
+					disf_values[i].append(val)
+
+	# save the new transcript QC rows exactly as transcript_diary_qc does
+	qc_rows = batch_transcript_qc([x[0] for x in qc_pending], [x[1] for x in qc_pending], [x[2] for x in qc_pending], txt_bytes_list=[x[3] for x in qc_pending])
+	qc_values = [[] for x in range(21)]
+	for cur_pending,cur_qc in zip(qc_pending, qc_rows):
+		for i,val in enumerate(list(cur_pending[4]) + cur_qc + [cur_pending[0]]):
+			qc_values[i].append(val)
+	new_csv = build_transcript_qc_csv(site, subject, qc_values)
+	save_qc_rows(data_root, site, subject, new_csv, "diaryTranscriptQC", dpdash_exclude_columns=["date_transcript_processed"])
+
+	print(str(new_count) + " total transcripts newly processed for subject " + subject)
+	if new_count > 0:
+		print("Finally, updating disfluencies summary stat table for " + subject + " with new data")
+		save_disfluency_rows(data_root, site, subject, disf_values)
+
+if __name__ == '__main__':
+	# Map command line arguments to function arguments.
+	fused_transcript_processing(sys.argv[1], sys.argv[2], sys.argv[3])
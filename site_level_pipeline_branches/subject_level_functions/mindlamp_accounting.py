@@ -2,14 +2,19 @@
 
 import os
 import sys
-import glob
-import json
+import fnmatch
 import datetime
 import pytz
 import pandas as pd
 import numpy as np
 
-def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed_language="ENGLISH"):
+from mindlamp_time_accounting import submission_time_accounting
+from mindlamp_activity_json import iter_activity_records
+from diary_ledger import open_subject_ledger
+
+# with use_ledger, new diaries are set aside for processing in the subject's SQLite diary ledger instead of raw_file_tracking_system marker files (see diary_ledger.py)
+# - existing marker files are migrated into the ledger when it is first made, and subjects that already have a ledger always use it
+def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed_language="ENGLISH", use_ledger=False):
 	# start by obtaining valid consent date for input subject ID
 	try:
 		study_metadata_path = os.path.join(data_root,"PROTECTED",site,site + "_metadata.csv")
@@ -37,7 +42,12 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 		print("WARNING: no PROTECTED phone data available for subject ID " + subject + ", or problem with input arguments") 
 		return
 
-	cur_files = glob.glob("*activity*.json")
+	# take one snapshot of the raw phone folder, used both for finding the JSONs and MP3s and for checking which expected MP3s exist
+	# JSON and MP3 name lists keep directory order and skip hidden names, just as glob would return them
+	with os.scandir(".") as raw_folder:
+		raw_entries = [(x.name, x.is_file()) for x in raw_folder]
+	raw_file_names = set([x for x,y in raw_entries if y])
+	cur_files = [x for x,y in raw_entries if not x.startswith(".") and fnmatch.fnmatch(x, "*activity*.json")]
 	if len(cur_files) == 0:
 		# should generally not reach this warning if calling from main pipeline bash script
 		print("WARNING: no active app data files available for subject ID " + subject)
@@ -45,9 +55,9 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 
 	if os.path.isfile(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals","file_accounting_details",site + "_" + subject + "_appActivitiesJSONAccounting.csv")):
 		old_json_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals","file_accounting_details",site + "_" + subject + "_appActivitiesJSONAccounting.csv"))
-		prev_json_paths = old_json_df["json_filename"].tolist()
+		prev_json_paths = set(old_json_df["json_filename"].tolist())
 	else:
-		prev_json_paths = []
+		prev_json_paths = set()
 	if os.path.isfile(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals","file_accounting_details",site + "_" + subject + "_audioJournalJSONRecordsInfo.csv")):
 		old_diary_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals","file_accounting_details",site + "_" + subject + "_audioJournalJSONRecordsInfo.csv"))
 		prev_diary_paths = old_diary_df["matching_mp3_absolute_raw_path"].tolist()
@@ -55,9 +65,9 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 		prev_diary_paths = []
 	if os.path.isfile(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals","file_accounting_details",site + "_" + subject + "_availablePhoneMP3sAccounting.csv")):
 		old_mp3_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals","file_accounting_details",site + "_" + subject + "_availablePhoneMP3sAccounting.csv"))
-		prev_mp3_paths = old_mp3_df["found_mp3_name"].tolist()
+		prev_mp3_paths = set(old_mp3_df["found_mp3_name"].tolist())
 	else:
-		prev_mp3_paths = []
+		prev_mp3_paths = set()
 
 	# initialize lists for high level active mindlamp json accounting
 	new_files = []
@@ -75,10 +85,11 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 			new_files.append(file)
 		diary_count = 0
 		ema_count = 0
+		# records are read one at a time rather than loading the whole (ever growing) JSON, keeping only the fields needed below
+		obj_count = 0
 		with open(file) as f:
-			cur_json = json.load(f)
-			obj_count = len(cur_json)
-			for obj in cur_json:
+			for obj in iter_activity_records(f):
+				obj_count = obj_count + 1
 				if "timestamp" not in obj:
 					# in testing every activity JSON had the timestamp field
 					# - but just to be safe so it doesn't crash for an entire subject due to a single file error
@@ -109,19 +120,11 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 
 	mindlamp_dates = [x.split("_")[3] + "-" + x.split("_")[4] + "-" + x.split("_")[5] if len(x.split("_"))==6 else np.nan for x in diary_root_filenames]
 	expected_absolute_paths = [os.path.join(data_root,"PROTECTED", site, "raw", subject, "phone", x + "_" + y.lower() + ".mp3") for x,y in zip(diary_root_filenames,sound_numbers)]
-	existence_boolean = [os.path.isfile(x) for x in expected_absolute_paths]
-	converted_times = [datetime.datetime.fromtimestamp(x/1000.0,tz=pytz.timezone(assumed_timezone)) for x in unix_timestamps]
-	converted_times_str = [x.strftime("%Y-%m-%d %H:%M:%S") for x in converted_times]
-	literal_day_numbers = [(x - consent_date).days + 1 for x in converted_times] # study day starts at 1 on day of consent, here not yet adjusting for late night
-	literal_submission_hours = [x.hour for x in converted_times]
-	submission_minute_stamp = [x.minute for x in converted_times]
-	# now push back day number by 1 if that submission took place before 4 am
-	# also make midnight 24, 1 am 25, 2 am 26, and 3 am 27 as far as hours, so that 4 is lowest
-	adjusted_day_numbers = [x - 1 if y < 4 else x for x,y in zip(literal_day_numbers,literal_submission_hours)]
-	adjusted_hour_numbers = [x + 24 if x < 4 else x for x in literal_submission_hours]
-	week_days = [((x.weekday() + 2) % 7) + 1 for x in converted_times] # use dpdash weekday convention for later steps
-	# need to adjust weekdays for late night submissions now similarly
-	week_days_adjusted = [x - 1 if (y < 4 and x > 1) else (7 if y < 4 else x) for x,y in zip(week_days,literal_submission_hours)]
+	existence_boolean = [x + "_" + y.lower() + ".mp3" in raw_file_names for x,y in zip(diary_root_filenames,sound_numbers)] # expected paths are all in the raw phone folder
+	# convert timestamps to local time and derive study day, weekday, hour, and minute for all the diary records at once
+	# study day starts at 1 on day of consent, with day number pushed back by 1 if that submission took place before 4 am
+	# also make midnight 24, 1 am 25, 2 am 26, and 3 am 27 as far as hours, so that 4 is lowest, and adjust weekdays for late night submissions similarly (using dpdash weekday convention for later steps)
+	converted_times_str, adjusted_day_numbers, week_days_adjusted, adjusted_hour_numbers, submission_minute_stamp = submission_time_accounting(unix_timestamps, consent_date, assumed_timezone)
 	consent_account = [consent_date_str for x in range(len(expected_absolute_paths))]
 	timezone_account = [assumed_timezone for x in range(len(expected_absolute_paths))]
 	language_setting = [assumed_language for x in range(len(expected_absolute_paths))]
@@ -152,9 +155,9 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 		diary_json_logs_full = diary_json_logs.copy() # will modify diary_json_logs later
 
 	cur_date = datetime.date.today().strftime("%Y-%m-%d")
-	cur_mp3s = glob.glob("*.mp3")
+	cur_mp3s = [x for x,y in raw_entries if not x.startswith(".") and fnmatch.fnmatch(x, "*.mp3")]
 	new_mp3s = [x for x in cur_mp3s if x not in prev_mp3_paths]
-	known_mp3_names = [x.split("/")[-1] for x in diary_json_logs_full["matching_mp3_absolute_raw_path"].tolist()]
+	known_mp3_names = set([x.split("/")[-1] for x in diary_json_logs_full["matching_mp3_absolute_raw_path"].tolist()])
 	mp3_found_boolean = [x in known_mp3_names for x in new_mp3s]
 	# in case an mp3 isn't found, also add a column checking for various mindlamp assumptions
 	mp3_gen_structure_check = [x[0]=="U" and len(x.split("_"))==8 and x.split("_")[1]==site and x.split("_")[2]=="activity" and x.split("_")[6]=="sound" and len(x.split("activity_")[-1].split("_sound")[0])==10 for x in new_mp3s]
@@ -179,6 +182,29 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 			basic_diary_logs = pd.concat([old_mp3_df,basic_diary_logs]).reset_index(drop=True)
 		basic_diary_logs.to_csv(os.path.join("file_accounting_details",site + "_" + subject + "_availablePhoneMP3sAccounting.csv"),index=False)
 
+	# the ledger is made here when turned on, even without new diaries today if there are marker files to migrate
+	ledger = open_subject_ledger(data_root, site, subject, create=use_ledger and (not diary_json_logs.empty or os.path.isdir("raw_file_tracking_system")))
+	if ledger is not None:
+		with ledger:
+			if not diary_json_logs.empty:
+				diary_json_logs_full.to_csv(os.path.join("file_accounting_details",site + "_" + subject + "_audioJournalJSONRecordsInfo.csv"),index=False)
+				print("Found new diaries to be processed for subject " + subject)
+				# make sure that the found diaries via JSON record check out with mp3 path before adding them to the ledger for next step
+				diary_json_logs = diary_json_logs[diary_json_logs["mp3_existence_check"]==True]
+				new_diaries = []
+				new_raw_names = set()
+				for raw_path,processed_path in zip(diary_json_logs["matching_mp3_absolute_raw_path"].tolist(),diary_json_logs["proposed_processed_name"].tolist()):
+					raw_name_check = raw_path.split(".mp3")[0].split("/")[-1]
+					# confirm that this file has definitely not already been processed
+					if raw_name_check in new_raw_names or ledger.is_known(raw_name_check):
+						print("WARNING: previously processed diary (" + raw_name_check + ") was detected as new today, skipping this one")
+						continue
+					new_diaries.append((raw_name_check, processed_path))
+					new_raw_names.add(raw_name_check)
+				# all of today's new diaries are recorded together in one transaction
+				ledger.discover(new_diaries)
+		return
+
 	if not diary_json_logs.empty:
 		diary_json_logs_full.to_csv(os.path.join("file_accounting_details",site + "_" + subject + "_audioJournalJSONRecordsInfo.csv"),index=False)
 		print("Found new diaries to be processed for subject " + subject)
@@ -188,21 +214,29 @@ def mindlamp_json_accounting(data_root, site, subject, assumed_timezone, assumed
 		
 		# make sure that the found diaries via JSON record check out with mp3 path before adding them to list for next step
 		diary_json_logs = diary_json_logs[diary_json_logs["mp3_existence_check"]==True]
+		# tracking files already present are looked up in one listing of the folder, which is kept up to date as new ones are written
+		with os.scandir("raw_file_tracking_system") as tracking_folder:
+			tracking_file_names = set([x.name for x in tracking_folder if x.is_file()])
 		for raw_path,processed_path in zip(diary_json_logs["matching_mp3_absolute_raw_path"].tolist(),diary_json_logs["proposed_processed_name"].tolist()):
 			raw_name_check = raw_path.split(".mp3")[0].split("/")[-1]
 			tracking_file_name = os.path.join("raw_file_tracking_system","TODO+" + raw_name_check + ".txt")
 			tracking_file_later_rename = os.path.join("raw_file_tracking_system",raw_name_check + ".txt")
 			# confirm that this file has definitely not already been processed
-			if os.path.isfile(tracking_file_name) or os.path.isfile(tracking_file_later_rename):
+			if "TODO+" + raw_name_check + ".txt" in tracking_file_names or raw_name_check + ".txt" in tracking_file_names:
 				print("WARNING: previously processed filename (" + tracking_file_later_rename + ") was detected as new today, skipping this one")
 				continue
 			# if wav files are deleted we can still easily track what has already been processed
 			with open(tracking_file_name,'w') as txt:
 				txt.write(processed_path) # put processed name inside the text file like I do for tracking interview pipeline
+			tracking_file_names.add("TODO+" + raw_name_check + ".txt")
 			
 if __name__ == '__main__':
 	# Map command line arguments to function arguments.
 	try:
-		mindlamp_json_accounting(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], assumed_language=sys.argv[5])
+		use_ledger = sys.argv[6] in ["Y","y"]
+	except:
+		use_ledger = False
+	try:
+		mindlamp_json_accounting(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], assumed_language=sys.argv[5], use_ledger=use_ledger)
 	except:
-		mindlamp_json_accounting(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
\ No newline at end of file
+		mindlamp_json_accounting(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], use_ledger=use_ledger)
\ No newline at end of file
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+
+# incremental reading of MindLAMP activity JSONs for mindlamp_accounting
+# each activity JSON is one top level list of records, that for long running participants can keep growing with every Lochness pull
+# so instead of loading the whole list at once, the file is read a chunk at a time and each record is decoded and handed back on its own,
+# keeping peak memory to about the chunk size plus the largest single record, no matter how large the file is
+
+ACTIVITY_CHUNK_SIZE = 1 << 16 # characters read from the file at a time
+JSON_WHITESPACE = re.compile("[ \t\n\r]*")
+JSON_NUMBER_CHARS = re.compile("[0-9eE.+-]*")
+
+# generator over the records of the activity JSON open as f, in file order
+# malformed JSON raises json.JSONDecodeError just like json.load would (though after the records before the problem have been given)
+# a file whose top level is not a list (never seen from MindLAMP) is instead loaded fully and iterated as json.load's result would be
+def iter_activity_records(f, chunk_size=ACTIVITY_CHUNK_SIZE):
+	decoder = json.JSONDecoder()
+	buf = ""
+	pos = 0
+	at_end = False
+
+	# helpers to read more of the file onto the buffer (dropping what was already decoded, and noting when the file is done),
+	# and to move past any whitespace to the next character, reading more when the buffer runs out first
+	def read_more(pos, buf, amount):
+		new_text = f.read(amount)
+		return buf[pos:] + new_text, 0, len(new_text) == 0
+	def skip_whitespace(pos, buf, at_end):
+		while True:
+			pos = JSON_WHITESPACE.match(buf, pos).end()
+			if pos < len(buf) or at_end:
+				return pos, buf, at_end
+			buf, pos, at_end = read_more(pos, buf, chunk_size)
+
+	pos, buf, at_end = skip_whitespace(pos, buf, at_end)
+	if pos >= len(buf) or buf[pos] != "[":
+		# not a list, so fall back to the regular full load of the rest of the file
+		yield from json.loads(buf[pos:] + f.read())
+		return
+	pos = pos + 1
+	pos, buf, at_end = skip_whitespace(pos, buf, at_end)
+	if pos < len(buf) and buf[pos] == "]":
+		pos = pos + 1
+	else:
+		while True:
+			# decode the next record, reading on (in growing amounts, for any very large record) until it is complete
+			# a bare number as a record could have been cut off by the end of the buffer, so it is only accepted once something other than number characters follows it
+			amount = chunk_size
+			while True:
+				try:
+					record, end = decoder.raw_decode(buf, pos)
+					if at_end or not isinstance(record, (int, float)) or JSON_NUMBER_CHARS.match(buf, end).end() < len(buf):
+						break
+				except json.JSONDecodeError:
+					if at_end:
+						raise
+				buf, pos, at_end = read_more(pos, buf, amount)
+				amount = amount * 2
+			yield record
+			pos, buf, at_end = skip_whitespace(end, buf, at_end)
+			if pos < len(buf) and buf[pos] == ",":
+				pos, buf, at_end = skip_whitespace(pos + 1, buf, at_end)
+			elif pos < len(buf) and buf[pos] == "]":
+				pos = pos + 1
+				break
+			else:
+				raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+	# like json.load, anything other than whitespace after the list is an error
+	pos, buf, at_end = skip_whitespace(pos, buf, at_end)
+	if pos < len(buf):
+		raise json.JSONDecodeError("Extra data", buf, pos)
+
+if __name__ == '__main__':
+	# check and benchmark of the streamed reading against json.load on a large synthetic activity JSON, reporting time and peak python memory of each
+	# usage: python mindlamp_activity_json.py [number of records, default 200000]
+	try:
+		num_records = int(sys.argv[1])
+	except:
+		num_records = 200000
+	records = []
+	for i in range(num_records):
+		if i % 3 == 0:
+			records.append({"id": str(i), "timestamp": 1646864490734 + i*1000, "duration": 61234, "static_data": {"url": "SOUND_" + str(i % 5)}, "temporal_slices": []})
+		else:
+			records.append({"id": str(i), "timestamp": 1646864490734 + i*1000, "duration": 5321, "static_data": {}, "temporal_slices": [{"item": "How are you feeling today?", "value": i % 7, "type": None, "duration": 2345, "level": None}]*4})
+	with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+		json.dump(records, f)
+		json_path = f.name
+	del records
+	print("Synthetic activity JSON with " + str(num_records) + " records, " + str(round(os.path.getsize(json_path) / 1e6, 1)) + " MB")
+	try:
+		tracemalloc.start()
+		start_time = time.time()
+		with open(json_path) as f:
+			loaded_records = json.load(f)
+			loaded_summary = [(x["timestamp"], x["static_data"].get("url")) for x in loaded_records]
+		load_time = time.time() - start_time
+		load_peak = tracemalloc.get_traced_memory()[1]
+		del loaded_records
+		tracemalloc.stop()
+		print("json.load: " + str(round(load_time, 3)) + " seconds, peak memory " + str(round(load_peak / 1e6, 1)) + " MB")
+
+		tracemalloc.start()
+		start_time = time.time()
+		with open(json_path) as f:
+			streamed_summary = [(x["timestamp"], x["static_data"].get("url")) for x in iter_activity_records(f)]
+		stream_time = time.time() - start_time
+		# (both peaks include the small per record summary list that is kept)
+		stream_peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		print("streamed records: " + str(round(stream_time, 3)) + " seconds, peak memory " + str(round(stream_peak / 1e6, 1)) + " MB")
+		print("identical records: " + str(loaded_summary == streamed_summary))
+	finally:
+		os.remove(json_path)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import datetime
+import pytz
+import pandas as pd
+import numpy as np
+
+# submission time accounting for the audio journal records found in MindLAMP activity JSONs, used by mindlamp_accounting
+# the unix timestamps (ms) of all new diary records are converted to the assumed local timezone as one timezone-aware datetime column,
+# with the timezone looked up just once, and then study day, hour, minute, and weekday are all derived with whole column operations
+# results are exactly the same as the original per record datetime conversions, which are kept in the benchmark below for reference
+
+# returns the lists of local time strings, study days, days of week, submission hours, and submission minutes for the input list of unix timestamps
+# consent_date should be the localized (pytz) datetime of the subject's consent - study day starts at 1 on the day of consent,
+# with study day, weekday, and hour all pushed back for submissions before 4 am so that late night diaries count towards the previous day
+# (hours 0 to 3 become 24 to 27, and weekday uses the dpdash convention where Saturday is 1)
+def submission_time_accounting(unix_timestamps, consent_date, assumed_timezone):
+	if len(unix_timestamps) == 0:
+		return [], [], [], [], []
+	seconds = np.asarray(unix_timestamps, dtype=float) / 1000.0
+	if not np.isfinite(seconds).all():
+		raise ValueError("invalid unix timestamp in diary records")
+	# split into whole seconds and microseconds the same way datetime.fromtimestamp does, rounding the fraction half to even
+	whole_seconds = np.floor(seconds)
+	micros = whole_seconds.astype(np.int64) * 1000000 + np.round((seconds - whole_seconds) * 1e6).astype(np.int64)
+	# the pytz timezone object is passed to pandas directly, so that the same transition table is used as in the original conversion
+	converted_times = pd.to_datetime(micros, unit="us", utc=True).tz_convert(pytz.timezone(assumed_timezone))
+
+	# difference is taken between the absolute times (like subtracting two aware datetimes), so whole days are counted in elapsed 24 hour periods
+	literal_day_numbers = np.asarray((converted_times - pd.Timestamp(consent_date)) // pd.Timedelta(days=1), dtype=np.int64) + 1
+	literal_submission_hours = np.asarray(converted_times.hour, dtype=np.int64)
+	submission_minute_stamp = np.asarray(converted_times.minute, dtype=np.int64)
+	week_days = ((np.asarray(converted_times.weekday, dtype=np.int64) + 2) % 7) + 1
+	late_night = literal_submission_hours < 4
+	adjusted_day_numbers = np.where(late_night, literal_day_numbers - 1, literal_day_numbers)
+	adjusted_hour_numbers = np.where(late_night, literal_submission_hours + 24, literal_submission_hours)
+	week_days_adjusted = np.where(late_night, np.where(week_days > 1, week_days - 1, 7), week_days)
+	# local wall clock strings are formatted by numpy from the whole seconds, as pandas strftime goes record by record and would take most of the time here
+	local_seconds = np.asarray(converted_times.tz_localize(None)).astype("datetime64[s]")
+	converted_times_str = [x.replace("T", " ") for x in np.datetime_as_string(local_seconds, unit="s").tolist()]
+
+	return converted_times_str, adjusted_day_numbers, week_days_adjusted, adjusted_hour_numbers, submission_minute_stamp
+
+# the original per record calculations, only used to check and time submission_time_accounting against
+def reference_time_accounting(unix_timestamps, consent_date, assumed_timezone):
+	converted_times = [datetime.datetime.fromtimestamp(x/1000.0,tz=pytz.timezone(assumed_timezone)) for x in unix_timestamps]
+	converted_times_str = [x.strftime("%Y-%m-%d %H:%M:%S") for x in converted_times]
+	literal_day_numbers = [(x - consent_date).days + 1 for x in converted_times]
+	literal_submission_hours = [x.hour for x in converted_times]
+	submission_minute_stamp = [x.minute for x in converted_times]
+	adjusted_day_numbers = [x - 1 if y < 4 else x for x,y in zip(literal_day_numbers,literal_submission_hours)]
+	adjusted_hour_numbers = [x + 24 if x < 4 else x for x in literal_submission_hours]
+	week_days = [((x.weekday() + 2) % 7) + 1 for x in converted_times]
+	week_days_adjusted = [x - 1 if (y < 4 and x > 1) else (7 if y < 4 else x) for x,y in zip(week_days,literal_submission_hours)]
+	return converted_times_str, adjusted_day_numbers, week_days_adjusted, adjusted_hour_numbers, submission_minute_stamp
+
+if __name__ == '__main__':
+	# benchmark and exactness check on synthetic diary timestamps, across several timezones with consent dates and submissions clustered around DST transitions
+	# usage: python mindlamp_time_accounting.py [number of timestamps per timezone, default 100000]
+	try:
+		num_stamps = int(sys.argv[1])
+	except:
+		num_stamps = 100000
+	rng = np.random.default_rng(0)
+	all_identical = True
+	for assumed_timezone in ["America/New_York", "Europe/London", "Australia/Sydney", "America/Sao_Paulo", "Asia/Kolkata", "UTC"]:
+		tz = pytz.timezone(assumed_timezone)
+		# unix ms of this timezone's transitions over the study period, to place half the submissions within a few hours of one
+		transitions = [int((x - datetime.datetime(1970,1,1)).total_seconds()*1000) for x in getattr(tz, "_utc_transition_times", []) if 2018 <= x.year <= 2025]
+		uniform_stamps = rng.integers(1514764800000, 1767225600000, num_stamps - num_stamps//2)
+		near_stamps = rng.choice(transitions, num_stamps//2) + rng.integers(-6*3600000, 6*3600000, num_stamps//2) if len(transitions) > 0 else rng.integers(1514764800000, 1767225600000, num_stamps//2)
+		unix_timestamps = np.concatenate([uniform_stamps, near_stamps]).tolist()
+		# a few fractional ms values too, to check the rounding to microseconds
+		unix_timestamps[:100] = [x + rng.random() for x in unix_timestamps[:100]]
+		for consent_date_str in ["2018-03-11", "2019-10-06", "2021-03-28", "2022-11-06"]:
+			consent_date = tz.localize(datetime.datetime.strptime(consent_date_str,"%Y-%m-%d"))
+			start_time = time.time()
+			reference_values = reference_time_accounting(unix_timestamps, consent_date, assumed_timezone)
+			reference_time = time.time() - start_time
+			start_time = time.time()
+			new_values = submission_time_accounting(unix_timestamps, consent_date, assumed_timezone)
+			new_time = time.time() - start_time
+			identical = all([list(x) == list(y) for x,y in zip(reference_values, new_values)])
+			all_identical = all_identical and identical
+			print(assumed_timezone + " consent " + consent_date_str + ": per record " + str(round(reference_time, 3)) + " seconds, vectorized " + str(round(new_time, 3)) + " seconds, identical: " + str(identical))
+	print("identical results overall: " + str(all_identical))
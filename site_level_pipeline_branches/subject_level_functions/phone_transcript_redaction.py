@@ -2,117 +2,150 @@
 
 import os
 import glob
+import re
 import sys
 
+from diary_ledger import update_subject_ledger
+
 # for input subject, find any transcripts without redacted transcripts and make them
 # relies on PII marked within curly brackets. each instance of curly brackets will have all words within (separated on spaces) replaced with "REDACTED"
-# assumes that after each { a } will follow before another {, that an unmatched bracket (or an empty set of braces) will not occur, and there will be some character between any } and {. 
+# assumes that after each { a } will follow before another {, that an unmatched bracket (or an empty set of braces) will not occur, and there will be some character between any } and {.
 # this matches the TranscribeMe convention for marking PII. also, because of subject IDs/timestamps we know a line will never begin with a {. it plausibly could end with a } though
+# a line that breaks the convention means the whole transcript is not redacted, to protect against accidentally putting PII in general
+
+# each PII marking is a { followed by everything up to the last } before the next { (or the end of the line)
+# on lines that follow the convention that is just the single } closing it - except at the very end of a line, where all text up to a final } was always treated as the marked PII
+PII_MARKING = re.compile(r"\{([^{]*)\}")
+
 def redact_transcripts(data_root, site, subject):
 	try:
 		os.chdir(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts"))
 	except:
 		# should generally not reach this warning if calling from main pipeline bash script
-		print("WARNING: no transcripts yet for input subject " + subject + ", or problem with input arguments") 
-		return
+		print("WARNING: no transcripts yet for input subject " + subject + ", or problem with input arguments")
+		return 0
 
 	cur_files = glob.glob("*.txt")
 	if len(cur_files) == 0:
 		# should generally not reach this warning if calling from main pipeline bash script
 		print("WARNING: no transcripts yet for input subject " + subject)
-		return
+		return 0
 
 	new_count = 0
+	redacted_names = [] # WAV names of the newly redacted transcripts, for the diary ledger
 	for trans in cur_files:
 		trans_name = trans.split(".txt")[0]
 		redacted_trans_name = trans_name + "_REDACTED.txt"
 		if not os.path.isfile(os.path.join("redacted_copies",redacted_trans_name)):
 			# means not yet redacted yet, so call the helper function (defined below)
-			redact_transcript(trans,os.path.join("redacted_copies",redacted_trans_name))
-			new_count = new_count + 1
+			redaction_counts = redact_transcript(trans,os.path.join("redacted_copies",redacted_trans_name))
+			if redaction_counts is not None:
+				print("Redacted " + str(redaction_counts[1]) + " words across " + str(redaction_counts[0]) + " PII markings in " + trans)
+				new_count = new_count + 1
+				redacted_names.append(trans_name + ".wav")
 
 	print(str(new_count) + " total transcripts newly redacted for subject " + subject)
-	return
+	update_subject_ledger(data_root, site, subject, redacted_names, "redacted")
+	return new_count
+
+# batch version of the above for every subject in a site, all in one process
+# subjects without any transcripts are skipped quietly, and redacted_copies folders are made where needed
+def redact_site_transcripts(data_root, site):
+	data_root = os.path.abspath(data_root) # subject level function changes directories
+	processed_folder = os.path.join(data_root,"PROTECTED", site, "processed")
+	if not os.path.isdir(processed_folder):
+		print("WARNING: invalid data root path " + data_root + " or site ID " + site + ", as necessary base folder structure does not exist")
+		return
+	total_count = 0
+	for subject in sorted(os.listdir(processed_folder)):
+		transcripts_folder = os.path.join(processed_folder, subject, "phone", "audio_journals", "transcripts")
+		if len(glob.glob(os.path.join(transcripts_folder, "*.txt"))) == 0:
+			continue
+		if not os.path.isdir(os.path.join(transcripts_folder, "redacted_copies")):
+			os.mkdir(os.path.join(transcripts_folder, "redacted_copies"))
+		total_count = total_count + redact_transcripts(data_root, site, subject)
+	print(str(total_count) + " total transcripts newly redacted for site " + site)
 
 # helper function for performing the redaction for a given transcript and saving at given path
+# the input is streamed line by line into a temporary file next to savepath, which is only renamed into place once the whole transcript is redacted
+# returns tuple of (number of PII markings, number of words redacted), or None if nothing was saved because of a problem with the transcript
 def redact_transcript(filename, savepath):
 	# do argument sanity check first
 	# if calling via this file's main, shouldn't hit these messages
 	if not os.path.isfile(filename):
 		print("Input transcript path is not a file (" + filename + "), skipping")
-		return
+		return None
 	if os.path.exists(savepath):
 		print("Intended output path already exists (" + savepath + "), skipping")
-		return
+		return None
 
-	# get a list of the lines in the input transcript txt file
-	with open(filename, 'r') as input_file: # read mode
-		input_lines = input_file.readlines()
-		# remove white space characters from the ends of the lines for cleaning
-		input_lines = [line.rstrip() for line in input_lines]
+	marking_count = 0
+	word_count = 0
+	success = True
+	try:
+		with open(filename, 'r') as input_file, open(savepath + ".part", 'w') as output_file:
+			for line in input_file:
+				# remove white space characters from the ends of the lines for cleaning
+				line = line.rstrip()
+				# add a new line after each line is written! good for reading in txt file, csv conversion script will strip
+				if "{" not in line:
+					# most lines have nothing to redact, write those straight through
+					output_file.write(line + "\n")
+					continue
+				redacted = redact_line(line)
+				if redacted is None:
+					print("Redaction convention violated in file (" + filename + "), please review manually")
+					success = False
+					break
+				output_file.write(redacted[0] + "\n")
+				marking_count = marking_count + redacted[1]
+				word_count = word_count + redacted[2]
+	except UnicodeDecodeError:
+		print("WARNING: found transcript that is not UTF-8 encoded, this may cause issues with the automatic redaction! It will be completely skipped for now, please review in main transcripts folder manually")
+		success = False
+	if not success:
+		os.remove(savepath + ".part")
+		return None
+	os.replace(savepath + ".part", savepath)
+	return (marking_count, word_count)
 
-	# now go line by line through the input and write a modified version to the output file
-	output_file = open(savepath, 'w') # write mode
+# helper function that redacts the (already whitespace stripped) lines of a transcript all at once
+# returns the full redacted text to save, with a new line after each line, or None if the redaction convention was violated
+# filename is only used for the warning message - used by the fused transcript processing, which needs the redacted text in memory
+def redact_lines(input_lines, filename):
+	output_lines = []
 	for line in input_lines:
-		pre_redact_list = line.split("{")
-		if len(pre_redact_list) == 1: # if no redaction at all in this line write it as is and continue
-			output_file.write(pre_redact_list[0])
-			output_file.write("\n") # add a new line after each line is written! good for reading in txt file, csv conversion script will strip
-			continue
-		# handle anything that comes before the first redaction, start string that will be written to new file for this line
-		modified_line = pre_redact_list[0] + "{"
+		redacted = redact_line(line)
+		if redacted is None:
+			print("Redaction convention violated in file (" + filename + "), please review manually")
+			return None
+		output_lines.append(redacted[0] + "\n")
+	return "".join(output_lines)
 
-		# now start going through the redactions
-		for contents in pre_redact_list[1:-1]: # exclude very last brace in a given line here, as it may end the line and needs to be treated slightly differently
-			cur_post_redact_list = contents.split("}")
-			# expect each of these items to have a single } with meaningful content both before and after
-			if len(cur_post_redact_list) != 2:
-				print("Redaction convention violated in file (" + filename + "), please review manually")
-				output_file.close()
-				os.remove(savepath) # delete it as a protection for accidentally putting PII in general
-				return
-			# the content before is what needs to be redacted, the content after can be kept as is
-			# find how many words occur inside the curly brace by splitting the first part by spaces
-			to_redact = len(cur_post_redact_list[0].split(" "))
-			for word in range(to_redact-1):
-				modified_line = modified_line + "REDACTED "
-			modified_line = modified_line + "REDACTED}" # assume there will always be at least one word inside the braces! could add more safety checks here?
-			# now add the normal content back, plus the front curly brace as we know we are not on the last one yet if in this loop
-			modified_line = modified_line + cur_post_redact_list[1] + "{"
-		
-		# now just handle final redaction in the line
-		final_redaction = pre_redact_list[-1]
-		if final_redaction[-1] == '}': # handle case where the last character is a curly brace ender separately
-			# here just need to add the redaction, not any subsequent text. do that part as before
-			to_redact = len(final_redaction.split(" "))
-			for word in range(to_redact-1):
-				modified_line = modified_line + "REDACTED "
-			modified_line = modified_line + "REDACTED}"
-		else: # when there is content after the final redaction, handle similarly as before, just don't add an extra {
-			cur_post_redact_list = final_redaction.split("}")
-			# expect each of these items to have a single } with meaningful content both before and after
-			if len(cur_post_redact_list) != 2:
-				print("Redaction convention violated in file (" + filename + "), please review manually")
-				output_file.close()
-				os.remove(savepath) # delete it as a protection for accidentally putting PII in general
-				return
-			# the content before is what needs to be redacted, the content after can be kept as is
-			# find how many words occur inside the curly brace by splitting the first part by spaces
-			to_redact = len(cur_post_redact_list[0].split(" "))
-			for word in range(to_redact-1):
-				modified_line = modified_line + "REDACTED "
-			modified_line = modified_line + "REDACTED}" # assume there will always be at least one word inside the braces! could add more safety checks here?
-			# now add the normal content back
-			modified_line = modified_line + cur_post_redact_list[1]
-		
-		# finally can write the new line that was put together
-		output_file.write(modified_line)
-		output_file.write("\n") # add a new line after each line is written! good for reading in txt file, csv conversion script will strip
-	
-	# done going through the transcript, can close the file and return
-	output_file.close()
-	return
+# helper function for redacting a single line, returns tuple of (redacted line, number of PII markings, number of words redacted) or None if the convention is violated
+# words are counted by splitting the marked text on single spaces, each becoming one REDACTED (so even an empty set of braces gets one)
+def redact_line(line):
+	if "{" not in line:
+		return (line, 0, 0)
+	# splitting on the pattern alternates between the text around markings and the marked text itself
+	line_parts = PII_MARKING.split(line)
+	# the convention is violated if any { was left without a marking (i.e. has no } after it before the next {)
+	# or if a marking contains another } - which is only allowed for the final marking when the line ends with it
+	if line.count("{") != len(line_parts) // 2:
+		return None
+	word_count = 0
+	for i in range(1, len(line_parts), 2):
+		if "}" in line_parts[i] and (i != len(line_parts) - 2 or line_parts[-1] != ""):
+			return None
+		to_redact = len(line_parts[i].split(" "))
+		line_parts[i] = "{" + "REDACTED " * (to_redact - 1) + "REDACTED}"
+		word_count = word_count + to_redact
+	return ("".join(line_parts), len(line_parts) // 2, word_count)
 
 if __name__ == '__main__':
 	# Map command line arguments to function arguments.
-	redact_transcripts(sys.argv[1], sys.argv[2], sys.argv[3])
+	# with just data root and site, redacts pending transcripts for every subject of the site
+	if len(sys.argv) > 3:
+		redact_transcripts(sys.argv[1], sys.argv[2], sys.argv[3])
+	else:
+		redact_site_transcripts(sys.argv[1], sys.argv[2])
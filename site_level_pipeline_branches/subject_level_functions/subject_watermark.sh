@@ -0,0 +1,58 @@
+#!/bin/bash
+
+# change detection watermark helpers for the site level scripts, sourced by audio_side.sh and transcript_side.sh
+# a subject's watermark is a one line summary of the files its side of the pipeline takes as input - file count, total size, latest modification time,
+# and a checksum of the full listing (path, size, and modification time of every file), so any file added, removed, replaced, or touched changes it
+# when the watermark saved at the end of the last completed run still matches, the subject has nothing new and can be skipped before any python is started
+# all of this is plain bash/GNU find, as the point is to spend next to nothing on idle subjects
+
+# prints the current watermark for the given paths - for a folder the regular files directly within it are listed (subfolders are not included),
+# for a file just the file itself, and a missing path is noted as such
+subject_watermark() {
+	local listing
+	listing=$(for path in "$@"; do
+		if [[ -d $path ]]; then
+			find "$path" -mindepth 1 -maxdepth 1 -type f -printf "%p\t%s\t%T@\n" | LC_ALL=C sort
+		elif [[ -f $path ]]; then
+			find "$path" -maxdepth 0 -printf "%p\t%s\t%T@\n"
+		else
+			echo "${path} missing"
+		fi
+	done)
+	echo "$(echo "$listing" | awk -F'\t' 'NF == 3 {count++; bytes += $2; if ($3 > latest) latest = $3} END {printf "%d files, %.0f bytes, latest modified %s", count, bytes, latest}'), listing checksum $(echo "$listing" | md5sum | cut -d " " -f 1)"
+}
+
+# returns success if the watermark saved at the first argument matches the second argument
+watermark_unchanged() {
+	[[ -f $1 ]] && [[ "$(cat "$1")" == "$2" ]]
+}
+
+# saves the second argument as the watermark at the first argument, making its folder if needed
+# (only that last folder is made - if the subject's processed folders are not set up, nothing is saved and the subject will just be checked again next time)
+save_watermark() {
+	if [[ ! -d $(dirname "$(dirname "$1")") ]]; then
+		return
+	fi
+	if [[ ! -d $(dirname "$1") ]]; then
+		mkdir "$(dirname "$1")"
+	fi
+	echo "$2" > "$1"
+}
+
+# prints the number of transcripts in the given transcripts folder that are still missing their redacted copy or its CSV
+# the transcript side only saves its watermark when this is 0, so that a transcript whose processing failed is still retried on the next run
+unfinished_transcripts() {
+	local count=0
+	local file
+	local name
+	for file in "$1"/*.txt; do
+		if [[ ! -e $file ]]; then
+			continue
+		fi
+		name=$(basename "$file" .txt)
+		if [[ ! -e $1/redacted_copies/${name}_REDACTED.txt ]] || [[ ! -e $1/redacted_copies/csv/${name}_REDACTED.csv ]]; then
+			count=$((count + 1))
+		fi
+	done
+	echo "$count"
+}
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import pysftp
+import paramiko
+import time
+
+# make sure if paramiko throws an error it will get mentioned in log files
+import logging
+logging.basicConfig()
+
+# hardcode the basic properties for the transcription service, as these shouldn't change
+TRANSCRIBEME_HOST = "sftp.transcribeme.com"
+
+# one SFTP connection to TranscribeMe that can be reused for the push or pull of every subject in a site, instead of a new SSH handshake per subject
+# the connection is only opened when first needed, and if it drops (or anything else goes wrong during an operation) it is transparently reopened for a retry
+# time spent on SSH handshakes and time spent on the actual transfers are tracked separately, and logged when the session is closed
+class TranscribeMeSession:
+	def __init__(self, username, password, host=TRANSCRIBEME_HOST, port=22, max_attempts=10, retry_delay=5):
+		self.username = username
+		self.password = password
+		self.host = host
+		self.port = port
+		self.max_attempts = max_attempts
+		self.retry_delay = retry_delay # seconds to wait before reattempting
+		self.connection = None
+		self.listings = {} # cached remote directory listings, see listdir below
+		self.handshake_count = 0
+		self.failed_attempts = 0
+		self.handshake_seconds = 0.0
+		self.transfer_seconds = 0.0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	# returns the open pysftp connection, (re)connecting first if there isn't a live one
+	def connect(self):
+		if self.is_active():
+			return self.connection
+		self.disconnect()
+		self.listings = {}
+		start_time = time.time()
+		try:
+			cnopts = pysftp.CnOpts()
+			cnopts.hostkeys = None # ignore hostkey
+			self.connection = pysftp.Connection(self.host, username=self.username, password=self.password, port=self.port, cnopts=cnopts)
+		finally:
+			self.handshake_seconds = self.handshake_seconds + (time.time() - start_time)
+		self.handshake_count = self.handshake_count + 1
+		return self.connection
+
+	def is_active(self):
+		if self.connection is None:
+			return False
+		try:
+			return self.connection.sftp_client.get_channel().get_transport().is_active()
+		except:
+			return False
+
+	# returns the set of names in a remote directory, only actually listing it on the server the first time it is asked for during the session
+	# so callers that change the directory need to keep the returned set up to date themselves - it is cleared whenever an operation fails, to be listed fresh on retry
+	def listdir(self, path):
+		if path not in self.listings:
+			self.listings[path] = set(self.connect().listdir(path))
+		return self.listings[path]
+
+	# returns a list of count additional SFTP clients on the open connection's SSH transport, e.g. for concurrent uploads
+	# each is its own SFTP channel, so they can be used from separate threads without another handshake - caller should close them when done
+	def open_channels(self, count):
+		transport = self.connect().sftp_client.get_channel().get_transport()
+		channels = []
+		try:
+			for i in range(count):
+				channels.append(paramiko.SFTPClient.from_transport(transport))
+		except:
+			for channel in channels:
+				channel.close()
+			raise
+		return channels
+
+	def disconnect(self):
+		if self.connection is not None:
+			try:
+				self.connection.close()
+			except:
+				pass
+			self.connection = None
+
+	# call operation with the open connection as its only argument, giving it a few tries before falling back
+	# returns True if the operation got all the way through, False if every attempt failed
+	# operation may be run again after a partial failure, so it needs to be safe to repeat (e.g. by checking what already exists on the server)
+	def run(self, operation):
+		count = 0
+		while count < self.max_attempts:
+			try:
+				sftp = self.connect()
+				start_time = time.time()
+				try:
+					operation(sftp)
+				finally:
+					self.transfer_seconds = self.transfer_seconds + (time.time() - start_time)
+				return True
+			except:
+				# here will increment counter and possibly try again, on a fresh connection if this one dropped
+				count = count + 1
+				self.failed_attempts = self.failed_attempts + 1
+				self.listings = {}
+				if count < self.max_attempts:
+					# but do short delay first
+					time.sleep(self.retry_delay)
+		return False
+
+	def close(self):
+		self.disconnect()
+		if self.handshake_count > 0:
+			print("TranscribeMe SFTP session closed - " + str(self.handshake_count) + " SSH handshake(s) took " + str(round(self.handshake_seconds, 3)) +
+				  " seconds, and transfers took " + str(round(self.transfer_seconds, 3)) + " seconds (" + str(self.failed_attempts) + " failed attempt(s) retried)")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import re
+import sys
+
+# for input subject, convert any redacted transcript text files that don't have a CSV version yet into CSV
+# this replaces the bash while read loop previously in transcript_side.sh, which forked awk/tr/echo several times for every line of every transcript
+# output is kept exactly the same as that loop produced, so the parsing below intentionally mirrors the awk field splitting it used:
+# speaker ID comes first on a line (followed by a colon if "S1:" appears anywhere in the file), timestamp comes second,
+# and text is whatever comes after the first timestamp in MM:SS.mmm format (which also works when hours are present), or MM:SS format if ms resolution was not provided
+# lines where no text can be found that way are skipped, as they are generally empty lines
+CSV_HEADER = "site,subject,filename,speakerID,timefromstart,text"
+MS_TIMESTAMP_SPLIT = re.compile("[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9] ")
+NO_MS_TIMESTAMP_SPLIT = re.compile("[0-9][0-9]:[0-9][0-9] ")
+# awk's default field splitting only treats spaces, tabs, and newlines as separators - unlike python's str.split()
+AWK_FIELD_SPLIT = re.compile("[ \t\n]+")
+
+def convert_transcripts(data_root, site, subject):
+	try:
+		os.chdir(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts", "redacted_copies"))
+	except:
+		# should generally not reach this warning if calling from main pipeline bash script
+		print("WARNING: no redacted transcripts yet for input subject " + subject + ", or problem with input arguments")
+		return
+	if not os.path.isdir("csv"):
+		os.mkdir("csv")
+
+	new_count = 0
+	for trans in sorted(glob.glob("*.txt")):
+		# name matched as it was with awk -F '.txt' in the original loop, so the CSV names don't change
+		trans_name = re.split(".txt", trans)[0]
+		if os.path.exists(os.path.join("csv", trans_name + ".csv")):
+			continue
+		print("New transcript to convert detected: " + trans)
+		if transcript_to_csv(trans, os.path.join("csv", trans_name + ".csv"), site, subject, trans_name) is not None:
+			new_count = new_count + 1
+
+	print(str(new_count) + " total transcripts newly converted to CSV for subject " + subject)
+	return
+
+# helper function to convert a single redacted transcript at filename into a CSV at savepath, returns the saved CSV text (or None if no CSV was made)
+# first checks encoding, forcing at least UTF-8 - a transcript that isn't UTF-8 is deleted from redacted copies and skipped
+# raw_bytes can be given when the transcript contents are already in memory, so the file doesn't need to be read again
+def transcript_to_csv(filename, savepath, site, subject, trans_name, raw_bytes=None):
+	if raw_bytes is None:
+		with open(filename, "rb") as f:
+			raw_bytes = f.read()
+	if len(raw_bytes) == 0 or not raw_bytes.isascii():
+		# ASCII is subset of UTF8, so now need to check UTF8 since we know it isn't ASCII
+		try:
+			raw_text = raw_bytes.decode("utf-8")
+		except UnicodeDecodeError:
+			print("WARNING: found transcript that is not UTF-8 encoded, this may cause issues with the automatic redaction! It will be completely skipped for now, please review in main transcripts folder manually")
+			# now remove the file from redacted copies to be safe in case marked PII was not removed due to encoding discrepancy
+			os.remove(filename)
+			return None
+		# if it's not ASCII but is UTF8, just make a note
+		print("(note transcript is not ASCII encoded, but is UTF-8)")
+	else:
+		raw_text = raw_bytes.decode("ascii")
+
+	# check speaker ID number format, as TranscribeMe has used a few different delimiters in the past
+	# (this does assume they are consistent with one format throughout a single file though, which should be fine)
+	colon_ids = "S1:" in raw_text # speaker ID S1 is guaranteed to appear at least once as it is the initial ID they assign
+
+	# substitute tabs with single space for easier parsing (returned by TranscribeMe we see a mix)
+	# split only on newlines so any carriage returns stay in place like they did for bash read, and drop a final empty line after trailing newline
+	lines = raw_text.replace("\t", " ").replace("\x00", "").split("\n")
+	if lines[-1] == "":
+		lines = lines[:-1]
+
+	# (no reason to have DPDash formatting for a transcript CSV, so I choose these columns)
+	# (some of them are just for ease of future concat/merge operations)
+	csv_lines = [CSV_HEADER]
+	for line in lines:
+		fields = AWK_FIELD_SPLIT.split(line.strip(" \t\n"))
+		if colon_ids: # speaker ID always comes first, is sometimes followed by a colon
+			sub = line.split(": ")[0]
+		else:
+			sub = fields[0]
+		time = fields[1] if len(fields) > 1 else "" # timestamp always comes second
+		text_split = MS_TIMESTAMP_SPLIT.split(line)
+		text = text_split[1] if len(text_split) > 1 else ""
+		if text == "":
+			# text could end up empty because ms resolution not provided, so first try looking for space after the SS part of the timestamp
+			text_split = NO_MS_TIMESTAMP_SPLIT.split(line)
+			text = text_split[1] if len(text_split) > 1 else ""
+			if text == "":
+				# if text is still empty safe to assume this is an empty line, which do occur - skip it!
+				continue
+		text = text.replace('"', "").replace("\r", "") # remove extra characters at end of each sentence
+		csv_lines.append(site + "," + subject + "," + trans_name + "," + sub + "," + time + ",\"" + text + "\"")
+
+	csv_text = "\n".join(csv_lines) + "\n"
+	with open(savepath, "w", encoding="utf-8", newline="") as f:
+		f.write(csv_text)
+	return csv_text
+
+if __name__ == '__main__':
+	# Map command line arguments to function arguments.
+	convert_transcripts(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -1,25 +1,20 @@
 #!/usr/bin/env python
 
 import os
+import re
 import pandas as pd
 import numpy as np
 import sys
-import glob
 import datetime
 
+from accounting_index import load_accounting_index, lookup_accounting_record
+from incremental_qc_save import save_qc_rows
+from transcript_timestamps import timestamp_minutes, timestamp_gaps
+
 # compute latest transcript QC for newly available redacted transcript QC CSVs for given subject ID
 # when applicable updates existing master CSV and creates GENERAL side version for DPDash integration
 # analogous to audio_diary_qc function from audio side, but now relevant metrics for quality assessment of diary transcripts
 def transcript_diary_qc(data_root, site, subject):
-	# specify column headers that will be used for every CSV
-	# make it DPDash formatted, but will leave reftime columns blank. others will look up
-	headers=["reftime","day","timeofday","weekday","site","subject","daily_submission_number",
-			 "speakerID_count","S1_sentence_count","total_sentence_count","word_count",
-			 "min_words_in_sen","max_words_in_sen","inaudible_count","questionable_count",
-			 "other_bracketed_notation_count","redacted_count",
-			 "final_timestamp_minutes","min_timestamp_space_seconds","max_timestamp_space_seconds",
-			 "min_timestamp_space_per_word","max_timestamp_space_per_word",
-			 "txt_encoding_type","redacted_csv_filename","date_transcript_processed"]
 	# note: 
 	# inaudibles can occur once to mark a long stretch of continuing inaudible, or could just mean a single word was
 	# questionable is single uncertain word for each
@@ -28,68 +23,82 @@ def transcript_diary_qc(data_root, site, subject):
 	# no need for crosstalk here as a specific metric like in interviews
 	# (also not having the punctuation ones here as adding a basic actual disfluency calculation in downstream step)
 
-	# initialize lists to fill in df
-	site_days = []
-	times = []
-	week_days = []
-	sub_nums=[]
-	speaker_counts = []
-	s1_sens = []
-	total_sens = []
-	words = []
-	min_words = []
-	max_words = []
-	inauds = []
-	questions = []
-	brackets = []
-	redactions = []
-	fin_times = []
-	min_spaces = []
-	max_spaces = []
-	min_spaces_ratio = []
-	max_spaces_ratio = []
-	encodings = []
-	fnames = []
-	trans_dates = [] # should generally be same as transcript return date - note I will only save this on PROTECTED side source and not DPDash GENERAL copy
-	# site and subject list will be same thing n times, so just do at end
-
-	# check necessary input folder exists in order to change directories into it
-	try:
-		os.chdir(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts", "redacted_copies", "csv"))
-	except:
+	# first find the transcript CSVs that are new for QC, with their metadata
+	pending = pending_transcript_qc(data_root, site, subject)
+	if pending is None:
+		return
+
+	# now get the actual transcript QC values for all of them at once, and put together the new rows
+	new_csv = build_transcript_qc_csv(site, subject, transcript_qc_columns(pending))
+
+	# now save the new rows - appends to the PROTECTED source CSV and updates the GENERAL DPDash copy for push to predict
+	# (processing date is only kept on the PROTECTED side)
+	save_qc_rows(data_root, site, subject, new_csv, "diaryTranscriptQC", dpdash_exclude_columns=["date_transcript_processed"])
+
+# site-wide version of the above, loading the new transcript CSVs of every subject into the same batch QC computation
+# the rows are then split back up by subject to be saved exactly as the subject level function would
+def site_transcript_diary_qc(data_root, site):
+	data_root = os.path.abspath(data_root)
+	processed_folder = os.path.join(data_root,"PROTECTED", site, "processed")
+	if not os.path.isdir(processed_folder):
+		print("WARNING: invalid data root path " + data_root + " or site ID " + site + ", as necessary base folder structure does not exist")
+		return
+	subject_pending = []
+	for subject in sorted(os.listdir(processed_folder)):
+		if not os.path.isdir(os.path.join(processed_folder, subject, "phone", "audio_journals", "transcripts", "redacted_copies", "csv")):
+			# subject has no transcripts yet, nothing to do
+			continue
+		pending = pending_transcript_qc(data_root, site, subject)
+		if pending is not None:
+			subject_pending.append((subject, pending))
+
+	all_values = transcript_qc_columns([x for subject,pending in subject_pending for x in pending])
+	row_start = 0
+	for subject,pending in subject_pending:
+		values = [x[row_start:row_start + len(pending)] for x in all_values]
+		row_start = row_start + len(pending)
+		new_csv = build_transcript_qc_csv(site, subject, values)
+		save_qc_rows(data_root, site, subject, new_csv, "diaryTranscriptQC", dpdash_exclude_columns=["date_transcript_processed"])
+	print("Transcript QC updated for " + str(len(subject_pending)) + " subjects, with " + str(row_start) + " total new transcripts")
+
+# helper that finds the transcript CSVs for a subject that have not been through QC yet
+# returns list of tuples of (CSV filename, full CSV path, full path of the corresponding redacted txt, metadata tuple from transcript_metadata)
+# or None if QC can't be run for the subject (warning printed)
+def pending_transcript_qc(data_root, site, subject):
+	csv_folder = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts", "redacted_copies", "csv")
+	# check necessary input folder exists
+	if not os.path.isdir(csv_folder):
 		# should generally not reach this warning if calling from main pipeline bash script
 		print("WARNING: haven't generated any redacted transcript CSVs yet for input subject " + subject + ", or problem with input arguments") 
-		return
+		return None
 
 	# need output folder setup before proceeding as well - again this is just check for someone calling outside the scope of main pipeline
 	if not os.path.isdir(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "dpdash_source_csvs")):
 		print("WARNING: output folder not correctly set up yet for input subject " + subject + " - please address in order to save transcript QC outputs")
-		return
+		return None
 
 	# now get list of CSV files to actually potentially process!
-	cur_files = os.listdir(".")
+	cur_files = os.listdir(csv_folder)
 	if len(cur_files) == 0:
 		# should generally not reach this warning if calling from main pipeline bash script
 		print("WARNING: haven't generated any redacted transcript CSVs yet for input subject " + subject)
-		return
+		return None
 	cur_files.sort() # go in order, although can also always sort CSV later.
 
 	# next will prep to get additional info from accounting JSON 
 	# - not strictly necessary for python script but should always exist in context of broader pipeline
-	if not os.path.isfile(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "file_accounting_details", site + "_" + subject + "_audioJournalJSONRecordsInfo.csv")):
-		# shouldn't have this issue when called from pipeline
-		print("WARNING: JSON file accounting missing for input subject " + subject + ", so some metadata details will be missing from transcript QC output here")
-		accounting_df = pd.DataFrame()
-	else:
-		accounting_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "file_accounting_details", site + "_" + subject + "_audioJournalJSONRecordsInfo.csv"))
+	# (loaded once into an index keyed on day and submission number, so each lookup below is a direct access)
+	accounting_index = load_accounting_index(data_root, site, subject, output_name="transcript QC")
 
 	# also see if any of these transcripts have already been processed
 	if os.path.isfile(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "dpdash_source_csvs", site + "_" + subject + "_" + "diaryTranscriptQC.csv")):
-		old_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "dpdash_source_csvs", site + "_" + subject + "_" + "diaryTranscriptQC.csv"))
-		prev_trans_list = old_df["redacted_csv_filename"].tolist()
+		# only need the filename column here, new rows get appended to the file later without loading the rest
+		old_df = pd.read_csv(os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "dpdash_source_csvs", site + "_" + subject + "_" + "diaryTranscriptQC.csv"), usecols=["redacted_csv_filename"])
+		prev_trans_list = set(old_df["redacted_csv_filename"].tolist())
 	else:
-		prev_trans_list = []
+		prev_trans_list = set()
 
+	pending = []
 	for filename in cur_files:
 		if not filename.endswith(".csv"): 
 			# skip any non-CSV files (and folders) - though using main pipeline there shouldn't be any
@@ -98,194 +107,221 @@ def transcript_diary_qc(data_root, site, subject):
 			# also skip anything that has already been processed
 			continue
 		# now good to proceed
-		fnames.append(filename) 
-
 		# handle the DPDash and other metadata columns here
-		# first pulling directly from filename for core info which we will always require
-		cur_day = int(filename.split("_day")[-1].split("_")[0])
-		cur_num = int(filename.split("_submission")[-1].split("_")[0])
-		site_days.append(cur_day)
-		sub_nums.append(cur_num)
-		# next get additional info from accounting JSON where available
-		if accounting_df.empty:
-			times.append(np.nan)
-			week_days.append(np.nan)
-		else:
-			# match exactly that record in the accounting JSON
-			cur_account = accounting_df[(accounting_df["assigned_study_day"]==cur_day) & (accounting_df["adjusted_sound_number"]==cur_num)]
-			if cur_account.shape[0] != 1:
-				# shouldn't really have this happen in scope of main pipeline if run correctly with no manual interference
-				# - but catch this to be safe, will print this warning but also will find obvious due to placement of NaNs in resulting CSV
-				print("WARNING: " + filename + " had issue with lookup in JSON accounting CSV, some metadata will be missing for it - shape of filtered DF was actually " + str(cur_account.shape[0]))
-				times.append(np.nan)
-				week_days.append(np.nan)
-			else:
-				times.append(cur_account["local_time_converted"].tolist()[0].split(" ")[-1])
-				week_days.append(cur_account["assigned_day_of_week"].tolist()[0])
-		
-		# now set to get the actual transcript QC values for this transcript CSV
-		# load in CSV and clear any rows where there is a missing value (should always be a speakerID, timestamp, and text)
-		try:
-			cur_trans = pd.read_csv(filename)
-			cur_trans = cur_trans[["speakerID", "timefromstart", "text"]]
-			cur_trans.dropna(how='any',inplace=True)
-		except:
-			# ignore bad CSV
-			print("WARNING: " + filename + " appears to be an incorrectly formatted CSV, QC values will be empty")
-			speaker_counts.append(np.nan)
-			s1_sens.append(np.nan)
-			total_sens.append(np.nan)
-			words.append(np.nan)
-			min_words.append(np.nan)
-			max_words.append(np.nan)
-			inauds.append(np.nan)
-			questions.append(np.nan)
-			brackets.append(np.nan)
-			redactions.append(np.nan)
-			fin_times.append(np.nan)
-			min_spaces.append(np.nan)
-			max_spaces.append(np.nan)
-			min_spaces_ratio.append(np.nan)
-			max_spaces_ratio.append(np.nan)
-			encodings.append(np.nan)
-			continue 
-
-		# ensure transcript is not empty as well
-		if cur_trans.empty:
-			print("WARNING: " + filename + " is an empty transcript, QC values will be empty")
-			speaker_counts.append(np.nan)
-			s1_sens.append(np.nan)
-			total_sens.append(np.nan)
-			words.append(np.nan)
-			min_words.append(np.nan)
-			max_words.append(np.nan)
-			inauds.append(np.nan)
-			questions.append(np.nan)
-			brackets.append(np.nan)
-			redactions.append(np.nan)
-			fin_times.append(np.nan)
-			min_spaces.append(np.nan)
-			max_spaces.append(np.nan)
-			min_spaces_ratio.append(np.nan)
-			max_spaces_ratio.append(np.nan)
-			encodings.append(np.nan)
-			continue
-		
-		# now can get actual QC values to append - starting with basic counts of structure
-		speaker_counts.append(len(set(cur_trans["speakerID"].tolist())))
-		cur_trans_S1 = cur_trans[cur_trans["speakerID"]=="S1"]
-		s1_sens.append(cur_trans_S1.shape[0])
-		# get actual text from full transcript DF to use in all the QC metrics calc
-		all_sens = [x.lower() for x in cur_trans["text"].tolist()] # case shouldn't matter in what we are doing here
-		total_sens.append(len(all_sens))
-		words_per = [len(x.split(" ")) for x in all_sens] # define words here as always space delimitted
-		words.append(np.nansum(words_per))
-		min_words.append(np.nanmin(words_per))
-		max_words.append(np.nanmax(words_per))
-
-		# now counting of TranscribeMe special notations
-		inaud_per = [x.count("[inaudible]") for x in all_sens]
-		quest_per = [x.count("?]") for x in all_sens] # assume bracket should never follow a ? unless the entire word is bracketed in
-		redact_per = [x.count("redacted") for x in all_sens] # should be fine to not bother checking for curly brace here anymore, as we are ones who plugged in REDACTED already
-		bracket_per = [x.count("]") - x.count("?]") - x.count("[inaudible]") for x in all_sens]
-		inauds.append(np.nansum(inaud_per))
-		questions.append(np.nansum(quest_per))
-		brackets.append(np.nansum(bracket_per))
-		redactions.append(np.nansum(redact_per))
-
-		# now timestamps related metrics
-		cur_times = cur_trans["timefromstart"].tolist()
-		# convert all timestamps to a float value indicating number of minutes
-		try:
-			cur_minutes = [float(int(x.split(":")[0]))*60.0 + float(int(x.split(":")[1])) + float(x.split(":")[2])/60.0 for x in cur_times]
-		except:
-			cur_minutes = [float(int(x.split(":")[0])) + float(x.split(":")[1])/60.0 for x in cur_times] # format sometimes will not include an hours time, so need to catch that
-		# get last timestamp - note this will be for the time *before* the last sentence
-		fin_times.append(round(cur_minutes[-1],3))
-		# convert the minutes to a number of seconds for spacing features
-		cur_seconds = [m * 60.0 for m in cur_minutes] 
-		differences_list = [j - i for i, j in zip(cur_seconds[: -1], cur_seconds[1 :])]
-		if len(differences_list) == 0:
-			# current transcript is of minimal length (1 sentence), so no valid timestamp differences, append nan
-			min_spaces.append(np.nan)
-			max_spaces.append(np.nan)
-			min_spaces_ratio.append(np.nan)
-			max_spaces_ratio.append(np.nan)
-		else:
-			# use round so values are reasonably viewable on DPDash
-			min_spaces.append(round(np.nanmin(differences_list),3))
-			max_spaces.append(round(np.nanmax(differences_list),3))
-			weighted_list = [j/float(i) for i, j in zip(words_per[: -1], differences_list)]
-			min_spaces_ratio.append(round(np.nanmin(weighted_list),3))
-			max_spaces_ratio.append(round(np.nanmax(weighted_list),3))
-
-		# finally just get the transcript text encoding type
 		txt_name = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "transcripts", "redacted_copies", filename.split(".csv")[0] + ".txt")
+		pending.append((filename, os.path.join(csv_folder, filename), txt_name, transcript_metadata(filename, accounting_index)))
+	return pending
+
+# helper that loads and QCs the given pending transcripts (from pending_transcript_qc) in one batch
+# returns one list per column from day through redacted_csv_filename, excluding site and subject, as build_transcript_qc_csv expects
+# site and subject list will be same thing n times, so just done at end - as with the processing date, which is only saved on PROTECTED side source and not DPDash GENERAL copy
+def transcript_qc_columns(pending):
+	transcripts = [load_transcript_csv(x[1]) for x in pending]
+	qc_rows = batch_transcript_qc([x[0] for x in pending], transcripts, [x[2] for x in pending])
+	values = [[] for x in range(21)]
+	for cur_pending,cur_qc in zip(pending, qc_rows):
+		for i,val in enumerate(list(cur_pending[3]) + cur_qc + [cur_pending[0]]):
+			values[i].append(val)
+	return values
+
+# helper for getting the DPDash metadata columns for a given redacted transcript CSV
+# core info (day and submission number) is pulled directly from filename, which we will always require
+# additional info comes from the accounting JSON records where available
+# returns tuple of (day, time of day, weekday, submission number)
+def transcript_metadata(filename, accounting_index):
+	cur_day = int(filename.split("_day")[-1].split("_")[0])
+	cur_num = int(filename.split("_submission")[-1].split("_")[0])
+	# match exactly that record in the accounting JSON - helper warns if there is an issue with the lookup
+	cur_account = lookup_accounting_record(accounting_index, filename, cur_day, cur_num)
+	if cur_account is None:
+		return (cur_day, np.nan, np.nan, cur_num)
+	return (cur_day, cur_account["local_time_converted"].split(" ")[-1], cur_account["assigned_day_of_week"], cur_num)
+
+# helper to load a redacted transcript CSV (path or file-like object) and clear any rows where there is a missing value
+# (should always be a speakerID, timestamp, and text) - returns None if it could not be read as a transcript CSV
+# the sentence stats script uses the same loading, so fused processing can share one loaded DF between the two
+def load_transcript_csv(source):
+	try:
+		cur_trans = pd.read_csv(source)
+		cur_trans = cur_trans[["speakerID", "timefromstart", "text"]]
+		cur_trans.dropna(how='any',inplace=True)
+	except:
+		return None
+	return cur_trans
+
+# helper that computes the QC values for a single loaded transcript DF (from load_transcript_csv above)
+# returns list of the values for the columns speakerID_count through txt_encoding_type, in header order - all nan if the transcript could not be used
+# the encoding type is checked on the corresponding redacted txt, txt_bytes can be given if its contents are already in memory
+def transcript_qc(filename, cur_trans, txt_name, txt_bytes=None):
+	if cur_trans is None:
+		# ignore bad CSV
+		print("WARNING: " + filename + " appears to be an incorrectly formatted CSV, QC values will be empty")
+		return [np.nan for x in range(16)]
+	# ensure transcript is not empty as well
+	if cur_trans.empty:
+		print("WARNING: " + filename + " is an empty transcript, QC values will be empty")
+		return [np.nan for x in range(16)]
+
+	# now can get actual QC values - starting with basic counts of structure
+	speaker_count = len(set(cur_trans["speakerID"].tolist()))
+	cur_trans_S1 = cur_trans[cur_trans["speakerID"]=="S1"]
+	s1_sens = cur_trans_S1.shape[0]
+	# get actual text from full transcript DF to use in all the QC metrics calc
+	all_sens = [x.lower() for x in cur_trans["text"].tolist()] # case shouldn't matter in what we are doing here
+	total_sens = len(all_sens)
+	words_per = [len(x.split(" ")) for x in all_sens] # define words here as always space delimitted
+	cur_qc = [speaker_count, s1_sens, total_sens, np.nansum(words_per), np.nanmin(words_per), np.nanmax(words_per)]
+
+	# now counting of TranscribeMe special notations
+	inaud_per = [x.count("[inaudible]") for x in all_sens]
+	quest_per = [x.count("?]") for x in all_sens] # assume bracket should never follow a ? unless the entire word is bracketed in
+	redact_per = [x.count("redacted") for x in all_sens] # should be fine to not bother checking for curly brace here anymore, as we are ones who plugged in REDACTED already
+	bracket_per = [x.count("]") - x.count("?]") - x.count("[inaudible]") for x in all_sens]
+	cur_qc.extend([np.nansum(inaud_per), np.nansum(quest_per), np.nansum(bracket_per), np.nansum(redact_per)])
+
+	# now timestamps related metrics
+	# convert all timestamps to a float value indicating number of minutes (see transcript_timestamps for handling of the formats)
+	cur_minutes = timestamp_minutes(cur_trans["timefromstart"].tolist())
+	# get last timestamp - note this will be for the time *before* the last sentence
+	cur_qc.append(round(float(cur_minutes[-1]),3))
+	# timestamp spacing features in seconds, overall and per word of the earlier sentence
+	differences_list, weighted_list = timestamp_gaps(cur_minutes, words_per)
+	if np.isnan(differences_list).all():
+		# current transcript is of minimal length (1 sentence), so no valid timestamp differences, use nan
+		cur_qc.extend([np.nan, np.nan, np.nan, np.nan])
+	else:
+		# use round so values are reasonably viewable on DPDash
+		cur_qc.extend([round(np.nanmin(differences_list),3), round(np.nanmax(differences_list),3), round(np.nanmin(weighted_list),3), round(np.nanmax(weighted_list),3)])
+
+	# finally just get the transcript text encoding type
+	cur_qc.append(transcript_encoding(filename, txt_name, txt_bytes))
+	return cur_qc
+
+# helper for the encoding type of the redacted txt corresponding to a transcript CSV, txt_bytes can be given if its contents are already in memory
+# note the contents are fully decoded to check UTF-8 - the original check only opened the file in UTF-8 mode, which never failed, so invalid UTF-8 used to be recorded as "UTF-8" rather than nan
+def transcript_encoding(filename, txt_name, txt_bytes=None):
+	if txt_bytes is None:
 		if not os.path.isfile(txt_name):
 			# should not happen in scope of main pipeline
 			# but would be a problem if so as the redacted txts are main thing planned to go to NDA
 			print("WARNING: " + filename + " does not have expected corresponding txt file!")
-			encodings.append(np.nan)
-			continue
-			
+			return np.nan
 		with open(txt_name, 'rb') as fd:
-			ascii_bool = fd.read().isascii()
-		if not ascii_bool:
-			try:
-				ftest = open(txt_name, encoding="utf-8", errors="strict")
-				encodings.append("UTF-8")
-			except:
-				# shouldn't really get to this if going through main pipeline, as non-UTF8 is supposed to be "rejected" earlier than this step
-				print("WARNING: " + filename + " may have an encoding problem!")
-				encodings.append(np.nan)
+			txt_bytes = fd.read()
+	if not txt_bytes.isascii():
+		try:
+			txt_bytes.decode("utf-8")
+			return "UTF-8"
+		except:
+			# shouldn't really get to this if going through main pipeline, as non-UTF8 is supposed to be "rejected" earlier than this step
+			print("WARNING: " + filename + " may have an encoding problem!")
+			return np.nan
+	return "ASCII"
+
+# batch version of transcript_qc for a list of loaded transcript DFs, returning the list of QC values for each (in the same order)
+# all of the transcripts are stacked into one frame tagged by transcript, so the per sentence counts are vectorized string operations and the per transcript stats one groupby
+# the values are the same as transcript_qc gives one at a time - transcripts that could make it behave differently (e.g. non-string text)
+# are just passed to transcript_qc individually instead, as are ones that failed to load or are empty so their warnings are printed as usual
+def batch_transcript_qc(filenames, transcripts, txt_names, txt_bytes_list=None):
+	if txt_bytes_list is None:
+		txt_bytes_list = [None for x in filenames]
+	qc_rows = [None for x in filenames]
+	batch_frames = []
+	for i,cur_trans in enumerate(transcripts):
+		if not batch_qc_ready(cur_trans):
+			qc_rows[i] = transcript_qc(filenames[i], cur_trans, txt_names[i], txt_bytes=txt_bytes_list[i])
+			continue
+		batch_frames.append(cur_trans[["speakerID", "timefromstart", "text"]].assign(transcript_index=i))
+	if len(batch_frames) == 0:
+		return qc_rows
+
+	batch_df = pd.concat(batch_frames, ignore_index=True)
+	# case shouldn't matter in what we are doing here
+	all_sens = batch_df["text"].str.lower()
+	sen_stats = pd.DataFrame({"transcript_index": batch_df["transcript_index"]})
+	sen_stats["is_S1"] = batch_df["speakerID"] == "S1"
+	sen_stats["words"] = all_sens.str.count(" ") + 1 # define words here as always space delimitted
+	# counting of TranscribeMe special notations - note str.count takes a regex, so the notations are escaped
+	sen_stats["inaudible"] = all_sens.str.count(re.escape("[inaudible]"))
+	sen_stats["questionable"] = all_sens.str.count(re.escape("?]")) # assume bracket should never follow a ? unless the entire word is bracketed in
+	sen_stats["redacted"] = all_sens.str.count("redacted")
+	sen_stats["bracketed"] = all_sens.str.count(re.escape("]")) - sen_stats["questionable"] - sen_stats["inaudible"]
+
+	# timestamps converted to minutes and then spacing to the next sentence within the same transcript, exactly as transcript_qc does
+	cur_minutes = timestamp_minutes(batch_df["timefromstart"].tolist())
+	sen_stats["spaces"], sen_stats["spaces_per_word"] = timestamp_gaps(cur_minutes, sen_stats["words"].to_numpy(), groups=batch_df["transcript_index"].to_numpy())
+	# last timestamp of each transcript taken directly, as the groupby would skip a nan one
+	transcript_index = batch_df["transcript_index"].to_numpy()
+	final_minutes = cur_minutes[np.append(transcript_index[1:] != transcript_index[:-1], True)]
+
+	grouped = sen_stats.groupby("transcript_index", sort=False)
+	speaker_counts = batch_df.groupby("transcript_index", sort=False)["speakerID"].nunique()
+	group_stats = grouped.agg(S1_sentence_count=("is_S1", "sum"), total_sentence_count=("words", "size"), word_count=("words", "sum"),
+							  min_words=("words", "min"), max_words=("words", "max"), inaudible_count=("inaudible", "sum"),
+							  questionable_count=("questionable", "sum"), bracketed_count=("bracketed", "sum"), redacted_count=("redacted", "sum"),
+							  min_space=("spaces", "min"), max_space=("spaces", "max"),
+							  min_space_ratio=("spaces_per_word", "min"), max_space_ratio=("spaces_per_word", "max"))
+	group_stats["speakerID_count"] = speaker_counts
+	group_stats["final_minutes"] = final_minutes # groups are in order of first appearance, same as the transcripts
+
+	for i,stats in zip(group_stats.index.tolist(), group_stats.to_dict("records")):
+		cur_qc = [int(stats["speakerID_count"]), int(stats["S1_sentence_count"]), int(stats["total_sentence_count"]), np.int64(stats["word_count"]),
+				  np.int64(stats["min_words"]), np.int64(stats["max_words"]), np.int64(stats["inaudible_count"]), np.int64(stats["questionable_count"]),
+				  np.int64(stats["bracketed_count"]), np.int64(stats["redacted_count"]), round(float(stats["final_minutes"]),3)]
+		if np.isnan(stats["min_space"]):
+			# transcript is of minimal length (1 sentence), so no valid timestamp differences
+			cur_qc.extend([np.nan, np.nan, np.nan, np.nan])
 		else:
-			encodings.append("ASCII")
+			# rounded from numpy floats, as transcript_qc does
+			cur_qc.extend([round(np.float64(stats[x]),3) for x in ["min_space", "max_space", "min_space_ratio", "max_space_ratio"]])
+		cur_qc.append(transcript_encoding(filenames[i], txt_names[i], txt_bytes_list[i]))
+		qc_rows[i] = cur_qc
+	return qc_rows
+
+# helper that checks whether a loaded transcript can go through the batch QC
+# speaker IDs and text need to be strings, as then the vectorized string operations give the exact values of the python ones in transcript_qc
+def batch_qc_ready(cur_trans):
+	if cur_trans is None or cur_trans.empty:
+		return False
+	for col in ["speakerID", "text"]:
+		if pd.api.types.infer_dtype(cur_trans[col], skipna=False) != "string":
+			return False
+	return True
 
+# helper for putting together the new rows of the transcript QC CSV
+# values should be the lists for each column from day through redacted_csv_filename, skipping site and subject (which are filled in here)
+def build_transcript_qc_csv(site, subject, values):
+	# specify column headers that will be used for every CSV
+	# make it DPDash formatted, but will leave reftime columns blank. others will look up
+	headers=["reftime","day","timeofday","weekday","site","subject","daily_submission_number",
+			 "speakerID_count","S1_sentence_count","total_sentence_count","word_count",
+			 "min_words_in_sen","max_words_in_sen","inaudible_count","questionable_count",
+			 "other_bracketed_notation_count","redacted_count",
+			 "final_timestamp_minutes","min_timestamp_space_seconds","max_timestamp_space_seconds",
+			 "min_timestamp_space_per_word","max_timestamp_space_per_word",
+			 "txt_encoding_type","redacted_csv_filename","date_transcript_processed"]
 	# get pt and site lists, and also a list of nans for reftime column (values optional but column must exist per DPDash)
-	sites = [site for x in range(len(fnames))]
-	subjects = [subject for x in range(len(fnames))]
-	ref_times = [np.nan for x in range(len(fnames))]
+	n_rows = len(values[0])
+	sites = [site for x in range(n_rows)]
+	subjects = [subject for x in range(n_rows)]
+	ref_times = [np.nan for x in range(n_rows)]
 	cur_date = datetime.date.today().strftime("%Y-%m-%d")
-	trans_dates = [cur_date for x in range(len(fnames))]
+	trans_dates = [cur_date for x in range(n_rows)]
+	values = [ref_times, values[0], values[1], values[2], sites, subjects] + values[3:] + [trans_dates]
 
 	# construct current CSV
-	values = [ref_times, site_days, times, week_days, sites, subjects, sub_nums, speaker_counts, s1_sens, 
-			  total_sens, words, min_words, max_words, inauds, questions, brackets, redactions, fin_times, 
-			  min_spaces, max_spaces, min_spaces_ratio, max_spaces_ratio, encodings, fnames, trans_dates]
 	new_csv = pd.DataFrame()
 	for i in range(len(headers)):
 		h = headers[i]
 		vals = values[i]
 		new_csv[h] = vals
-
-	# now can concat with prior records, where applicable
-	if len(prev_trans_list) == 0:
-		final_save = new_csv
-	else:
-		final_save = pd.concat([old_df,new_csv]).reset_index(drop=True)
-	# specify main save path under PROTECTED here
-	save_path = os.path.join(data_root,"PROTECTED", site, "processed", subject, "phone", "audio_journals", "dpdash_source_csvs", site + "_" + subject + "_" + "diaryTranscriptQC.csv")
-	final_save.to_csv(save_path,index=False)
-
-	# finally also deal with saving copy to be pushed to predict under GENERAL, matching expectations for DPDash
-	final_save.sort_values(by="day",inplace=True) # should already be sorted but ensure before grabbing day number for name
-	start_day = final_save["day"].dropna().tolist()[0]
-	end_day = final_save["day"].dropna().tolist()[-1]
-	# also drop any duplicates in case transcript got processed a second time - shouldn't happen via pipeline though!
-	final_save.drop_duplicates(subset=["day", "timeofday"],inplace=True)
-	final_save.drop(columns=["date_transcript_processed"],inplace=True)
-	dpdash_name = site[-2:] + "-" + subject + "-diaryTranscriptQC-day" + str(start_day) + "to" + str(end_day) + ".csv"
-	dpdash_folder = os.path.join(data_root, "GENERAL", site, "processed", subject, "phone", "audio_journals")
-	try:
-		os.chdir(dpdash_folder)
-	except:
-		print("WARNING: correct folder structure does not exist for push of DPDash CSV to predict server, please fix for future monitoring updates")
-		return
-	for old_dpdash in glob.glob(site[-2:] + "-" + subject + "-diaryTranscriptQC-day*.csv"):
-		os.remove(old_dpdash)
-	final_save.to_csv(dpdash_name,index=False)
+	return new_csv
 
 if __name__ == '__main__':
 	# Map command line arguments to function arguments.
-	transcript_diary_qc(sys.argv[1], sys.argv[2], sys.argv[3])
+	# with just data root and site, runs QC for the new transcripts of every subject of the site in one batch
+	if len(sys.argv) > 3:
+		transcript_diary_qc(sys.argv[1], sys.argv[2], sys.argv[3])
+	else:
+		site_transcript_diary_qc(sys.argv[1], sys.argv[2])
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import re
+import sys
+import time
+import numpy as np
+
+# disfluency counting for the sentence stats step, based on known TranscribeMe verbatim notation
+# each sentence is split into words just once, with everything counted on the words from that single pass,
+# plus one combined compiled pattern for the markers that are matched within the full sentence text
+# counts are exactly the same as the original separate per marker calculations, which are kept in the benchmark below for reference
+
+# nonverbal edits are uh/um style filler sounds, matched within each word so that e.g. lithium is not included
+NONVERBAL_FILLER = re.compile("[^a-z]u+[hm]+[^a-z]")
+# verbal edits are filler phrases, counted wherever they appear in the (lower case) sentence text
+# might consider expanding this list at some point to include other verbal fillers? but these are main ones used
+# (note entries here and the restart marker should not be able to overlap one another, or the combined pattern would count differently than counting each separately)
+VERBAL_FILLERS = ["like,", "you know,", "i mean,"]
+# double dash is an estimate of sentence restarts, could also be long mid-sentence pause per TranscribeMe notation
+RESTART_MARKER = "--"
+
+# returns the lists of nonverbal edits, verbal edits, stutter repeats, word repeats, and restarts counts for the input list of lower case sentences
+# stutter repeats are repetition of characters after a single dash within a word, word repeats are consecutive words that are the same when ignoring commas
+def sentence_disfluencies(all_sens, nonverbal_filler=NONVERBAL_FILLER, verbal_fillers=VERBAL_FILLERS, restart_marker=RESTART_MARKER):
+	phrase_markers = re.compile("|".join([re.escape(x) for x in [restart_marker] + verbal_fillers]))
+	# the same words come up over and over in speech, so the per word results are only worked out once per transcript
+	word_info = {}
+	nonverbal_per = []
+	verbal_per = []
+	stutter_per = []
+	repeat_per = []
+	restart_per = []
+	for sen in all_sens:
+		phrase_matches = phrase_markers.findall(sen)
+		restarts = phrase_matches.count(restart_marker)
+		restart_per.append(restarts)
+		verbal_per.append(len(phrase_matches) - restarts)
+
+		nonverbal = 0
+		stutters = 0
+		repeats = 0
+		prev_word = None
+		words = sen.split(" ")
+		for word in words:
+			cur_info = word_info.get(word)
+			if cur_info is None:
+				# words are padded with a space on either side, so the filler regex can still match against non-alphabet chars at the start and end of a word
+				dash_split = word.split("-")
+				cur_info = (len(nonverbal_filler.findall(" " + word + " ")), 1 if len(dash_split) > 1 and dash_split[1].startswith(dash_split[0]) else 0, word.replace(",",""))
+				word_info[word] = cur_info
+			nonverbal = nonverbal + cur_info[0]
+			stutters = stutters + cur_info[1]
+			if cur_info[2] == prev_word:
+				repeats = repeats + 1
+			prev_word = cur_info[2]
+		if len(words) == 1:
+			# the original summed an empty list of word pairs with np.nansum here, giving a float 0 (which makes the whole column float), so keep that
+			repeats = 0.0
+		nonverbal_per.append(nonverbal)
+		stutter_per.append(stutters)
+		repeat_per.append(repeats)
+
+	return nonverbal_per, verbal_per, stutter_per, repeat_per, restart_per
+
+# the original per marker calculations, only used to check and time sentence_disfluencies against
+def reference_disfluencies(all_sens):
+	reg_ex_list_hack = [" " + "  ".join(x.split(" ")) + " " for x in all_sens]
+	uhum_per = [len(re.findall("[^a-z]u+[hm]+[^a-z]", x)) for x in reg_ex_list_hack]
+	verbal_per = [x.count("like,") + x.count("you know,") + x.count("i mean,") for x in all_sens]
+	dash_repetition = [np.nansum([1 if len(y.split("-")) > 1 and len(y.split("-")[0]) <= len(y.split("-")[1]) and y.split("-")[0]==y.split("-")[1][0:len(y.split("-")[0])] else 0 for y in x.split(" ")]) for x in all_sens]
+	word_repetition = [np.nansum([1 if x.split(" ")[y-1].replace(",","")==x.split(" ")[y].replace(",","") else 0 for y in range(1,len(x.split(" ")))]) for x in all_sens]
+	ddash_per = [x.count("--") for x in all_sens]
+	return uhum_per, verbal_per, dash_repetition, word_repetition, ddash_per
+
+if __name__ == '__main__':
+	# quick benchmark of the disfluency counting on a long synthetic transcript, versus the original per marker calculations
+	# usage: python transcript_disfluencies.py [number of sentences, default 20000] [words per sentence, default 30]
+	try:
+		num_sens = int(sys.argv[1])
+	except:
+		num_sens = 20000
+	try:
+		num_words = int(sys.argv[2])
+	except:
+		num_words = 30
+	rng = np.random.default_rng(0)
+	vocab = np.array(["i", "mean,", "you", "know,", "like,", "uh", "um,", "the", "the,", "wh-what", "s-s-so", "lithium", "--", "and--", "[inaudible]", "umm...", "really", "day", "today", "redacted"])
+	all_sens = [" ".join(rng.choice(vocab, rng.integers(1, 2*num_words))) for x in range(num_sens)]
+
+	start_time = time.time()
+	reference_counts = reference_disfluencies(all_sens)
+	print("original per marker counting: " + str(round(time.time() - start_time, 3)) + " seconds")
+	start_time = time.time()
+	new_counts = sentence_disfluencies(all_sens)
+	print("single pass counting: " + str(round(time.time() - start_time, 3)) + " seconds")
+	print("identical counts: " + str(all([list(x) == list(y) for x,y in zip(reference_counts, new_counts)])))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import numpy as np
+
+# shared helpers for the timefromstart column of the redacted transcript CSVs, used by both transcript QC and sentence stats
+# TranscribeMe timestamps are H:MM:SS.mmm, though the hours are sometimes left off (MM:SS.mmm), and ms resolution is not always provided
+# whole columns are converted at once, with the format decided separately for each row - so a transcript that mixes the two formats still gets correct minutes throughout
+# (previously the hours format was tried for an entire transcript and it fell back to the minutes format for every row if any one timestamp lacked hours)
+
+# convert a column (or list) of timestamp strings to a float array of the number of minutes from the start of the recording
+# uses the same float operations per value as the original per sentence conversion, so results are identical for well formatted timestamps
+# anything that can not be converted in either format (e.g. a missing timestamp) becomes nan
+def timestamp_minutes(timestamps):
+	timestamps = [x if isinstance(x, str) else "" for x in timestamps]
+	colon_counts = np.array([x.count(":") for x in timestamps], dtype=int)
+	cur_minutes = np.full(len(timestamps), np.nan)
+	# two colons means the hours are present, one that they are not
+	for num_colons in [2, 1]:
+		rows = np.flatnonzero(colon_counts == num_colons)
+		if rows.size == 0:
+			continue
+		part_vals = timestamp_parts([timestamps[i] for i in rows], num_colons + 1)
+		if num_colons == 2:
+			cur_minutes[rows] = part_vals[:,0]*60.0 + part_vals[:,1] + part_vals[:,2]/60.0
+		else:
+			cur_minutes[rows] = part_vals[:,0] + part_vals[:,1]/60.0
+	return cur_minutes
+
+# helper to convert timestamps that all have the same number of parts into a float array with one column per part
+# all parts are joined for a single conversion, only falling back to converting each timestamp on its own (with nan for a bad one) if that fails
+# float() of a digit string is exactly float() of its int(), so this matches the original conversion
+def timestamp_parts(timestamps, num_parts):
+	try:
+		return np.array(":".join(timestamps).split(":"), dtype=float).reshape(-1, num_parts)
+	except ValueError:
+		part_vals = np.full((len(timestamps), num_parts), np.nan)
+		for i,x in enumerate(timestamps):
+			try:
+				part_vals[i] = [float(y) for y in x.split(":")]
+			except ValueError:
+				pass
+		return part_vals
+
+# get the timestamp spacing in seconds from each sentence to the next, along with that spacing divided by the word count of the earlier sentence
+# returns two arrays the same length as the input minutes, with nan for the final sentence (which has no next timestamp)
+# groups can be given (e.g. a transcript index) when the input stacks several transcripts, so that spacing is never taken across two different transcripts
+# - each transcript's sentences are expected to be contiguous, and the final sentence of each gets nan
+def timestamp_gaps(cur_minutes, words_per, groups=None):
+	cur_seconds = np.asarray(cur_minutes) * 60.0
+	gaps = np.append(cur_seconds[1:] - cur_seconds[:-1], np.nan)
+	if groups is not None and len(gaps) > 0:
+		groups = np.asarray(groups)
+		gaps[np.append(groups[1:] != groups[:-1], True)] = np.nan
+	return gaps, gaps / np.asarray(words_per).astype(float)
+
+# micro-benchmark comparing the shared conversion against the per sentence list comprehension it replaced, on a long synthetic transcript
+# usage: python transcript_timestamps.py [number_of_sentences]
+def benchmark_timestamps(num_sentences=200000):
+	seconds = np.cumsum(np.random.default_rng(0).uniform(0.5, 20.0, num_sentences))
+	cur_times = [str(int(x // 3600)) + ":" + str(int(x // 60 % 60)).zfill(2) + ":" + ("%06.3f" % (x % 60)) for x in seconds]
+	words_per = [10 for x in cur_times]
+
+	start_time = time.perf_counter()
+	old_minutes = [float(int(x.split(":")[0]))*60.0 + float(int(x.split(":")[1])) + float(x.split(":")[2])/60.0 for x in cur_times]
+	old_seconds = [m * 60.0 for m in old_minutes]
+	old_gaps = [j - i for i, j in zip(old_seconds[: -1], old_seconds[1 :])]
+	old_weighted = [j/float(i) for i, j in zip(words_per[: -1], old_gaps)]
+	old_time = time.perf_counter() - start_time
+
+	start_time = time.perf_counter()
+	new_minutes = timestamp_minutes(cur_times)
+	new_gaps, new_weighted = timestamp_gaps(new_minutes, words_per)
+	new_time = time.perf_counter() - start_time
+
+	matches = np.array_equal(old_minutes, new_minutes) and np.array_equal(old_gaps, new_gaps[:-1]) and np.array_equal(old_weighted, new_weighted[:-1])
+	print("Timestamp conversion and spacing for " + str(num_sentences) + " sentences:")
+	print("per sentence list comprehensions: " + str(round(old_time, 3)) + " seconds")
+	print("shared vectorized conversion: " + str(round(new_time, 3)) + " seconds")
+	print("identical results: " + str(matches))
+
+if __name__ == '__main__':
+	# Map command line arguments to function arguments.
+	if len(sys.argv) > 1:
+		benchmark_timestamps(int(sys.argv[1]))
+	else:
+		benchmark_timestamps()
@@ -167,7 +167,10 @@ for p in *; do
 	fi
 	# raw file tracking system folder will obviously exist if processing has happened for a diary
 	# - but shouldn't have anything left with TODO, and existence should check out
-	if [[ -d raw_file_tracking_system ]]; then
+	# (for subjects on the diary ledger the same checks are run against the ledger, logging the same issues, along with a printout of any diaries stuck in one state)
+	if [[ -f diary_ledger.sqlite3 ]]; then
+		python "$func_root"/diary_ledger.py "$data_root" "$site" "$p" issues "$cur_date"
+	elif [[ -d raw_file_tracking_system ]]; then
 		cd raw_file_tracking_system
 		for file in TODO*.txt; do
 			if [[ ! -e ${file} ]]; then
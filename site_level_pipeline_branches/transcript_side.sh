@@ -19,6 +19,18 @@ repo_root="$pipelines_root"/..
 
 # running config file will set up necessary environment variables
 source "$config_path"
+# optional performance settings do not need to be in the config file, fall back to defaults when they are missing
+if [[ -z $fused_transcript_processing ]]; then
+	fused_transcript_processing="N" # if "Y", each new transcript is redacted, converted, QCed, and given sentence stats in one pass
+fi
+if [[ -z $pooled_sftp_session ]]; then
+	pooled_sftp_session="N" # if "Y", TranscribeMe pulls for all subjects happen up front over one SFTP session instead of one per subject
+fi
+if [[ -z $subject_watermarks ]]; then
+	subject_watermarks="N" # if "Y", subjects with no new transcripts since their last completed run (and nothing to pull) are skipped before any python is started
+fi
+# helpers for the change detection watermarks
+source "$func_root"/subject_watermark.sh
 
 # make directory for logs if needed
 if [[ ! -d ${repo_root}/logs ]]; then
@@ -79,6 +91,15 @@ echo "Current time: ${now}"
 echo ""
                                                
 cd "$data_root"/PROTECTED/"$site"/processed
+if [[ $pooled_sftp_session == "Y" ]]; then
+	# the keyword site in place of a subject ID makes the pull script go through every subject with pending audio, over one SFTP session
+	echo "Starting TranscribeMe pull attempt for all subjects with pending audios, over one SFTP session"
+	python "$func_root"/journal_transcribeme_sftp_pull.py "$data_root" "$site" site "$transcribeme_username" "$transcribeme_password" "$transcription_language"
+	echo "TranscribeMe SFTP pull attempts complete for site ${site}"
+	now=$(date +"%T")
+	echo "Current time: ${now}"
+	echo ""
+fi
 echo "Looping through available subject IDs"
 echo ""
 for p in *; do
@@ -90,6 +111,19 @@ for p in *; do
 		echo ""
 		continue
 	fi
+	# with watermarks on, also skip any subject whose pending audio and transcripts are unchanged since its last completed run
+	# - unless there is still audio pending that has not already been checked on by the pooled pull above, as new transcripts for it could be waiting on TranscribeMe's server
+	if [[ $subject_watermarks == "Y" ]]; then
+		transcript_watermark_path="$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/file_accounting_details/"$site"_"$p"_transcriptSideWatermark.txt
+		transcript_watermark_inputs=("$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/pending_audio "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/transcripts)
+		if [ -z "$(ls -A "$p"/phone/audio_journals/pending_audio)" ] || [[ $pooled_sftp_session == "Y" ]]; then
+			if watermark_unchanged "$transcript_watermark_path" "$(subject_watermark "${transcript_watermark_inputs[@]}")"; then
+				echo "${p} has no changes to pending audio or transcripts since its last completed run, continuing to next subject"
+				echo ""
+				continue
+			fi
+		fi
+	fi
 	cd "$p"/phone/audio_journals
 
 	# set up folder for pulled transcripts if not there already
@@ -103,8 +137,10 @@ for p in *; do
 		mkdir completed_audio
 	fi
 
-	# when pending audios exist within pending_audio folder, then need to run TranscribeMe pull script
-	if [ ! -z "$(ls -A pending_audio)" ]; then
+	# when pending audios exist within pending_audio folder, then need to run TranscribeMe pull script (unless already done for the whole site above)
+	if [ ! -z "$(ls -A pending_audio)" ] && [[ $pooled_sftp_session == "Y" ]]; then
+		echo "TranscribeMe pull for subject ${p} was already attempted by the pooled SFTP session, some audio journals remain pending transcription"
+	elif [ ! -z "$(ls -A pending_audio)" ]; then
 		echo "Starting TranscribeMe pull attempt for subject ${p} as pending audios were detected"
 		now=$(date +"%T")
 		echo "Current time: ${now}"
@@ -125,125 +161,80 @@ for p in *; do
 		echo "${p} has no transcript text files available yet, continuing to next subject"
 		echo ""
 		cd "$data_root"/PROTECTED/"$site"/processed # back out of folder before skipping over pt
+		# (with no transcripts at all there is nothing that could have failed, so the watermark can always be saved here)
+		if [[ $subject_watermarks == "Y" ]]; then
+			save_watermark "$transcript_watermark_path" "$(subject_watermark "${transcript_watermark_inputs[@]}")"
+		fi
 		continue
 	fi
 
-	# make redacted copies of the transcript text files for any not done yet
-	# maintain in PROTECTED processed for file safety reasons (small size anyway)
-	# but will copy redacted versions to GENERAL downstream
-	echo "Making redacted copies of any new transcripts for ${p}, using TranscribeMe's {PII} marking convention"
-	now=$(date +"%T")
-	echo "Current time: ${now}"
-
-	if [[ ! -d redacted_copies ]]; then
-		mkdir redacted_copies
-		# in addition to going under redacted_copies, they will be named [name]_REDACTED.txt
-		# - for later copy to GENERAL transcripts folder
-	fi
-	# note this python function runs on subject level to make redacted copy for any that don't have it yet 
-	# - unlike the per file version used for AMPSCZ interview pipeline
-	python "$func_root"/phone_transcript_redaction.py "$data_root" "$site" "$p"
-
-	# csv conversion of newly redacted transcripts
-	echo "Converting any new redacted transcript texts for ${p} to CSV"
-	now=$(date +"%T")
-	echo "Current time: ${now}"
+	if [[ $fused_transcript_processing == "Y" ]]; then
+		# fused version reads each new transcript once, producing the same redacted copy, CSV, QC rows, and sentence stats as the separate steps below
+		echo "Processing any new transcripts for ${p} - redaction using TranscribeMe's {PII} marking convention, CSV conversion, QC, and per sentence stats"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
 
-	cd redacted_copies
-	if [[ ! -d csv ]]; then
-		mkdir csv
-	fi
-	
-	# just do CSV part within the pipeline wrapper here
-	for file in *.txt; do	
-		name=$(echo "$file" | awk -F '.txt' '{print $1}')
-		[[ -e csv/"${name}".csv ]] && continue # if already have a formatted copy skip
-		echo "New transcript to convert detected: ${file}"
-		
-		# begin conversion for this applicable file
-		# check encoding type - and force at least UTF8
-		typecheck=$(file -n "$file" | grep ASCII | wc -l)
-		if [[ $typecheck == 0 ]]; then
-			# ASCII is subset of UTF8, so now need to check UTF8 since we know it isn't ASCII
-			iconv -f utf8 "$file" -t utf8 -o /dev/null
-			if [ $? = 0 ]; then # if exit code of above command is 0, the file is UTF8, otherwise not
-				# if it's not ASCII but is UTF8, just make a note
-				echo "(note transcript is not ASCII encoded, but is UTF-8)"
-			else
-				# if it isn't UTF8 we have a problem, completely skip it 
-				echo "WARNING: found transcript that is not UTF-8 encoded, this may cause issues with the automatic redaction! It will be completely skipped for now, please review in main transcripts folder manually"
-				# now remove the file from redacted copies to be safe in case marked PII was not removed due to encoding discrepancy
-				rm "$file" 
-				# then skip to the next transcript
-				continue 
-			fi			
+		if [[ ! -d redacted_copies ]]; then
+			mkdir redacted_copies
+		fi
+		if [[ ! -d redacted_copies/csv ]]; then
+			mkdir redacted_copies/csv
+		fi
+		if [[ ! -d redacted_csvs_with_stats ]]; then
+			mkdir redacted_csvs_with_stats
 		fi
-		# now good to continue
 
-		# substitute tabs with single space for easier parsing (returned by TranscribeMe we see a mix)
-		# this file will be kept only temporarily
-		sed 's/\t/ /g' "$file" > "$name"_noTABS.txt
+		python "$func_root"/journal_transcript_fused_processing.py "$data_root" "$site" "$p"
+	else
+		# make redacted copies of the transcript text files for any not done yet
+		# maintain in PROTECTED processed for file safety reasons (small size anyway)
+		# but will copy redacted versions to GENERAL downstream
+		echo "Making redacted copies of any new transcripts for ${p}, using TranscribeMe's {PII} marking convention"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
 
-		# prep CSV with column headers
-		# (no reason to have DPDash formatting for a transcript CSV, so I choose these columns)
-		# (some of them are just for ease of future concat/merge operations)
-		echo "site,subject,filename,speakerID,timefromstart,text" > csv/"$name".csv
+		if [[ ! -d redacted_copies ]]; then
+			mkdir redacted_copies
+			# in addition to going under redacted_copies, they will be named [name]_REDACTED.txt
+			# - for later copy to GENERAL transcripts folder
+		fi
+		# note this python function runs on subject level to make redacted copy for any that don't have it yet 
+		# - unlike the per file version used for AMPSCZ interview pipeline
+		python "$func_root"/phone_transcript_redaction.py "$data_root" "$site" "$p"
 
-		# check speaker ID number format, as TranscribeMe has used a few different delimiters in the past
-		# (this does assume they are consistent with one format throughout a single file though, which should be fine)
-		subcheck=$(cat "$file" | grep S1: | wc -l) # speaker ID S1 is guaranteed to appear at least once as it is the initial ID they assign 
+		# csv conversion of newly redacted transcripts
+		echo "Converting any new redacted transcript texts for ${p} to CSV"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
 
-		# read in transcript line by line to convert to CSV rows
-		while IFS='' read -r line || [[ -n "$line" ]]; do
-			if [[ $subcheck == 0 ]]; then # speaker ID always comes first, is sometimes followed by a colon
-				sub=$(echo "$line" | awk -F ' ' '{print $1}') 
-			else
-				sub=$(echo "$line" | awk -F ': ' '{print $1}')
-			fi
-			time=$(echo "$line" | awk -F ' ' '{print $2}') # timestamp always comes second
-			text=$(echo "$line" | awk -F '[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9] ' '{print $2}') # get text based on what comes after timestamp in expected format (MM:SS.milliseconds)
-			# the above still works fine if hours are also provided, it just hinges on full minute digits and millisecond resolution being provided throughout the transcript
-			if [[ -z "$text" ]]; then
-				# text variable could end up empty because ms resolution not provided, so first try a different way of splitting, looking for space after the SS part of the timestamp
-				text=$(echo "$line" | awk -F '[0-9][0-9]:[0-9][0-9] ' '{print $2}')
-				if [[ -z "$text" ]]; then
-					# if text is still empty safe to assume this is an empty line, which do occur - skip it!
-					continue
-				fi
-			fi
-			text=$(echo "$text" | tr -d '"') # remove extra characters at end of each sentence
-			text=$(echo "$text" | tr -d '\r') # remove extra characters at end of each sentence
-			echo "${site},${p},${name},${sub},${time},\"${text}\"" >> csv/"$name".csv # add the line to CSV
-		done < "$name"_noTABS.txt
+		# converts every new redacted transcript in one python process, matching the CSV format the original bash line by line loop produced
+		# (the python script also takes care of the encoding check - transcripts that are not UTF-8 are removed from redacted_copies and skipped)
+		python "$func_root"/transcript_csv_conversion.py "$data_root" "$site" "$p"
 
-		# remove the temporary file
-		rm "$name"_noTABS.txt
-	done
+		echo "New CSV conversion for ${p} done"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
 
-	echo "New CSV conversion for ${p} done"
-	now=$(date +"%T")
-	echo "Current time: ${now}"
-	cd .. # return to main transcripts folder
+		# now proceed with transcript QC 
+		# - no folders to make for this actually as can use what was already created for audio side
+		# (fair to assume audio side must have been run to get to this point for subject anyway)
+		echo "Updating transcript QC for subject ${p}"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
 
-	# now proceed with transcript QC 
-	# - no folders to make for this actually as can use what was already created for audio side
-	# (fair to assume audio side must have been run to get to this point for subject anyway)
-	echo "Updating transcript QC for subject ${p}"
-	now=$(date +"%T")
-	echo "Current time: ${now}"
+		python "$func_root"/transcript_diary_qc.py "$data_root" "$site" "$p"
 
-	python "$func_root"/transcript_diary_qc.py "$data_root" "$site" "$p"
+		echo "Transcript QC for new ${p} data done - moving on to final early processing step (basic per sentence stats for expanded transcript CSVs)"
+		now=$(date +"%T")
+		echo "Current time: ${now}"
 
-	echo "Transcript QC for new ${p} data done - moving on to final early processing step (basic per sentence stats for expanded transcript CSVs)"
-	now=$(date +"%T")
-	echo "Current time: ${now}"
+		if [[ ! -d redacted_csvs_with_stats ]]; then
+			mkdir redacted_csvs_with_stats
+		fi
 
-	if [[ ! -d redacted_csvs_with_stats ]]; then
-		mkdir redacted_csvs_with_stats
+		python "$func_root"/phone_transcript_sentence_stats.py "$data_root" "$site" "$p"
 	fi
 
-	python "$func_root"/phone_transcript_sentence_stats.py "$data_root" "$site" "$p"
-
 	echo "Transcript sentences check for new ${p} data done - will now do final file management, sending copies of new shareable transcripts to GENERAL side"
 	now=$(date +"%T")
 	echo "Current time: ${now}"
@@ -276,6 +267,11 @@ for p in *; do
 	echo "Updated transfers done for ${p}"
 	
 	cd "$data_root"/PROTECTED/"$site"/processed # at end of loop go back to start spot
+	# the watermark is taken after this run's pull and processing, as the pull itself is what adds new transcripts
+	# - and only saved once every transcript has its redacted copy and CSV, so that any that failed are still retried on the next run
+	if [[ $subject_watermarks == "Y" ]] && [[ $(unfinished_transcripts "$data_root"/PROTECTED/"$site"/processed/"$p"/phone/audio_journals/transcripts) == 0 ]]; then
+		save_watermark "$transcript_watermark_path" "$(subject_watermark "${transcript_watermark_inputs[@]}")"
+	fi
 	echo "${p} has completed new diary transcript processing!"
 	now=$(date +"%T")
 	echo "Current time: ${now}"